@@ -1,5 +1,195 @@
 import pypeliner
+import zlib
+
+gzip_magic = b'\x1f\x8b'
 
 
 def gunzip(gzipped_file):
     pypeliner.commandline.execute('gunzip', gzipped_file)
+
+
+def is_gzip_file(file_name):
+    """ Check if a file is gzip compressed from its first bytes.
+    """
+    with open(file_name, 'rb') as fh:
+        return fh.read(2) == gzip_magic
+
+
+def copy_gzip_file(in_fh, out_fh, skip_bytes=0, buffer_size=2 ** 20):
+    """ Copy a gzip file to an open file, skipping bytes at the start of the uncompressed data.
+
+    :param in_fh: Gzip file opened for reading in binary mode.
+
+    :param out_fh: File opened for writing in binary mode. Output is appended as gzip members.
+
+    :param skip_bytes: Number of uncompressed bytes to drop from the start of the file.
+
+    Only the members holding skipped bytes are recompressed, and the last of them only if it holds other data. The
+    remaining members are copied as is, so the cost is small when a header was written as its own member.
+
+    Returns the last byte of the uncompressed data written, or an empty string if nothing was written.
+
+    """
+
+    decompressor = None
+
+    compressor = None
+
+    last_byte = b''
+
+    # The member holding the last skipped bytes is read to its end unless it holds other data
+    while (skip_bytes > 0) or ((decompressor is not None) and (not decompressor.eof) and (compressor is None)):
+        if decompressor is None:
+            buf = in_fh.read(buffer_size)
+
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+        elif decompressor.eof:
+            # Skipped bytes continue in the next member
+            buf = decompressor.unused_data or in_fh.read(buffer_size)
+
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+        else:
+            buf = in_fh.read(buffer_size)
+
+        if (not buf) and (skip_bytes > 0):
+            raise Exception('Gzip file ended before {0} bytes were skipped: {1}'.format(skip_bytes, in_fh.name))
+
+        elif not buf:
+            raise Exception('Truncated gzip file: {0}'.format(in_fh.name))
+
+        data = decompressor.decompress(buf)
+
+        num_skipped = min(skip_bytes, len(data))
+
+        skip_bytes -= num_skipped
+
+        data = data[num_skipped:]
+
+        # The rest of the member is recompressed, everything after it is copied as is
+        if (compressor is None) and (len(data) > 0):
+            compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+        if compressor is not None:
+            out_fh.write(compressor.compress(data))
+
+            last_byte = data[-1:] or last_byte
+
+    while (compressor is not None) and (not decompressor.eof):
+        buf = in_fh.read(buffer_size)
+
+        if not buf:
+            raise Exception('Truncated gzip file: {0}'.format(in_fh.name))
+
+        data = decompressor.decompress(buf)
+
+        out_fh.write(compressor.compress(data))
+
+        last_byte = data[-1:] or last_byte
+
+    if compressor is not None:
+        out_fh.write(compressor.flush())
+
+    if decompressor is None:
+        buf = b''
+
+    else:
+        buf = decompressor.unused_data
+
+    # The copied members are decompressed, but not recompressed, to find the last byte of their data
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    in_member = False
+
+    while True:
+        if not buf:
+            buf = in_fh.read(buffer_size)
+
+            if not buf:
+                break
+
+        out_fh.write(buf)
+
+        while len(buf) > 0:
+            if not in_member:
+                buf = buf.lstrip(b'\x00')
+
+                if len(buf) == 0:
+                    break
+
+                in_member = True
+
+            data = decompressor.decompress(buf)
+
+            last_byte = data[-1:] or last_byte
+
+            if decompressor.eof:
+                in_member = False
+
+                buf = decompressor.unused_data
+
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+            else:
+                buf = b''
+
+    if in_member:
+        raise Exception('Truncated gzip file: {0}'.format(in_fh.name))
+
+    return last_byte
+
+
+def check_gzip_file(file_name, buffer_size=2 ** 20):
+    """ Check the CRC and size in the trailer of every member of a gzip file by decompressing it as a stream.
+
+    Raises an Exception if a member is corrupt or the file is truncated. Zero bytes between or after members are
+    ignored, as they are by `gzip.open`.
+
+    Returns the size of the file up to the end of the last member, without any zero padding after it.
+
+    """
+
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    in_member = False
+
+    offset = 0
+
+    data_size = 0
+
+    with open(file_name, 'rb') as fh:
+        for buf in iter(lambda: fh.read(buffer_size), b''):
+            offset += len(buf)
+
+            while len(buf) > 0:
+                if not in_member:
+                    buf = buf.lstrip(b'\x00')
+
+                    if len(buf) == 0:
+                        break
+
+                    in_member = True
+
+                try:
+                    decompressor.decompress(buf)
+
+                except zlib.error as e:
+                    raise Exception('Corrupt gzip file {0}: {1}'.format(file_name, e))
+
+                if decompressor.eof:
+                    in_member = False
+
+                    buf = decompressor.unused_data
+
+                    data_size = offset - len(buf)
+
+                    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+                else:
+                    buf = b''
+
+    if in_member:
+        raise Exception('Truncated gzip file: {0}'.format(file_name))
+
+    return data_size
@@ -1,10 +1,22 @@
+import gzip
 import pandas as pd
 
+from biowrappers.components.io.compression.tasks import copy_gzip_file, is_gzip_file
+
 
 def concatenate_csv(in_filenames, out_filename):
     if isinstance(in_filenames, dict):
         in_filenames = in_filenames.values()
 
+    in_filenames = list(in_filenames)
+
+    compress = out_filename.endswith('.gz.tmp')
+
+    if has_same_header(in_filenames):
+        concatenate_files_with_header(in_filenames, out_filename, compress=compress)
+
+        return
+
     data = []
 
     for in_filename in in_filenames:
@@ -16,8 +28,137 @@ def concatenate_csv(in_filenames, out_filename):
 
     data = pd.concat(data)
 
-    if out_filename.endswith('.gz.tmp'):
+    if compress:
         data.to_csv(out_filename, index=False, compression='gzip')
     else:
         data.to_csv(out_filename, index=False)
 
+
+def write_csv(df, out_file):
+    """ Write a table to CSV without the index, gzip compressed if `out_file` ends with `.gz.tmp`.
+
+    Compressed files have the header in its own gzip member, so `concatenate_csv` can drop it without recompressing
+    the rows.
+
+    """
+    if not out_file.endswith('.gz.tmp'):
+        df.to_csv(out_file, index=False)
+
+        return
+
+    with open(out_file, 'wb') as out_fh:
+        write_gzip_member(out_fh, df.head(0).to_csv(index=False))
+
+        if not df.empty:
+            write_gzip_member(out_fh, df.to_csv(index=False, header=False))
+
+
+def write_gzip_member(out_fh, text):
+    """ Append text to an open binary file as a complete gzip member.
+    """
+    with gzip.GzipFile(fileobj=out_fh, mode='wb') as gzip_fh:
+        gzip_fh.write(text.encode('utf-8'))
+
+
+def read_header(file_name):
+    """ Read the first line of a plain or gzip compressed file, or None if the file is empty.
+    """
+    if is_gzip_file(file_name):
+        fh = gzip.open(file_name, 'rb')
+
+    else:
+        fh = open(file_name, 'rb')
+
+    with fh:
+        header = fh.readline()
+
+    if len(header) == 0:
+        return None
+
+    return header
+
+
+def has_same_header(in_files):
+    """ Check if all non-empty files have the same header line.
+    """
+    headers = set([read_header(x) for x in in_files])
+
+    headers.discard(None)
+
+    return len(headers) <= 1
+
+
+def concatenate_files_with_header(in_files, out_file, compress=False):
+    """ Concatenate delimited files with the same header line without parsing them.
+
+    :param in_files: List of plain or gzip compressed files. Empty files are skipped.
+
+    :param out_file: Path where the concatenated file will be written.
+
+    :param compress: Whether to write the output as gzip.
+
+    The header of the first non-empty file is kept and dropped from the others. When both input and output are gzip
+    compressed the members are copied as is, and only the member holding the header is recompressed. A newline is added
+    after files which do not end with one, so their last row is not joined to the next.
+
+    """
+
+    write_header = True
+
+    with open(out_file, 'wb') as out_fh:
+        for in_file in in_files:
+            header = read_header(in_file)
+
+            if header is None:
+                continue
+
+            if write_header:
+                skip_bytes = 0
+
+            else:
+                skip_bytes = len(header)
+
+            if compress and is_gzip_file(in_file):
+                with open(in_file, 'rb') as in_fh:
+                    last_byte = copy_gzip_file(in_fh, out_fh, skip_bytes=skip_bytes)
+
+            else:
+                last_byte = _copy_file(in_file, out_fh, skip_bytes=skip_bytes, compress=compress)
+
+            if last_byte not in (b'', b'\n'):
+                if compress:
+                    write_gzip_member(out_fh, '\n')
+
+                else:
+                    out_fh.write(b'\n')
+
+            write_header = False
+
+
+def _copy_file(in_file, out_fh, skip_bytes=0, compress=False, buffer_size=2 ** 20):
+    if is_gzip_file(in_file):
+        in_fh = gzip.open(in_file, 'rb')
+
+    else:
+        in_fh = open(in_file, 'rb')
+
+    if compress:
+        write_fh = gzip.GzipFile(fileobj=out_fh, mode='wb')
+
+    else:
+        write_fh = out_fh
+
+    last_byte = b''
+
+    with in_fh:
+        in_fh.read(skip_bytes)
+
+        for buf in iter(lambda: in_fh.read(buffer_size), b''):
+            write_fh.write(buf)
+
+            last_byte = buf[-1:]
+
+    if compress:
+        write_fh.close()
+
+    return last_byte
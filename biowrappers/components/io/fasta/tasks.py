@@ -0,0 +1,156 @@
+'''
+Memory mapped store of reference sequences.
+
+The sequences of a FASTA file are packed into a single byte file, along with a table of contig offsets and lengths. Bases for many positions can then be gathered with one numpy fancy index into the memory mapped
+file instead of a faidx fetch per position.
+'''
+from collections import OrderedDict
+
+import csv
+import numpy as np
+import os
+
+
+def build_reference_store(fasta_file, store_file, buffer_size=int(1e7)):
+    """ Build the sequence store for a FASTA file if it is missing or older than the FASTA file.
+
+    :param fasta_file: Path of reference FASTA file.
+
+    :param store_file: Path of the packed sequence file. The index is written to `store_file` + `.idx`.
+
+    """
+
+    index_file = store_file + '.idx'
+
+    if os.path.exists(index_file) and (os.path.getmtime(index_file) >= os.path.getmtime(fasta_file)):
+        return store_file
+
+    # Concurrent builds write to separate files and the last rename wins
+    tmp_suffix = '.{0}.tmp'.format(os.getpid())
+
+    contigs = OrderedDict()
+
+    offset = 0
+
+    chrom = None
+
+    buffer = []
+
+    buffer_len = 0
+
+    with open(fasta_file, 'rb') as in_fh, open(store_file + tmp_suffix, 'wb') as out_fh:
+        for line in in_fh:
+            if line.startswith(b'>'):
+                chrom = line[1:].split()[0].decode('ascii')
+
+                contigs[chrom] = [offset, 0]
+
+                continue
+
+            line = line.strip()
+
+            if chrom is None:
+                continue
+
+            buffer.append(line)
+
+            buffer_len += len(line)
+
+            contigs[chrom][1] += len(line)
+
+            offset += len(line)
+
+            if buffer_len >= buffer_size:
+                out_fh.write(b''.join(buffer))
+
+                buffer = []
+
+                buffer_len = 0
+
+        out_fh.write(b''.join(buffer))
+
+    with open(index_file + tmp_suffix, 'w') as out_fh:
+        writer = csv.writer(out_fh, delimiter='\t', lineterminator='\n')
+
+        for chrom, (chrom_offset, chrom_length) in contigs.items():
+            writer.writerow([chrom, chrom_offset, chrom_length])
+
+    os.rename(store_file + tmp_suffix, store_file)
+
+    os.rename(index_file + tmp_suffix, index_file)
+
+
+class ReferenceStore(object):
+    '''
+    Random access to reference bases from a memory mapped sequence store.
+
+    :param fasta_file: Path of reference FASTA file.
+
+    :param store_file: Path of the packed sequence file, see `build_reference_store`. The store is built if needed.
+    '''
+
+    def __init__(self, fasta_file, store_file):
+        build_reference_store(fasta_file, store_file)
+
+        self.offsets = {}
+
+        self.lengths = {}
+
+        with open(store_file + '.idx') as fh:
+            for chrom, offset, length in csv.reader(fh, delimiter='\t'):
+                self.offsets[chrom] = int(offset)
+
+                self.lengths[chrom] = int(length)
+
+        self._seq = np.memmap(store_file, dtype=np.uint8, mode='r')
+
+    def gather(self, chroms, starts, length):
+        '''
+        Get the bases of windows of `length` bases starting at the 0-based positions `starts`.
+
+        Returns a uint8 array of shape (len(starts), length) with 0 for positions outside the contig.
+        '''
+        chroms = np.asarray(chroms, dtype=object)
+
+        starts = np.asarray(starts, dtype=np.int64)
+
+        contig_offsets = np.zeros(len(starts), dtype=np.int64)
+
+        contig_lengths = np.zeros(len(starts), dtype=np.int64)
+
+        for chrom in set(chroms):
+            if chrom not in self.offsets:
+                raise ValueError('Unknown contig {0}'.format(chrom))
+
+            idx = chroms == chrom
+
+            contig_offsets[idx] = self.offsets[chrom]
+
+            contig_lengths[idx] = self.lengths[chrom]
+
+        pos = starts[:, np.newaxis] + np.arange(length)[np.newaxis, :]
+
+        valid = (pos >= 0) & (pos < contig_lengths[:, np.newaxis])
+
+        bases = np.zeros(pos.shape, dtype=np.uint8)
+
+        bases[valid] = self._seq[(contig_offsets[:, np.newaxis] + pos)[valid]]
+
+        return bases
+
+    def get_sequences(self, chroms, starts, length):
+        '''
+        Get the sequences of windows of `length` bases as strings, clipped to the contig.
+        '''
+        starts = np.asarray(starts, dtype=np.int64)
+
+        bases = self.gather(chroms, starts, length)
+
+        # Shift windows overlapping the start of a contig so the padding is trailing, which numpy strips from strings
+        cols = np.arange(length)[np.newaxis, :] + np.clip(-starts, 0, length)[:, np.newaxis]
+
+        bases = np.where(cols < length, bases[np.arange(len(starts))[:, np.newaxis], np.minimum(cols, length - 1)], 0)
+
+        bases = np.ascontiguousarray(bases, dtype=np.uint8)
+
+        return np.char.decode(bases.view('S{0}'.format(length)).ravel(), 'ascii')
@@ -5,16 +5,64 @@ import pypeliner
 import pysam
 import shutil
 
+from biowrappers.components.io.compression.tasks import check_gzip_file, is_gzip_file
 from biowrappers.components.utils import flatten_input
 
 
-def concatenate(in_files, out_file):
-    """ Concatenate FASTQ files.
+def concatenate(in_files, out_file, check_integrity=False, buffer_size=2 ** 20):
+    """ Concatenate FASTQ files into a gzip compressed FASTQ.
+
+    :param in_files: Plain or gzip compressed FASTQ files.
+
+    :param out_file: Path where the compressed output will be written.
+
+    :param check_integrity: Check the CRC and size of every gzip member of the inputs before concatenating, and drop
+        zero padding after the last member of each input. This decompresses every input, so it is off by default.
+
+    Gzip inputs are appended byte for byte, since concatenated gzip members are a valid gzip file. Uncompressed inputs
+    are compressed as a stream into a new member. The output holds at least one member, so it is a valid gzip file
+    even if every input is empty.
     """
-    with gzip.GzipFile(out_file, 'w') as out_fh:
-        for in_file in flatten_input(in_files):
-            with gzip.GzipFile(in_file, 'r') as in_fh:
-                out_fh.write(in_fh.read())
+    in_files = flatten_input(in_files)
+
+    data_sizes = {}
+
+    if check_integrity:
+        for in_file in in_files:
+            if is_gzip_file(in_file):
+                data_sizes[in_file] = check_gzip_file(in_file, buffer_size=buffer_size)
+
+    with open(out_file, 'wb') as out_fh:
+        for in_file in in_files:
+            if os.path.getsize(in_file) == 0:
+                continue
+
+            with open(in_file, 'rb') as in_fh:
+                if in_file in data_sizes:
+                    _copy_bytes(in_fh, out_fh, data_sizes[in_file], buffer_size)
+
+                elif is_gzip_file(in_file):
+                    shutil.copyfileobj(in_fh, out_fh, buffer_size)
+
+                else:
+                    with gzip.GzipFile(fileobj=out_fh, mode='wb') as gzip_fh:
+                        shutil.copyfileobj(in_fh, gzip_fh, buffer_size)
+
+        if out_fh.tell() == 0:
+            with gzip.GzipFile(fileobj=out_fh, mode='wb'):
+                pass
+
+
+def _copy_bytes(in_fh, out_fh, num_bytes, buffer_size):
+    while num_bytes > 0:
+        buf = in_fh.read(min(num_bytes, buffer_size))
+
+        if not buf:
+            break
+
+        out_fh.write(buf)
+
+        num_bytes -= len(buf)
 
 
 def is_phred33(file_name, num_reads=10000):
@@ -0,0 +1,89 @@
+import pypeliner
+import pypeliner.managed as mgd
+
+from biowrappers.components.utils import flatten_input
+
+
+def create_concatenate_tables_workflow(
+        in_files,
+        out_file,
+        drop_duplicates=False,
+        group_size=100,
+        in_memory=False,
+        non_numeric_as_category=True):
+    """ Concatenate HDF5 tables with a tree of merges.
+
+    Groups of `group_size` input files are merged in parallel and the partial merges are merged again, until a single
+    merge of at most `group_size` files produces the output. Categories are unioned at each level. The inputs and
+    partial merges of every level are managed files, so each merge task only runs once its inputs exist.
+
+    Unlike `tasks.concatenate_tables`, `in_memory` defaults to False so no merge holds all of its tables in memory.
+    """
+
+    if group_size < 2:
+        raise Exception('group_size must be at least 2.')
+
+    in_files = flatten_input(in_files)
+
+    ctx = {'mem': 4, 'num_retry': 3, 'mem_retry_increment': 4}
+
+    kwargs = {
+        'drop_duplicates': drop_duplicates,
+        'in_memory': in_memory,
+        'non_numeric_as_category': non_numeric_as_category,
+    }
+
+    workflow = pypeliner.workflow.Workflow()
+
+    if len(in_files) <= group_size:
+        workflow.setobj(
+            obj=mgd.OutputChunks('merge_input'),
+            value=list(range(len(in_files))),
+        )
+
+        workflow.transform(
+            name='concatenate_tables',
+            ctx=ctx,
+            func='biowrappers.components.io.hdf5.tasks.concatenate_tables',
+            args=(
+                mgd.InputFile('in.h5', 'merge_input', fnames=dict(enumerate(in_files))),
+                mgd.OutputFile(out_file),
+            ),
+            kwargs=kwargs
+        )
+
+        return workflow
+
+    group_files = {}
+
+    for idx, in_file in enumerate(in_files):
+        group_files[(idx // group_size, idx)] = in_file
+
+    workflow.setobj(
+        obj=mgd.OutputChunks('merge_group', 'merge_input'),
+        value=list(group_files.keys()),
+    )
+
+    workflow.transform(
+        name='concatenate_group_tables',
+        axes=('merge_group',),
+        ctx=ctx,
+        func='biowrappers.components.io.hdf5.tasks.concatenate_tables',
+        args=(
+            mgd.InputFile('in.h5', 'merge_group', 'merge_input', fnames=group_files),
+            mgd.TempOutputFile('partial.h5', 'merge_group'),
+        ),
+        kwargs=kwargs
+    )
+
+    workflow.subworkflow(
+        name='concatenate_partial_tables',
+        func='biowrappers.components.io.hdf5.create_concatenate_tables_workflow',
+        args=(
+            mgd.TempInputFile('partial.h5', 'merge_group'),
+            mgd.OutputFile(out_file),
+        ),
+        kwargs=dict(group_size=group_size, **kwargs)
+    )
+
+    return workflow
@@ -5,24 +5,35 @@ Created on Nov 4, 2015
 '''
 from collections import defaultdict
 
+import errno
 import gzip
+import numpy as np
+import os
 import pandas as pd
+import pickle
 import re
+import shutil
+import subprocess
+import tempfile
 
 from biowrappers.components.utils import flatten_input
 from pandas.api.types import CategoricalDtype
 
+_meta_data_table_re = re.compile('.*/meta/.*/meta$')
+
+
 def concatenate_tables(
     in_files,
     out_file,
     drop_duplicates=False,
     in_memory=True,
-    non_numeric_as_category=True
+    non_numeric_as_category=True,
+    chunk_size=int(1e5),
+    num_partitions=64
 ):
     in_files = flatten_input(in_files)
 
-    # Only support drop duplicatess in memory
-    if drop_duplicates or in_memory:
+    if in_memory:
         _concatenate_tables_in_memory(
             in_files,
             out_file,
@@ -34,7 +45,10 @@ def concatenate_tables(
         _concatenate_tables_on_disk(
             in_files,
             out_file,
-            non_numeric_as_category=non_numeric_as_category
+            drop_duplicates=drop_duplicates,
+            non_numeric_as_category=non_numeric_as_category,
+            chunk_size=chunk_size,
+            num_partitions=num_partitions
         )
 
 
@@ -89,93 +103,195 @@ def _concatenate_tables_in_memory(
     out_store.close()
 
 
-def _concatenate_tables_on_disk(in_files, out_file, non_numeric_as_category=True):
-    if non_numeric_as_category:
-        col_categories = _get_column_categories(in_files)
+def _concatenate_tables_on_disk(
+    in_files,
+    out_file,
+    drop_duplicates=False,
+    non_numeric_as_category=True,
+    chunk_size=int(1e5),
+    num_partitions=64
+):
+    col_categories, min_itemsize = _get_column_metadata(in_files, chunk_size=chunk_size)
 
-    else:
-        min_itemsize = _get_min_itemsize(in_files)
+    if drop_duplicates:
+        is_unique = _get_unique_rows(
+            in_files,
+            col_categories.keys(),
+            os.path.dirname(os.path.abspath(out_file)),
+            chunk_size=chunk_size,
+            num_partitions=num_partitions
+        )
 
     out_store = pd.HDFStore(out_file, 'w', complevel=9, complib='blosc')
 
     table_columns = defaultdict(set)
 
+    table_offsets = defaultdict(int)
+
     for file_name in in_files:
         in_store = pd.HDFStore(file_name, 'r')
 
         for table_name in _iter_table_names(in_store):
-            df = in_store[table_name]
+            for df in _iter_table_chunks(in_store, table_name, chunk_size):
+                table_columns[table_name].update(df.columns)
 
-            table_columns[table_name].update(df.columns)
+                if drop_duplicates:
+                    offset = table_offsets[table_name]
 
-            if df.empty:
-                continue
+                    table_offsets[table_name] += df.shape[0]
 
-            non_numeric_cols = _get_non_numeric_columns(df)
+                    df = df[is_unique[table_name][offset:offset + df.shape[0]]]
 
-            if non_numeric_as_category:
-                for col in non_numeric_cols:
-                    if df[col].dtype.name == 'category':
-                        df[col] = df[col].cat.set_categories(col_categories[table_name][col])
+                if df.empty:
+                    continue
 
-                    else:
-                        df[col] = df[col].astype(CategoricalDtype(categories=col_categories[table_name][col]))
+                non_numeric_cols = _get_non_numeric_columns(df)
+
+                if non_numeric_as_category:
+                    for col in non_numeric_cols:
+                        if df[col].dtype.name == 'category':
+                            df[col] = df[col].cat.set_categories(col_categories[table_name][col])
 
-                out_store.append(table_name, df, format='table')
+                        else:
+                            df[col] = df[col].astype(CategoricalDtype(categories=col_categories[table_name][col]))
 
-            else:
-                for col in non_numeric_cols:
-                    df[col] = df[col].astype(str)
+                    out_store.append(table_name, df, format='table')
 
-                out_store.append(table_name, df, min_itemsize=min_itemsize[table_name], format='table')
+                else:
+                    for col in non_numeric_cols:
+                        df[col] = df[col].astype(str)
 
-        for table_name, columns in table_columns.items():
-            out_store.append(table_name, pd.DataFrame(columns=columns), format='table')
+                    out_store.append(table_name, df, min_itemsize=min_itemsize[table_name], format='table')
 
         in_store.close()
 
+    for table_name, columns in table_columns.items():
+        out_store.append(table_name, pd.DataFrame(columns=list(columns)), format='table')
+
     out_store.close()
 
 
-def _get_min_itemsize(file_list):
+def _get_unique_rows(file_list, table_names, temp_dir, chunk_size=int(1e5), num_partitions=64):
     '''
-    Get the minimum string size for all columns in a list of tables from a list of HDFStores.
+    Find the first occurrence of each distinct row of each table in a list of HDFStores.
+
+    Tables are processed one at a time. Rows are hash partitioned to temporary files so duplicates always land in the
+    same partition, and each partition is deduplicated in memory on its own. Returns a dict with a boolean array for
+    each table, indexed by the position of the row in file and chunk order.
     '''
 
-    min_sizes = {}
+    partition_dir = tempfile.mkdtemp(dir=temp_dir)
+
+    is_unique = {}
+
+    try:
+        for table_name in table_names:
+            is_unique[table_name] = _get_unique_table_rows(
+                file_list,
+                table_name,
+                partition_dir,
+                chunk_size=chunk_size,
+                num_partitions=num_partitions
+            )
+
+    finally:
+        shutil.rmtree(partition_dir)
+
+    return is_unique
+
+
+def _get_unique_table_rows(file_list, table_name, partition_dir, chunk_size=int(1e5), num_partitions=64):
+    partition_files = [os.path.join(partition_dir, '{0}.pickle'.format(i)) for i in range(num_partitions)]
+
+    partition_fhs = [open(x, 'wb') for x in partition_files]
+
+    num_rows = 0
 
     for file_name in file_list:
         hdf_store = pd.HDFStore(file_name, 'r')
 
-        for table_name in _iter_table_names(hdf_store):
-            if table_name not in min_sizes:
-                min_sizes[table_name] = {}
+        if table_name in hdf_store:
+            for df in _iter_table_chunks(hdf_store, table_name, chunk_size):
+                row_idx = np.arange(num_rows, num_rows + df.shape[0])
 
-            df = hdf_store[table_name]
+                num_rows += df.shape[0]
 
-            if df.empty:
-                continue
+                if df.empty:
+                    continue
 
-            for col in _get_non_numeric_columns(df):
-                df[col] = df[col].astype(str)
+                df = df.reset_index(drop=True)
 
-                size = max(8, df[col].str.len().max())
+                partitions = _hash_rows(df) % num_partitions
 
-                if (col not in min_sizes[table_name]) or (size > min_sizes[table_name][col]):
-                    min_sizes[table_name][col] = size
+                for partition in np.unique(partitions):
+                    is_partition = (partitions == partition)
+
+                    pickle.dump((row_idx[is_partition], df[is_partition]), partition_fhs[partition], protocol=2)
 
         hdf_store.close()
 
-    return min_sizes
+    for fh in partition_fhs:
+        fh.close()
+
+    is_unique = np.zeros(num_rows, dtype=bool)
+
+    for file_name in partition_files:
+        row_idx = []
+
+        dfs = []
+
+        with open(file_name, 'rb') as fh:
+            while True:
+                try:
+                    chunk_row_idx, df = pickle.load(fh)
+
+                except EOFError:
+                    break
+
+                row_idx.append(chunk_row_idx)
+
+                dfs.append(df)
 
+        os.remove(file_name)
 
-def _get_column_categories(file_list):
+        if len(dfs) == 0:
+            continue
+
+        df = pd.concat(dfs, ignore_index=True)
+
+        is_unique[np.concatenate(row_idx)[~df.duplicated().values]] = True
+
+    return is_unique
+
+
+def _hash_rows(df):
     '''
-    Find the union set of categories for each column across tables.
+    Hash the rows of a table so equal rows hash equally across chunks with different dtypes, i.e. integer and float
+    columns, categorical and object columns or columns in a different order.
+    '''
+
+    df = df[sorted(df.columns, key=str)].copy()
+
+    for col in df.columns:
+        if df[col].dtype.kind in 'biuf':
+            df[col] = df[col].astype(np.float64)
+
+        else:
+            df[col] = df[col].astype(object)
+
+    return pd.util.hash_pandas_object(df, index=False).values
+
+
+def _get_column_metadata(file_list, chunk_size=int(1e5)):
+    '''
+    Find the union set of categories and the minimum string size for each non-numeric column of each table in a list
+    of HDFStores, reading each table once in chunks.
     '''
 
     categories = {}
 
+    min_sizes = {}
+
     for file_name in file_list:
         hdf_store = pd.HDFStore(file_name, 'r')
 
@@ -183,81 +299,158 @@ def _get_column_categories(file_list):
             if table_name not in categories:
                 categories[table_name] = {}
 
-            df = hdf_store[table_name]
+                min_sizes[table_name] = {}
+
+            for df in _iter_table_chunks(hdf_store, table_name, chunk_size):
+                if df.empty:
+                    continue
 
-            if df.empty:
-                continue
+                for col in _get_non_numeric_columns(df):
+                    if df[col].dtype.name == 'category':
+                        values = df[col].cat.categories
+
+                    else:
+                        values = df[col].dropna().unique()
 
-            for col in _get_non_numeric_columns(df):
-                df[col] = df[col].astype('category')
+                    if col not in categories[table_name]:
+                        categories[table_name][col] = set()
 
-                if col not in categories[table_name]:
-                    categories[table_name][col] = set()
+                    categories[table_name][col].update(values)
 
-                categories[table_name][col].update(set(df[col].cat.categories))
+                    size = max(8, df[col].astype(str).str.len().max())
+
+                    if (col not in min_sizes[table_name]) or (size > min_sizes[table_name][col]):
+                        min_sizes[table_name][col] = size
 
         hdf_store.close()
 
-    return categories
+    return categories, min_sizes
 
 
-def _get_non_numeric_columns(df):
+def _iter_table_chunks(store, table_name, chunk_size):
     '''
-    Find the set of non-numeric (int, float, complex) columns in a table.
+    Iterate over a table in chunks of rows. Tables in table format are read with `select`, DataFrames in fixed format
+    by slices of rows and anything else whole. Always yields at least one, possibly empty, DataFrame.
     '''
 
-    return df.select_dtypes(exclude=[pd.np.number, ]).columns
+    storer = store.get_storer(table_name)
 
+    if storer.is_table:
+        num_rows = storer.nrows
 
-def _iter_table_names(store):
+    else:
+        num_rows = _get_fixed_frame_num_rows(store, table_name)
+
+    if not num_rows:
+        yield store[table_name]
+
+    elif storer.is_table:
+        for df in store.select(table_name, chunksize=chunk_size):
+            yield df
+
+    else:
+        for beg in range(0, num_rows, chunk_size):
+            yield store.select(table_name, start=beg, stop=min(beg + chunk_size, num_rows))
+
+
+def _get_fixed_frame_num_rows(store, table_name):
     '''
-    Returns an iterator over all non-metadata tables in Pandas HDFStore.
+    Get the number of rows of a DataFrame in fixed format from the length of its index, or None for other objects.
     '''
 
-    meta_data_tables = _get_meta_data_tables(store)
+    node = store.get_node(table_name)
 
-    for table_name in store.keys():
-        if table_name in meta_data_tables:
-            continue
+    if (getattr(node._v_attrs, 'pandas_type', None) != 'frame') or ('axis1' not in node):
+        return None
 
-        yield table_name
+    return node._f_get_child('axis1').shape[0]
 
 
-def _get_meta_data_tables(store):
+def _get_non_numeric_columns(df):
     '''
-    Find all tables in and HDFStore which are pandas meta-data tables.
+    Find the set of non-numeric (int, float, complex) columns in a table.
     '''
 
-    meta_tables = set()
+    return df.select_dtypes(exclude=[pd.np.number, ]).columns
+
 
-    for table_name in store.keys():
-        for meta_table_name in store.keys():
-            if (re.search('.*/meta/.*/meta$', meta_table_name) is not None) and meta_table_name.startswith(table_name):
-                meta_tables.add(meta_table_name)
+def _iter_table_names(store):
+    '''
+    Returns an iterator over all non-metadata tables in Pandas HDFStore.
+
+    Meta-data tables hold the categories of a column at /table/meta/column/meta. The store is walked once.
+    '''
 
-    return meta_tables
+    for table_name in store.keys():
+        if _meta_data_table_re.search(table_name) is None:
+            yield table_name
 
 
-def convert_hdf5_to_tsv(in_file, key, out_file, compress=False, index=False):
+def convert_hdf5_to_tsv(in_file, key, out_file, compress=False, index=False, chunk_size=int(1e5), num_threads=1):
     '''
     Convert and pandas HDF5 table to tsv format.
+
+    The table is read and written in chunks of `chunk_size` rows. If `compress` is True and `num_threads` is more than
+    one the output is compressed by `pigz` with that many threads, or by gzip in this process if `pigz` is not
+    installed. The compressed bytes differ between the two, the uncompressed output is the same.
     '''
 
-    df = pd.read_hdf(in_file, key)
+    proc = None
+
+    if compress and (num_threads > 1):
+        out_fh = open(out_file, 'wb')
 
-    if compress:
-        f_open = gzip.open
+        try:
+            proc = subprocess.Popen(['pigz', '-c', '-p', str(num_threads)], stdin=subprocess.PIPE, stdout=out_fh)
+
+        except OSError as e:
+            out_fh.close()
+
+            if e.errno != errno.ENOENT:
+                raise
+
+    if proc is not None:
+        write_fh = proc.stdin
 
     else:
-        f_open = open
+        if compress:
+            out_fh = gzip.open(out_file, 'wb')
 
-    with f_open(out_file, 'w') as fh:
-        df.to_csv(fh, index=index, sep='\t')
+        else:
+            out_fh = open(out_file, 'wb')
 
+        write_fh = out_fh
 
-def merge_hdf5(in_files, out_file, table_names='{}'):
+    in_store = pd.HDFStore(in_file, 'r')
+
+    try:
+        header = True
+
+        for df in _iter_table_chunks(in_store, key, chunk_size):
+            write_fh.write(df.to_csv(index=index, header=header, sep='\t').encode('utf-8'))
+
+            header = False
+
+    finally:
+        in_store.close()
+
+        if proc is not None:
+            proc.stdin.close()
+
+            return_code = proc.wait()
+
+        out_fh.close()
+
+    if (proc is not None) and (return_code != 0):
+        raise Exception('pigz failed with exit code {0}'.format(return_code))
+
+
+def merge_hdf5(in_files, out_file, table_names='{}', copy_nodes=True):
     '''
     Merge pandas HDF5 tables
+
+    If `copy_nodes` is True tables already in table format are copied node for node with PyTables without decoding or
+    recompressing the data. Tables in fixed format still need to be converted and are read and written with pandas.
     '''
 
     out_store = pd.HDFStore(out_file, 'w', complevel=9, complib='blosc')
@@ -270,6 +463,13 @@ def merge_hdf5(in_files, out_file, table_names='{}'):
             file_key = (file_key,)
 
         for table_name in _iter_table_names(in_store):
+            out_table_name = table_names.format(*file_key) + '/' + table_name
+
+            if copy_nodes and in_store.get_storer(table_name).is_table:
+                _copy_table_node(in_store, table_name, out_store, out_table_name)
+
+                continue
+
             df = in_store[table_name]
 
             # Workaround: currently cannot store empty dataframe in table format
@@ -277,4 +477,29 @@ def merge_hdf5(in_files, out_file, table_names='{}'):
             if len(df.index) == 0:
                 format = None
 
-            out_store.put(table_names.format(*file_key) + '/' + table_name, df, format=format)
+            out_store.put(out_table_name, df, format=format)
+
+        in_store.close()
+
+    out_store.close()
+
+
+def _copy_table_node(in_store, table_name, out_store, out_table_name):
+    '''
+    Copy the PyTables group of a pandas table, with its attributes, data leaves and meta-data tables, to another store.
+    '''
+
+    out_path = [x for x in out_table_name.split('/') if x != '']
+
+    out_file = out_store.root._v_file
+
+    parent = out_store.root
+
+    for name in out_path[:-1]:
+        if name in parent:
+            parent = parent._f_get_child(name)
+
+        else:
+            parent = out_file.create_group(parent, name)
+
+    in_store.get_node(table_name)._f_copy(newparent=parent, newname=out_path[-1], overwrite=True, recursive=True)
@@ -3,6 +3,7 @@ Created on Nov 2, 2015
 
 @author: Andrew Roth
 '''
+from biowrappers.components.io.csv.tasks import concatenate_files_with_header, has_same_header, read_header
 from biowrappers.components.utils import flatten_input
 from pandas.io.common import EmptyDataError
 
@@ -12,6 +13,19 @@ import pandas as pd
 
 def concatenate_tables(in_files, out_file, ignore_empty_files=False, use_gzip=True):
 
+    in_files = flatten_input(in_files)
+
+    if not ignore_empty_files:
+        for file_name in in_files:
+            if read_header(file_name) is None:
+                raise EmptyDataError('No columns to parse from file: {0}'.format(file_name))
+
+    # Files with the same columns are concatenated without parsing
+    if has_same_header(in_files):
+        concatenate_files_with_header(in_files, out_file, compress=use_gzip)
+
+        return
+
     if use_gzip:
         open_func = gzip.GzipFile
 
@@ -21,7 +35,7 @@ def concatenate_tables(in_files, out_file, ignore_empty_files=False, use_gzip=Tr
     write_header = True
 
     with open_func(out_file, 'w') as out_fh:
-        for file_name in flatten_input(in_files):
+        for file_name in in_files:
             try:
                 df = pd.read_csv(file_name, sep='\t')
 
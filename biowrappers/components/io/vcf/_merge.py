@@ -5,7 +5,7 @@ Created on Nov 20, 2015
 '''
 from collections import namedtuple
 
-import csv
+import heapq
 import pysam
 
 from biowrappers.components.utils import flatten_input
@@ -13,25 +13,25 @@ from biowrappers.components.utils import flatten_input
 chrom_map = {'X': 23, 'Y': 24, 'M': 25, 'MT': 25}
 
 
-def merge_vcfs(in_files, out_file):
+def merge_vcfs(in_files, out_file, buffer_size=int(1e4)):
     in_files = flatten_input(in_files)
 
     with open(out_file, 'w') as out_fh:
         write_header(out_fh)
 
-        writer = csv.DictWriter(out_fh, ['CHROM', 'POS', 'ID', 'REF', 'ALT', 'QUAL', 'FILTER', 'INFO'], delimiter='\t')
-
         reader = MultiVcfReader(in_files)
 
+        lines = []
+
         for row in reader:
-            writer.writerow({'CHROM': row.chrom,
-                             'POS': row.coord,
-                             'ID': '.',
-                             'REF': row.ref,
-                             'ALT': row.alt,
-                             'QUAL': '.',
-                             'FILTER': '.',
-                             'INFO': '.'})
+            lines.append('{0}\t{1}\t.\t{2}\t{3}\t.\t.\t.\n'.format(row.chrom, row.coord, row.ref, row.alt))
+
+            if len(lines) >= buffer_size:
+                out_fh.write(''.join(lines))
+
+                lines = []
+
+        out_fh.write(''.join(lines))
 
         reader.close()
 
@@ -70,6 +70,12 @@ LightVCFRecord = namedtuple('LightVCFRecord', ['chrom', 'coord', 'ref', 'alt'])
 
 
 class MultiVcfReader(object):
+    '''
+    Iterate over the union of variants in a set of tabix indexed VCF files in genome order.
+
+    The files are merged with a heap keyed by chromosome rank and position. Multiple alt alleles are split into separate
+    records and duplicate records are only returned once.
+    '''
 
     def __init__(self, vcf_files):
         self._readers = []
@@ -78,33 +84,29 @@ class MultiVcfReader(object):
             self._readers.append(pysam.Tabixfile(file_name, parser=pysam.asVCF()))
 
     def __iter__(self):
-        for chrom in self.chroms:
-            active_iters = self._load_iters(chrom)
-
-            while len(active_iters) > 0:
-                pos_buffer = set()
+        chroms = self.chroms
 
-                min_coord = min([x.record.coord for x in active_iters])
+        heap = []
 
-                new_active_iters = []
+        for reader_idx, reader in enumerate(self._readers):
+            self._push_next_record(heap, reader_idx, self._iter_records(reader, chroms))
 
-                for chrom_iter in active_iters:
-                    while chrom_iter.coord == min_coord:
-                        record = chrom_iter.record
+        while len(heap) > 0:
+            chrom_rank, coord = heap[0][:2]
 
-                        # Handles multiple alt alleles.
-                        for alt in record.alt.split(','):
-                            pos_buffer.add(LightVCFRecord(record.chrom, record.coord, record.ref, alt))
+            pos_buffer = set()
 
-                        chrom_iter.buffer_next_record()
+            while (len(heap) > 0) and (heap[0][0] == chrom_rank) and (heap[0][1] == coord):
+                _, _, reader_idx, record, records = heapq.heappop(heap)
 
-                    if chrom_iter.active:
-                        new_active_iters.append(chrom_iter)
+                # Handles multiple alt alleles.
+                for alt in record.alt.split(','):
+                    pos_buffer.add((record.ref, alt))
 
-                for record in sorted(pos_buffer, key=lambda x: (get_chrom_order(x.chrom), x.coord, x.ref, x.alt)):
-                    yield record
+                self._push_next_record(heap, reader_idx, records)
 
-                active_iters = new_active_iters
+            for ref, alt in sorted(pos_buffer):
+                yield LightVCFRecord(chroms[chrom_rank], coord, ref, alt)
 
     def close(self):
         for reader in self._readers:
@@ -122,41 +124,31 @@ class MultiVcfReader(object):
 
         return sorted(chroms, key=lambda x: get_chrom_order(x))
 
-    def _load_iters(self, chrom):
-        iters = []
+    def _iter_records(self, reader, chroms):
+        '''
+        Iterate over (chromosome rank, record) pairs from a reader, visiting chromosomes in the order of `chroms`.
+        '''
+        contigs = set(reader.contigs)
+
+        for chrom_rank, chrom in enumerate(chroms):
+            if chrom not in contigs:
+                continue
 
-        for reader in self._readers:
             try:
                 chrom_iter = reader.fetch(chrom)
 
             except (KeyError, ValueError):
                 continue
 
-            iters.append(BufferedChromIter(chrom_iter))
-
-        return iters
-
-
-class BufferedChromIter(object):
-
-    def __init__(self, chrom_iter):
-        self._iter = chrom_iter
+            for record in chrom_iter:
+                yield chrom_rank, record
 
-        self.active = True
-
-        self.buffer_next_record()
-
-    def buffer_next_record(self):
+    def _push_next_record(self, heap, reader_idx, records):
         try:
-            record = self._iter.next()
-
-            self.record = LightVCFRecord(record.contig, record.pos + 1, record.ref, record.alt)
-
-            self.coord = self.record.coord
+            chrom_rank, record = next(records)
 
         except StopIteration:
-            self.active = False
-
-            self.record = None
+            return
 
-            self.coord = None
+        # The reader index breaks ties so records and iterators are never compared
+        heapq.heappush(heap, (chrom_rank, record.pos + 1, reader_idx, record, records))
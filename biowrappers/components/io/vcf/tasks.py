@@ -4,14 +4,19 @@ Created on Oct 31, 2015
 @author: Andrew Roth
 '''
 
+import gzip
 import itertools
+import math
 import os
+import shutil
+import tempfile
 
+import numpy as np
 import pandas as pd
 import pypeliner
+import pysam
 import vcf
 from biowrappers.components.utils import flatten_input
-from pandas.api.types import CategoricalDtype
 
 from ._merge import merge_vcfs
 
@@ -49,6 +54,37 @@ def filter_vcf(in_file, out_file):
         writer.close()
 
 
+def filter_and_compress_vcf(in_file, out_file):
+    """ Filter a VCF for records with no filters set, writing a bgzip compressed and indexed VCF.
+
+    :param in_file: Path of VCF file to filter.
+
+    :param out_file: Path where the compressed VCF file will be written. Index files will written to `out_file` +
+        `.tbi` and `out_file` + `.csi`.
+
+    Records are copied by pysam without parsing INFO or FORMAT fields. As with `filter_vcf` records with the filter
+    `PASS` will not be removed.
+
+    """
+
+    reader = pysam.VariantFile(in_file)
+
+    writer = pysam.VariantFile(out_file, 'wz', header=reader.header)
+
+    for record in reader:
+        filters = list(record.filter.keys())
+
+        if (len(filters) == 0) or (filters == ['PASS']):
+            writer.write(record)
+
+    writer.close()
+
+    reader.close()
+
+    index_bcf(out_file)
+    index_vcf(out_file)
+
+
 def _rename_index(in_file, index_suffix):
     if in_file.endswith('.tmp'):
         index_file = in_file[:-4] + index_suffix
@@ -155,6 +191,60 @@ def extract_variant_type(in_file, out_file, variant_type):
     index_bcf(out_file)
 
 
+def count_vcf_records(in_file):
+    """ Count the records in a plain or gzip compressed VCF file with a quick scan.
+    """
+
+    if in_file.endswith('.gz'):
+        fh = gzip.open(in_file, 'rb')
+    else:
+        fh = open(in_file, 'rb')
+
+    num_records = 0
+
+    for line in fh:
+        if not line.startswith(b'#'):
+            num_records += 1
+
+    fh.close()
+
+    return num_records
+
+
+def plan_vcf_split(
+        in_file,
+        seconds_per_record,
+        startup_seconds=0,
+        target_task_seconds=600,
+        max_jobs=1000):
+    """ Choose the number of records per file for `split_vcf`.
+
+    :param in_file: Path of VCF file which will be split.
+
+    :param seconds_per_record: Estimated time to process one record in the downstream task.
+
+    :param startup_seconds: Estimated fixed time of each downstream task, i.e. loading a database.
+
+    :param target_task_seconds: Desired run time of each downstream task.
+
+    :param max_jobs: Maximum number of files to create.
+
+    Returns the number of records per file, chosen so the records are spread evenly over as many files as needed to
+    reach the target task time, but no more than `max_jobs` files.
+
+    """
+
+    num_records = count_vcf_records(in_file)
+
+    records_per_task = max(int((target_task_seconds - startup_seconds) / seconds_per_record), 1)
+
+    num_jobs = int(math.ceil(num_records / float(records_per_task)))
+
+    num_jobs = min(max(num_jobs, 1), max_jobs)
+
+    return max(int(math.ceil(num_records / float(num_jobs))), 1)
+
+
 def split_vcf(in_file, out_files, lines_per_file):
     """ Split a VCF file into smaller files.
 
@@ -183,116 +273,204 @@ def split_vcf(in_file, out_files, lines_per_file):
             writer.close()
 
 
-def _convert_vcf_to_df(in_file, score_callback=None):
+def split_vcf_groups(in_file, out_files, lines_per_group, files_per_group):
+    """ Split a VCF file into groups of smaller files.
+
+    :param in_file: Path of VCF file to split.
+
+    :param out_files: Callback function which supplies file name given index of group and index of split in the group.
+
+    :param lines_per_group: Maximum number of lines to be written per group.
+
+    :param files_per_group: Maximum number of files each group is split into.
+
+     """
+
+    lines_per_file = max(int(math.ceil(lines_per_group / float(files_per_group))), 1)
+
     def line_group(line, line_idx=itertools.count()):
-        return int(next(line_idx) / chunk_size)
+        idx = next(line_idx)
 
-    chunk_size = 1000
+        return int(idx / lines_per_group), int((idx % lines_per_group) / lines_per_file)
 
-    # ===================================================================================================================
-    # find all entries in categories
-    # ===================================================================================================================
     reader = vcf.Reader(filename=in_file)
 
-    chrom_categories = set()
+    for (group_idx, file_idx), records in itertools.groupby(reader, key=line_group):
+        file_name = out_files(group_idx, file_idx)
 
-    ref_categories = set()
+        with open(file_name, 'w') as out_fh:
+            writer = vcf.Writer(out_fh, reader)
 
-    alt_categories = set()
+            for record in records:
+                writer.write_record(record)
 
-    for record in reader:
+            writer.close()
 
-        chrom_categories.add(str(record.CHROM))
 
-        ref_categories.add(str(record.REF))
+def _convert_vcf_to_df(in_file, score_callback=None, chunk_size=int(1e5)):
+    """ Convert a VCF file to chunks of a table with one row per alternate allele.
 
-        for alt in record.ALT:
-            alt_categories.add(str(alt))
+    :param in_file: Path of VCF file to convert.
 
-    chrom_categories = sorted(chrom_categories)
+    :param score_callback: Function which takes a `pysam.VariantRecord` and returns the score of the record. Defaults to
+        the QUAL field.
 
-    ref_categories = sorted(ref_categories)
+    :param chunk_size: Number of records per chunk.
 
-    alt_categories = sorted(alt_categories)
+    The file is read once. Values of the categorical chrom, ref and alt columns are added to the categories in the
+    order they are first seen, so codes of earlier chunks stay valid and the categories of the last chunk cover the
+    whole file.
 
-    if len(chrom_categories) > 0:
-        min_itemsize = {
-            'chrom': max([len(x) for x in chrom_categories]),
-            'ref': max([len(x) for x in ref_categories]),
-            'alt': max([len(x) for x in alt_categories])
-        }
+    """
 
-    else:
-        min_itemsize = {}
+    category_cols = ('chrom', 'ref', 'alt')
 
-    # ===================================================================================================================
-    # convert
-    # ===================================================================================================================
+    categories = dict([(col, []) for col in category_cols])
 
-    # reopen reader to restart iter
-    reader = vcf.Reader(filename=in_file)
+    codes = dict([(col, {}) for col in category_cols])
 
-    no_data = True
+    def get_code(col, value):
+        code = codes[col].get(value)
 
-    for file_idx, records in itertools.groupby(reader, key=line_group):
+        if code is None:
+            code = codes[col][value] = len(categories[col])
+
+            categories[col].append(value)
 
-        df = []
+        return code
+
+    reader = pysam.VariantFile(in_file)
+
+    num_rows = 0
+
+    for records in _iter_chunks(reader, chunk_size):
+        data = dict([(col, []) for col in ('chrom', 'coord', 'ref', 'alt', 'score')])
 
         for record in records:
             if score_callback is not None:
                 score = score_callback(record)
 
             else:
-                score = record.QUAL
+                score = record.qual
+
+            if score is None:
+                score = float('nan')
+
+            for alt in (record.alts or ()):
+                data['chrom'].append(get_code('chrom', str(record.chrom)))
+
+                data['coord'].append(record.pos)
+
+                data['ref'].append(get_code('ref', str(record.ref)))
+
+                data['alt'].append(get_code('alt', str(alt)))
+
+                data['score'].append(score)
+
+        if len(data['coord']) == 0:
+            continue
+
+        df = pd.DataFrame(index=range(num_rows, num_rows + len(data['coord'])))
+
+        for col in ('chrom', 'coord', 'ref', 'alt', 'score'):
+            if col in category_cols:
+                df[col] = pd.Categorical.from_codes(data[col], categories=list(categories[col]))
+
+            else:
+                df[col] = np.array(data[col], dtype=np.float64 if col == 'score' else np.int64)
+
+        num_rows += df.shape[0]
+
+        yield df
+
+    reader.close()
+
+    if num_rows == 0:
+        yield pd.DataFrame(columns=['chrom', 'coord', 'ref', 'alt', 'score'])
+
+
+def _iter_chunks(iterable, chunk_size):
+    iterator = iter(iterable)
+
+    while True:
+        chunk = list(itertools.islice(iterator, chunk_size))
+
+        if len(chunk) == 0:
+            return
+
+        yield chunk
+
+
+def convert_vcf_to_hdf5(in_file, out_file, table_name, score_callback=None, chunk_size=int(1e5)):
+    """ Convert a VCF file to an HDF5 table with one row per alternate allele.
+
+    Chunks are written with integer codes for the categorical columns to a temporary store as the VCF is read. The
+    codes are then remapped to sorted categories while the coded table is copied to `out_file`, so the VCF is only
+    parsed once.
+
+    """
+
+    category_cols = ('chrom', 'ref', 'alt')
+
+    temp_dir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(out_file)))
+
+    codes_file = os.path.join(temp_dir, 'codes.h5')
+
+    categories = None
+
+    try:
+        codes_store = pd.HDFStore(codes_file, 'w')
+
+        for df in _convert_vcf_to_df(in_file, score_callback=score_callback, chunk_size=chunk_size):
+            if df.shape[0] == 0:
+                continue
+
+            categories = dict([(col, np.array(df[col].cat.categories, dtype=object)) for col in category_cols])
+
+            for col in category_cols:
+                df[col] = df[col].cat.codes.astype(np.int64)
 
-            for alt in record.ALT:
-                row = {
-                    'chrom': record.CHROM,
-                    'coord': record.POS,
-                    'ref': str(record.REF),
-                    'alt': str(alt),
-                    'score': score
-                }
+            codes_store.append('codes', df)
 
-                df.append(row)
+        codes_store.close()
 
-        beg = file_idx * chunk_size
+        hdf_store = pd.HDFStore(out_file, 'w', complevel=9, complib='blosc')
 
-        end = beg + len(df)
+        if categories is not None:
+            remap = {}
 
-        df = pd.DataFrame(df, index=range(beg, end))
+            min_itemsize = {}
 
-        chrom_cat_type = CategoricalDtype(categories=chrom_categories)
-        df['chrom'] = df['chrom'].astype(chrom_cat_type)
+            for col in category_cols:
+                order = np.argsort(categories[col])
 
-        alt_cat_type = CategoricalDtype(categories=alt_categories)
-        df['alt'] = df['alt'].astype(alt_cat_type)
+                remap[col] = np.empty(len(order), dtype=np.int64)
 
-        ref_cat_type = CategoricalDtype(categories=ref_categories)
-        df['ref'] = df['ref'].astype(ref_cat_type)
+                remap[col][order] = np.arange(len(order))
 
-        df = df[['chrom', 'coord', 'ref', 'alt', 'score']]
+                categories[col] = categories[col][order]
 
-        yield df, min_itemsize
+                min_itemsize[col] = max([len(x) for x in categories[col]])
 
-        no_data = False
+            codes_store = pd.HDFStore(codes_file, 'r')
 
-    if no_data:
-        yield pd.DataFrame(columns=['chrom', 'coord', 'ref', 'alt', 'score']), None
+            for df in codes_store.select('codes', chunksize=chunk_size):
+                for col in category_cols:
+                    df[col] = pd.Categorical.from_codes(remap[col][df[col].values], categories=categories[col])
 
+                hdf_store.append(table_name, df, min_itemsize=min_itemsize)
 
-def convert_vcf_to_hdf5(in_file, out_file, table_name, score_callback=None):
-    hdf_store = pd.HDFStore(out_file, 'w', complevel=9, complib='blosc')
+            codes_store.close()
 
-    for (df, min_itemsize) in _convert_vcf_to_df(in_file, score_callback=score_callback):
-        hdf_store.append(table_name, df, min_itemsize=min_itemsize)
+        hdf_store.close()
 
-    hdf_store.close()
+    finally:
+        shutil.rmtree(temp_dir)
 
 
 def convert_vcf_to_csv(in_file, out_file, score_callback=None):
     header = False
-    for (df, _) in _convert_vcf_to_df(in_file, score_callback=score_callback):
+    for df in _convert_vcf_to_df(in_file, score_callback=score_callback):
         if not header:
             df.to_csv(out_file, mode='w', header=True, index=False)
             header = True
@@ -1,16 +1,34 @@
 import pypeliner
 import pypeliner.managed as mgd
 
+import biowrappers.components.variant_calling.utils as utils
+
+
 def create_vcf_db_annotation_workflow(
         db_vcf_file,
         target_vcf_file,
         out_file,
-        split_size=int(1e4)):
+        split_size=None,
+        target_task_seconds=600,
+        max_jobs=1000,
+        cache_file=None,
+        ref_build=None,
+        db_version=None):
 
     ctx = dict(mem=2, num_retry=3, mem_retry_increment=2)
 
     workflow = pypeliner.workflow.Workflow()
 
+    split_size = utils.plan_split(
+        workflow,
+        target_vcf_file,
+        split_size,
+        utils.db_status_task_cost,
+        target_task_seconds,
+        max_jobs,
+        ctx=ctx
+    )
+
     workflow.transform(
         name='split_vcf',
         ctx=ctx,
@@ -31,7 +49,12 @@ def create_vcf_db_annotation_workflow(
             db_vcf_file,
             mgd.TempInputFile('split.vcf', 'split'),
             mgd.TempOutputFile('annotated.csv.gz', 'split')
-        )
+        ),
+        kwargs={
+            'cache_file': cache_file,
+            'ref_build': ref_build,
+            'db_version': db_version,
+        }
     )
 
     workflow.transform(
@@ -3,62 +3,257 @@ Created on Nov 2, 2015
 
 @author: Andrew Roth
 '''
+from collections import OrderedDict
+
+import array
+import numpy as np
 import pandas as pd
-import vcf
+import pysam
+
+import biowrappers.components.io.csv.tasks as csv_tasks
+import biowrappers.components.variant_calling.annotation_cache as annotation_cache
+
+
+def annotate_db_status(
+        db_vcf_file,
+        target_vcf_file,
+        out_file,
+        max_window_gap=int(1e4),
+        cache_file=None,
+        ref_build=None,
+        db_version=None):
+    """ Annotate target variants with the records at the same position in a database VCF.
+
+    :param db_vcf_file: Path of tabix indexed database VCF, i.e. COSMIC or dbSNP.
+
+    :param target_vcf_file: Path of VCF with variants to annotate.
+
+    :param out_file: Path where the CSV table of matches will be written.
+
+    :param max_window_gap: Targets on a chromosome separated by at most this many bases are matched with a single
+        database fetch.
+
+    :param cache_file: Path of an annotation cache. Only targets missing from the cache are matched against the
+        database. See `biowrappers.components.variant_calling.annotation_cache`.
+
+    :param ref_build: Reference build used to key the cache.
+
+    :param db_version: Database version used to key the cache.
+
+    Targets are sorted by position and matched against the database records of each window in a single forward sweep,
+    instead of seeking in the database for every target.
+
+    """
+
+    targets = _read_targets(target_vcf_file)
+
+    data = annotation_cache.annotate_with_cache(
+        targets['chrom'],
+        targets['coord'],
+        targets['ref'],
+        targets['alts'],
+        lambda is_target: _annotate_targets(db_vcf_file, targets, is_target, max_window_gap),
+        cache_file=cache_file,
+        ref_build=ref_build,
+        db_version=db_version
+    )
+
+    csv_tasks.write_csv(data, out_file)
+
+
+def _annotate_targets(db_vcf_file, targets, is_target, max_window_gap):
+    db_reader = pysam.VariantFile(db_vcf_file)
+
+    matches = _DbMatches()
+
+    for chrom in _get_unique(targets['chrom'][is_target]):
+        # Stable sort so targets at the same position keep their file order
+        chrom_idx = np.flatnonzero((targets['chrom'] == chrom) & is_target)
+
+        chrom_idx = chrom_idx[np.argsort(targets['coord'][chrom_idx], kind='mergesort')]
+
+        for window_idx in _get_windows(targets['coord'][chrom_idx], max_window_gap):
+            window_idx = chrom_idx[window_idx]
+
+            window_coords = targets['coord'][window_idx]
+
+            try:
+                db_records = db_reader.fetch(chrom, window_coords[0] - 1, window_coords[-1])
+
+            except ValueError:
+                break
+
+            _sweep_window(db_records, window_idx, window_coords, matches)
+
+    db_reader.close()
+
+    return _get_matches_df(targets, matches)
+
+
+class _DbMatches(object):
+    '''
+    Column buffers of (target, database record) pairs found in the sweep.
+    '''
+
+    def __init__(self):
+        self.target_idx = array.array('l')
+
+        self.db_id = []
+
+        self.db_ref = []
+
+        self.db_alts = []
+
+        self.indel = array.array('b')
+
+    def add(self, target_idx, db_record):
+        self.target_idx.append(target_idx)
 
+        self.db_id.append(db_record.id)
 
-def annotate_db_status(db_vcf_file, target_vcf_file, out_file):
-    db_reader = vcf.Reader(filename=db_vcf_file)
+        self.db_ref.append(db_record.ref)
 
-    reader = vcf.Reader(filename=target_vcf_file)
+        self.db_alts.append(frozenset(db_record.alts or ()))
 
-    data = []
+        self.indel.append(_is_indel(db_record))
+
+
+def _read_targets(in_file):
+    reader = pysam.VariantFile(in_file, drop_samples=True)
+
+    chroms = []
+
+    coords = array.array('l')
+
+    refs = []
+
+    alts = []
 
     for record in reader:
-        chrom = record.CHROM
+        chroms.append(record.chrom)
+
+        coords.append(record.pos)
+
+        refs.append(record.ref)
+
+        alts.append(record.alts or ())
+
+    reader.close()
+
+    return {
+        'chrom': np.array(chroms, dtype=object),
+        'coord': np.array(coords, dtype=np.int64),
+        'ref': np.array(refs, dtype=object),
+        'alts': alts
+    }
+
+
+def _get_unique(values):
+    '''
+    Get the unique values of an array in order of first appearance.
+    '''
+    _, idx = np.unique(values, return_index=True)
+
+    return values[np.sort(idx)]
+
+
+def _get_windows(coords, max_window_gap):
+    '''
+    Split sorted coordinates into groups with no gaps larger than `max_window_gap`. Yields arrays of indices into
+    `coords`.
+    '''
+    breaks = np.flatnonzero(np.diff(coords) > max_window_gap) + 1
+
+    for window_idx in np.split(np.arange(len(coords)), breaks):
+        if len(window_idx) > 0:
+            yield window_idx
+
+
+def _sweep_window(db_records, window_idx, window_coords, matches):
+    '''
+    Match sorted targets against sorted database records by position in a single pass.
+    '''
+    num_targets = len(window_coords)
+
+    i = 0
+
+    for db_record in db_records:
+        pos = db_record.pos
+
+        while (i < num_targets) and (window_coords[i] < pos):
+            i += 1
+
+        if i == num_targets:
+            break
+
+        j = i
+
+        while (j < num_targets) and (window_coords[j] == pos):
+            matches.add(window_idx[j], db_record)
+
+            j += 1
+
+
+def _is_indel(record):
+    '''
+    Check if a record is an indel. Follows the rules of `vcf.model._Record.is_indel`.
+    '''
+    is_sv = 'SVTYPE' in record.info
+
+    if (len(record.ref) > 1) and not is_sv:
+        return True
+
+    if record.alts is None:
+        return True
+
+    for alt in record.alts:
+        if alt.startswith('<') or ('[' in alt) or (']' in alt) or (alt == '*'):
+            return False
+
+        elif len(alt) != len(record.ref):
+            return not is_sv
+
+    return False
+
+
+def _get_matches_df(targets, matches):
+    # One row per pair and target alt, ordered by target then database record
+    pair_order = np.argsort(np.array(matches.target_idx, dtype=np.int64), kind='mergesort')
 
-        coord = record.POS
+    pair_target_idx = np.array(matches.target_idx, dtype=np.int64)[pair_order]
 
-        try:
-            db_position_records = [x for x in db_reader.fetch(chrom, coord - 1, coord)]
+    num_alts = np.array([len(x) for x in targets['alts']], dtype=np.int64)
 
-        except ValueError:
-            db_position_records = []
+    pair_num_alts = num_alts[pair_target_idx]
 
-        for db_record in db_position_records:
+    row_pair_idx = np.repeat(pair_order, pair_num_alts)
 
-            if (db_record.CHROM != chrom) or (db_record.POS != coord):
-                continue
+    row_target_idx = np.repeat(pair_target_idx, pair_num_alts)
 
-            if db_record.is_indel:
-                indel = 1
+    # Index of each row's alt within its target
+    row_alt_idx = np.arange(len(row_target_idx)) - np.repeat(np.cumsum(pair_num_alts) - pair_num_alts, pair_num_alts)
 
-            else:
-                indel = 0
+    flat_alts = np.array([alt for alts in targets['alts'] for alt in alts], dtype=object)
 
-            for alt in record.ALT:
+    ref = targets['ref'][row_target_idx]
 
-                if (record.REF == db_record.REF) and (alt in db_record.ALT):
-                    exact_match = 1
+    alt = flat_alts[(np.cumsum(num_alts) - num_alts)[row_target_idx] + row_alt_idx]
 
-                else:
-                    exact_match = 0
+    db_ref = np.array(matches.db_ref, dtype=object)[row_pair_idx]
 
-                out_row = {
-                    'chrom': chrom,
-                    'coord': coord,
-                    'ref': record.REF,
-                    'alt': str(alt),
-                    'db_id': db_record.ID,
-                    'exact_match': exact_match,
-                    'indel': indel
-                }
+    db_alts = [matches.db_alts[idx] for idx in row_pair_idx]
 
-                data.append(out_row)
+    in_db_alts = np.array([x in y for x, y in zip(alt, db_alts)], dtype=bool)
 
-    data = pd.DataFrame(data)
+    exact_match = ((ref == db_ref) & in_db_alts).astype(int)
 
-    if out_file.endswith('.gz.tmp'):
-        data.to_csv(out_file, index=False, compression='gzip')
-    else:
-        data.to_csv(out_file, index=False)
+    return pd.DataFrame(OrderedDict((
+        ('record_idx', row_target_idx),
+        ('chrom', targets['chrom'][row_target_idx]),
+        ('coord', targets['coord'][row_target_idx]),
+        ('ref', ref),
+        ('alt', alt),
+        ('db_id', np.array(matches.db_id, dtype=object)[row_pair_idx]),
+        ('exact_match', exact_match),
+        ('indel', np.array(matches.indel, dtype=int)[row_pair_idx]),
+    )))
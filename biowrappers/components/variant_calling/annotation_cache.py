@@ -0,0 +1,302 @@
+'''
+Persistent cache of variant annotations shared across runs.
+
+Records are keyed by (reference build, database version, chrom, coord, ref, alt), with the alt alleles of a record
+joined by commas, and stored in an SQLite file with a primary key index on the full key, so a batch of records is looked
+up or inserted with a single indexed join. The `variants` table records which records have been annotated, including
+those without any annotation rows, and the `annotations` table holds the rows produced by the annotator for each record
+in the order they were produced. Each annotator should use its own cache file.
+
+Concurrent tasks rely on SQLite file locking, which is unreliable on NFS and some other network file systems. The cache
+file should be on a file system with working POSIX locks, otherwise tasks writing at the same time can corrupt it.
+'''
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+import sqlite3
+
+key_columns = ('chrom', 'coord', 'ref', 'alt')
+
+# Columns of the annotations table holding the key of the record each row belongs to
+annotation_key_columns = tuple(['variant_{0}'.format(x) for x in key_columns])
+
+# Placeholder alt for records without alternate alleles
+missing_alt = '.'
+
+
+class AnnotationCache(object):
+    '''
+    On disk cache of annotations for one reference build and database version.
+
+    :param file_name: Path of SQLite file. Created if it does not exist.
+
+    :param ref_build: Name of the reference build, i.e. GRCh37.
+
+    :param db_version: Version of the database or annotation resource, i.e. cosmic_v75.
+
+    :param timeout: Seconds to wait for other processes writing to the cache.
+    '''
+
+    def __init__(self, file_name, ref_build, db_version, timeout=600):
+        if (ref_build is None) or (db_version is None):
+            raise Exception('ref_build and db_version are required to use the annotation cache {0}'.format(file_name))
+
+        self.ref_build = str(ref_build)
+
+        self.db_version = str(db_version)
+
+        # Transactions are managed explicitly. The write lock is only taken by insert, so other processes can add the
+        # same records between a lookup and insert
+        self._conn = sqlite3.connect(file_name, timeout=timeout, isolation_level=None)
+
+        with self._transaction():
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS variants ('
+                'ref_build TEXT, db_version TEXT, chrom TEXT, coord INTEGER, ref TEXT, alt TEXT, '
+                'PRIMARY KEY (ref_build, db_version, chrom, coord, ref, alt)) WITHOUT ROWID'
+            )
+
+    def close(self):
+        self._conn.close()
+
+    def lookup(self, variants):
+        '''
+        Get a boolean array which is True for the rows of `variants` which are in the cache.
+
+        :param variants: DataFrame with the key columns.
+        '''
+        is_cached = np.zeros(len(variants), dtype=bool)
+
+        with self._transaction():
+            self._load_targets(variants)
+
+            idx = [x[0] for x in self._conn.execute(
+                'SELECT t.idx FROM targets t JOIN variants v '
+                'ON v.ref_build = ? AND v.db_version = ? AND v.chrom = t.chrom AND v.coord = t.coord AND '
+                'v.ref = t.ref AND v.alt = t.alt',
+                (self.ref_build, self.db_version)
+            )]
+
+        is_cached[idx] = True
+
+        return is_cached
+
+    def get_annotations(self, variants):
+        '''
+        Get the cached annotation rows of records.
+
+        :param variants: DataFrame with the key columns and the `record_idx` column from `get_variants_df`.
+
+        Returns the rows ordered by record with a `record_idx` column. Records with the same key each get a copy of the
+        rows.
+        '''
+        with self._transaction():
+            if not self._has_annotations_table():
+                return pd.DataFrame(columns=['record_idx'])
+
+            self._load_targets(variants, idx=variants['record_idx'])
+
+            columns = [x for x in self._get_annotation_columns() if x not in annotation_key_columns]
+
+            cursor = self._conn.execute(
+                'SELECT t.idx, {0} FROM targets t JOIN annotations a '
+                'ON a.ref_build = ? AND a.db_version = ? AND a.variant_chrom = t.chrom AND '
+                'a.variant_coord = t.coord AND a.variant_ref = t.ref AND a.variant_alt = t.alt '
+                'ORDER BY t.idx, a.rowid'.format(', '.join(['a.{0}'.format(x) for x in columns])),
+                (self.ref_build, self.db_version)
+            )
+
+            annotations = pd.DataFrame.from_records(cursor.fetchall(), columns=['record_idx'] + columns)
+
+        return annotations.drop(['ref_build', 'db_version'], axis=1)
+
+    def insert(self, variants, annotations):
+        '''
+        Add annotated records and their annotation rows to the cache.
+
+        :param variants: DataFrame with the key columns and the `record_idx` column of every record which was annotated.
+
+        :param annotations: DataFrame of annotation rows with a `record_idx` column giving the record of each row.
+
+        Records with the same key are stored once, with the rows of the first of them. Records added by another process
+        since the lookup are skipped along with their annotation rows.
+        '''
+        variants = variants.drop_duplicates(list(key_columns))
+
+        with self._transaction(immediate=True):
+            self._load_targets(variants)
+
+            new_idx = [x[0] for x in self._conn.execute(
+                'SELECT t.idx FROM targets t WHERE NOT EXISTS (SELECT 1 FROM variants v '
+                'WHERE v.ref_build = ? AND v.db_version = ? AND v.chrom = t.chrom AND v.coord = t.coord AND '
+                'v.ref = t.ref AND v.alt = t.alt)',
+                (self.ref_build, self.db_version)
+            )]
+
+            variants = variants.iloc[sorted(new_idx)]
+
+            self._conn.executemany(
+                'INSERT INTO variants VALUES (?, ?, ?, ?, ?, ?)',
+                [(self.ref_build, self.db_version) + _get_key(row)
+                 for row in variants[list(key_columns)].itertuples(index=False)]
+            )
+
+            if (variants.shape[0] == 0) or (annotations.shape[0] == 0):
+                return
+
+            # Key columns of each row from the record it belongs to
+            keys = variants[['record_idx'] + list(key_columns)]
+
+            keys.columns = ['record_idx'] + list(annotation_key_columns)
+
+            annotations = keys.merge(annotations, on='record_idx', how='inner', sort=False)
+
+            annotations = annotations.drop('record_idx', axis=1)
+
+            annotations.insert(0, 'ref_build', self.ref_build)
+
+            annotations.insert(1, 'db_version', self.db_version)
+
+            if not self._has_annotations_table():
+                self._create_annotations_table(annotations)
+
+            self._conn.executemany(
+                'INSERT INTO annotations ({0}) VALUES ({1})'.format(
+                    ', '.join(annotations.columns), ', '.join(['?'] * annotations.shape[1])),
+                annotations.astype(object).where(pd.notnull(annotations), None).values.tolist()
+            )
+
+    @contextmanager
+    def _transaction(self, immediate=False):
+        if immediate:
+            self._conn.execute('BEGIN IMMEDIATE')
+
+        else:
+            self._conn.execute('BEGIN')
+
+        try:
+            yield
+
+        except:
+            self._conn.execute('ROLLBACK')
+
+            raise
+
+        self._conn.execute('COMMIT')
+
+    def _create_annotations_table(self, annotations):
+        columns = []
+
+        for name, dtype in annotations.dtypes.items():
+            if dtype.kind in 'biu':
+                sql_type = 'INTEGER'
+
+            elif dtype.kind == 'f':
+                sql_type = 'REAL'
+
+            else:
+                sql_type = 'TEXT'
+
+            columns.append('{0} {1}'.format(name, sql_type))
+
+        self._conn.execute('CREATE TABLE annotations ({0})'.format(', '.join(columns)))
+
+        self._conn.execute(
+            'CREATE INDEX annotations_variant ON annotations (ref_build, db_version, {0})'.format(
+                ', '.join(annotation_key_columns))
+        )
+
+    def _get_annotation_columns(self):
+        return [x[1] for x in self._conn.execute('PRAGMA table_info(annotations)')]
+
+    def _has_annotations_table(self):
+        cursor = self._conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'annotations'")
+
+        return cursor.fetchone() is not None
+
+    def _load_targets(self, variants, idx=None):
+        '''
+        Load the keys of `variants` into a temporary table. Rows are identified by `idx`, or by their position if None.
+        '''
+        if idx is None:
+            idx = range(len(variants))
+
+        self._conn.execute('DROP TABLE IF EXISTS temp.targets')
+
+        self._conn.execute('CREATE TEMP TABLE targets (idx INTEGER, chrom TEXT, coord INTEGER, ref TEXT, alt TEXT)')
+
+        self._conn.executemany(
+            'INSERT INTO targets VALUES (?, ?, ?, ?, ?)',
+            [(int(x),) + _get_key(row) for x, row in zip(idx, variants[list(key_columns)].itertuples(index=False))]
+        )
+
+
+def get_variants_df(chroms, coords, refs, alts):
+    '''
+    Build a table of cache keys with one row per record.
+
+    :param alts: list with a sequence of alt alleles for each record.
+
+    The alt alleles of each record are joined by commas. The `record_idx` column gives the index of each record.
+    '''
+    joined_alts = [','.join([str(x) for x in record_alts]) or missing_alt for record_alts in alts]
+
+    return pd.DataFrame(OrderedDict((
+        ('record_idx', np.arange(len(alts))),
+        ('chrom', np.asarray(chroms, dtype=object)),
+        ('coord', np.asarray(coords, dtype=np.int64)),
+        ('ref', np.asarray(refs, dtype=object)),
+        ('alt', np.array(joined_alts, dtype=object)),
+    )))
+
+
+def annotate_with_cache(chroms, coords, refs, alts, annotate_func, cache_file=None, ref_build=None, db_version=None):
+    '''
+    Annotate records, only calling the annotator for records which are not in the cache.
+
+    :param chroms, coords, refs, alts: Columns of the target records, with a sequence of alt alleles per record.
+
+    :param annotate_func: Function taking a boolean mask of the records to annotate and returning a DataFrame of
+        annotations ordered by record, with a `record_idx` column giving the index of the record of each row.
+
+    :param cache_file: Path of the cache. If None every record is annotated and no cache is used.
+
+    :param ref_build, db_version: Keys of the cache, required if `cache_file` is given.
+
+    Returns a DataFrame of the annotations ordered by record without the `record_idx` column, the same as annotating
+    every record.
+    '''
+    num_records = len(alts)
+
+    if cache_file is None:
+        return annotate_func(np.ones(num_records, dtype=bool)).drop('record_idx', axis=1)
+
+    cache = AnnotationCache(cache_file, ref_build, db_version)
+
+    variants = get_variants_df(chroms, coords, refs, alts)
+
+    is_cached = cache.lookup(variants)
+
+    cached = cache.get_annotations(variants[is_cached])
+
+    annotations = annotate_func(~is_cached)
+
+    cache.insert(variants[~is_cached], annotations)
+
+    cache.close()
+
+    if cached.shape[0] > 0:
+        annotations = pd.concat([cached[list(annotations.columns)], annotations], ignore_index=True)
+
+        # Stable sort so the rows of each record keep their order
+        annotations = annotations.iloc[np.argsort(annotations['record_idx'].values, kind='mergesort')]
+
+        annotations = annotations.reset_index(drop=True)
+
+    return annotations.drop('record_idx', axis=1)
+
+
+def _get_key(row):
+    return (str(row[0]), int(row[1]), str(row[2]), str(row[3]))
@@ -11,6 +11,9 @@ def create_vcf_mappability_annotation_workflow(
         out_file,
         chromosomes=default_chromosomes,
         split_size=int(1e7),
+        cache_file=None,
+        ref_build=None,
+        db_version=None,
 ):
 
     ctx = {'mem': 2, 'num_retry': 3, 'mem_retry_increment': 2}
@@ -43,6 +46,9 @@ def create_vcf_mappability_annotation_workflow(
         ),
         kwargs={
             'region': mgd.TempInputObj('regions_obj', 'regions'),
+            'cache_file': cache_file,
+            'ref_build': ref_build,
+            'db_version': db_version,
         },
     )
 
@@ -3,7 +3,12 @@ Created on Nov 2, 2015
 
 @author: Andrew Roth
 '''
+from collections import OrderedDict
+
+import biowrappers.components.io.csv.tasks as csv_tasks
+import biowrappers.components.variant_calling.annotation_cache as annotation_cache
 import biowrappers.components.variant_calling.utils as utils
+import numpy as np
 import pandas as pd
 import vcf
 from bx.bbi.bigwig_file import BigWigFile
@@ -14,8 +19,10 @@ def get_mappability(
         vcf_file,
         out_file,
         region=None,
-        append_chr=True):
-    map_reader = BigWigFile(open(mappability_file, 'rb'))
+        append_chr=True,
+        cache_file=None,
+        ref_build=None,
+        db_version=None):
 
     vcf_reader = vcf.Reader(filename=vcf_file)
 
@@ -27,36 +34,106 @@ def get_mappability(
             print("no data for region {} in vcf".format(region))
             vcf_reader = []
 
-    data = []
+    records = list(vcf_reader)
+
+    data = annotation_cache.annotate_with_cache(
+        [x.CHROM for x in records],
+        [x.POS for x in records],
+        [x.REF for x in records],
+        [[str(alt) for alt in x.ALT if alt is not None] for x in records],
+        lambda is_target: _get_mappability(mappability_file, records, is_target, append_chr),
+        cache_file=cache_file,
+        ref_build=ref_build,
+        db_version=db_version
+    )
+
+    csv_tasks.write_csv(data, out_file)
+
+
+def _get_mappability(mappability_file, records, is_target, append_chr, flank=100):
+    """ Compute the mean mappability within `flank` bases of each target record.
+
+    The bigWig intervals spanning the targets on each chromosome are loaded with a single query and the window means
+    are computed from cumulative sums over the intervals.
+
+    """
+
+    map_reader = BigWigFile(open(mappability_file, 'rb'))
+
+    chroms = np.array([x.CHROM for x in records], dtype=object)[is_target]
+
+    coords = np.array([x.POS for x in records], dtype=np.int64)[is_target]
+
+    mappability = np.zeros(len(coords))
+
+    for chrom in sorted(set(chroms)):
+        idx = np.flatnonzero(chroms == chrom)
+
+        beg = np.maximum(coords[idx] - flank, 0)
+
+        end = coords[idx] + flank
 
-    for record in vcf_reader:
         if append_chr:
-            chrom = 'chr{0}'.format(record.CHROM)
+            map_chrom = 'chr{0}'.format(chrom)
 
         else:
-            chrom = record.CHROM
+            map_chrom = chrom
 
-        coord = record.POS
+        intervals = map_reader.get(map_chrom, int(beg.min()), int(end.max()))
 
-        beg = coord - 100
+        if not intervals:
+            continue
 
-        beg = max(beg, 0)
+        mappability[idx] = _get_window_means(intervals, beg, end)
 
-        end = coord + 100
+    return pd.DataFrame(OrderedDict((
+        ('record_idx', np.flatnonzero(is_target)),
+        ('chrom', chroms),
+        ('coord', coords),
+        ('mappability', mappability),
+    )))
 
-        result = map_reader.query(chrom, beg, end, 1)
 
-        if result is None:
-            mappability = 0
+def _get_window_means(intervals, beg, end):
+    """ Compute the mean value of sorted non-overlapping (start, end, value) intervals over windows [beg, end).
 
-        else:
-            mappability = result[0]['mean']
+    Bases without data are excluded from the mean, and windows without data have a mean of 0.
+
+    """
+
+    starts, ends, values = [np.array(x) for x in zip(*intervals)]
+
+    lengths = ends - starts
+
+    # Covered bases and summed values of the intervals before each interval
+    cum_coverage = np.concatenate([[0], np.cumsum(lengths)])
+
+    cum_sum = np.concatenate([[0], np.cumsum(lengths * values)])
+
+    coverage_beg, sum_beg = _integrate_intervals(starts, ends, values, cum_coverage, cum_sum, beg)
+
+    coverage_end, sum_end = _integrate_intervals(starts, ends, values, cum_coverage, cum_sum, end)
+
+    coverage = coverage_end - coverage_beg
+
+    window_sum = sum_end - sum_beg
+
+    means = np.zeros(len(beg))
+
+    means[coverage > 0] = window_sum[coverage > 0] / coverage[coverage > 0]
+
+    return means
+
+
+def _integrate_intervals(starts, ends, values, cum_coverage, cum_sum, pos):
+    """ Get the number of covered bases and summed values of intervals before positions `pos`.
+    """
+
+    # Intervals ending at or before pos are fully counted, and the next interval may be partially before pos
+    idx = np.searchsorted(ends, pos, side='right')
 
-        data.append({'chrom': record.CHROM, 'coord': record.POS, 'mappability': mappability})
+    partial_idx = np.minimum(idx, len(starts) - 1)
 
-    data = pd.DataFrame(data)
+    partial = np.where(idx < len(starts), np.clip(pos - starts[partial_idx], 0, None), 0)
 
-    if out_file.endswith('.gz.tmp'):
-        data.to_csv(out_file, index=False, compression='gzip')
-    else:
-        data.to_csv(out_file, index=False)
+    return cum_coverage[idx] + partial, cum_sum[idx] + partial * values[partial_idx]
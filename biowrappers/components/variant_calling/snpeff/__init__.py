@@ -1,6 +1,8 @@
 import pypeliner.managed as mgd
 from pypeliner.workflow import Workflow
 
+import biowrappers.components.variant_calling.utils as utils
+
 
 def create_snpeff_annotation_workflow(
         db,
@@ -8,33 +10,49 @@ def create_snpeff_annotation_workflow(
         target_vcf_file,
         out_file,
         classic_mode=True,
-        split_size=int(1e3),
+        split_size=None,
+        target_task_seconds=1800,
+        max_jobs=100,
+        splits_per_job=10,
         table_name='snpeff'):
     ctx = {'num_retry': 3, 'mem_retry_increment': 2}
 
     workflow = Workflow()
 
+    split_size = utils.plan_split(
+        workflow,
+        target_vcf_file,
+        split_size,
+        utils.snpeff_task_cost,
+        target_task_seconds,
+        max_jobs,
+        ctx=dict(mem=2, **ctx)
+    )
+
     workflow.transform(
         name='split_vcf',
         ctx=dict(mem=2, **ctx),
-        func='biowrappers.components.io.vcf.tasks.split_vcf',
+        func='biowrappers.components.io.vcf.tasks.split_vcf_groups',
         args=(
             mgd.InputFile(target_vcf_file),
-            mgd.TempOutputFile('split.vcf', 'split')
+            mgd.TempOutputFile('split.vcf', 'snpeff_job', 'split')
         ),
-        kwargs={'lines_per_file': split_size}
+        kwargs={
+            'lines_per_group': split_size,
+            'files_per_group': splits_per_job,
+        }
     )
 
     workflow.transform(
         name='run_snpeff',
-        axes=('split',),
+        axes=('snpeff_job',),
         ctx=dict(mem=8, **ctx),
-        func='biowrappers.components.variant_calling.snpeff.tasks.run_snpeff',
+        func='biowrappers.components.variant_calling.snpeff.tasks.run_snpeff_group',
         args=(
             db,
             data_dir,
-            mgd.TempInputFile('split.vcf', 'split'),
-            mgd.TempOutputFile('snpeff.vcf', 'split')
+            mgd.TempInputFile('split.vcf', 'snpeff_job', 'split'),
+            mgd.TempOutputFile('snpeff.vcf', 'snpeff_job', 'split', axes_origin=[])
         ),
         kwargs={
             'classic_mode': classic_mode,
@@ -43,14 +61,17 @@ def create_snpeff_annotation_workflow(
 
     workflow.transform(
         name='convert_vcf_to_csv',
-        axes=('split',),
+        axes=('snpeff_job', 'split'),
         ctx=dict(mem=4, **ctx),
         func='biowrappers.components.variant_calling.snpeff.tasks.convert_vcf_to_table',
         args=(
-            mgd.TempInputFile('snpeff.vcf', 'split'),
-            mgd.TempOutputFile('snpeff.csv.gz', 'split'),
+            mgd.TempInputFile('snpeff.vcf', 'snpeff_job', 'split'),
+            mgd.TempOutputFile('snpeff.csv.gz', 'snpeff_job', 'split'),
             table_name
-        )
+        ),
+        kwargs={
+            'classic_mode': classic_mode,
+        }
     )
 
     workflow.transform(
@@ -58,7 +79,7 @@ def create_snpeff_annotation_workflow(
         ctx=dict(mem=4, **ctx),
         func='biowrappers.components.io.csv.tasks.concatenate_csv',
         args=(
-            mgd.TempInputFile('snpeff.csv.gz', 'split'),
+            mgd.TempInputFile('snpeff.csv.gz', 'snpeff_job', 'split'),
             mgd.OutputFile(out_file)
         )
     )
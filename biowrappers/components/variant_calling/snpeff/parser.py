@@ -3,20 +3,32 @@ Created on 3 Apr 2017
 
 @author: Andrew Roth
 '''
-from collections import OrderedDict
+from collections import deque, OrderedDict
 
+import array
+import pandas as pd
+import pysam
 import re
-import vcf
 
 
 class SnpEffParser(object):
+    '''
+    Parse the annotations of a SnpEff VCF, yielding one row for each annotation of each record.
+
+    Iterating gives rows as dicts. `iter_chunks` collects the annotation strings and splits them into fields for a
+    chunk of rows at a time, which is much faster for large files.
+    '''
+
+    info_field = 'ANN'
 
     def __init__(self, file_name):
-        self._reader = vcf.Reader(filename=file_name)
+        self._reader = pysam.VariantFile(file_name, drop_samples=True)
 
         self.fields = self._get_field_names()
 
-        self._buffer = []
+        self.columns = ['chrom', 'coord', 'ref', 'alt'] + self.fields
+
+        self._buffer = deque()
 
     def __iter__(self):
         while True:
@@ -27,100 +39,141 @@ class SnpEffParser(object):
 
     def next(self):
         while len(self._buffer) == 0:
-            record = next(self._reader)
+            df = next(self._iter_record_chunks(1))
 
-            if 'ANN' not in record.INFO:
-                continue
+            for row in df.itertuples(index=False):
+                self._buffer.append(OrderedDict(zip(self.columns, row)))
+
+        return self._buffer.popleft()
 
-            for row in self._parse_record(record):
-                self._buffer.append(row)
+    __next__ = next
 
-        return self._buffer.pop(0)
+    def iter_chunks(self, chunk_size=int(1e5)):
+        '''
+        Iterate over DataFrames of annotations with roughly `chunk_size` rows.
+        '''
+        for df in self._iter_record_chunks(chunk_size):
+            yield df
 
     def _get_field_names(self):
         fields = []
 
-        match = re.search(":(.*)", self._reader.infos['ANN'].desc).groups()[0].replace("'", "")
+        match = re.search(":(.*)", self._reader.header.info['ANN'].description).groups()[0].replace("'", "")
 
         for x in match.split('|'):
             fields.append(x.strip().lower())
 
         return fields
 
-    def _parse_record(self, record):
-        for annotation in record.INFO['ANN']:
-            out_row = OrderedDict((
-                ('chrom', record.CHROM),
-                ('coord', record.POS),
-                ('ref', record.REF),
-                ('alt', ','.join([str(x) for x in record.ALT])),
-            ))
+    def _iter_record_chunks(self, chunk_size):
+        '''
+        Read records until at least `chunk_size` annotations are buffered, then build a DataFrame from the buffers.
+        '''
+        records = _RecordBuffer()
 
-            fields = annotation.split('|')
+        for record in self._reader:
+            if self.info_field not in record.info:
+                continue
 
-            for i, key in enumerate(self.fields):
-                out_row[key] = fields[i]
+            records.add(record, record.info[self.info_field])
 
-            yield out_row
+            if len(records.annotations) >= chunk_size:
+                yield self._get_chunk_df(records)
 
+                records = _RecordBuffer()
 
-class ClassicSnpEffParser(object):
+        if len(records.annotations) > 0:
+            yield self._get_chunk_df(records)
 
-    def __init__(self, file_name):
-        self._reader = vcf.Reader(filename=file_name)
+    def _get_chunk_df(self, records):
+        df = records.get_record_df()
 
-        self.fields = self._get_field_names()
+        annotations = pd.Series(records.annotations, dtype=object)
 
-        self._buffer = []
+        self._add_field_columns(df, annotations)
 
-        self._effect_matcher = re.compile(r'(.*)\(')
+        return df
 
-        self._fields_matcher = re.compile(r'\((.*)\)')
+    def _add_field_columns(self, df, annotations):
+        _add_split_columns(df, annotations, self.fields)
 
-    def __iter__(self):
-        while True:
-            try:
-                yield self.next()
-            except StopIteration:
-                break
 
-    def next(self):
-        while len(self._buffer) == 0:
-            record = next(self._reader)
+class ClassicSnpEffParser(SnpEffParser):
+    '''
+    Parse the EFF annotations of a SnpEff VCF produced in classic mode.
+    '''
 
-            if 'EFF' not in record.INFO:
-                continue
+    info_field = 'EFF'
 
-            for row in self._parse_record(record):
-                self._buffer.append(row)
+    def __init__(self, file_name):
+        SnpEffParser.__init__(self, file_name)
 
-        return self._buffer.pop(0)
+        self.columns = ['chrom', 'coord', 'ref', 'alt', 'effect'] + self.fields
 
     def _get_field_names(self):
         fields = []
 
-        match = re.search(r'\((.*)\[', self._reader.infos['EFF'].desc)
+        match = re.search(r'\((.*)\[', self._reader.header.info['EFF'].description)
 
         for x in match.groups()[0].split('|'):
             fields.append(x.strip().lower())
 
         return fields
 
-    def _parse_record(self, record):
-        for annotation in record.INFO['EFF']:
-            effect = self._effect_matcher.search(annotation).groups()[0]
+    def _add_field_columns(self, df, annotations):
+        df['effect'] = annotations.str.extract(r'(.*)\(', expand=False).values
+
+        _add_split_columns(df, annotations.str.extract(r'\((.*)\)', expand=False), self.fields)
+
+
+class _RecordBuffer(object):
+    '''
+    Column buffers for the records of a chunk, with the annotation strings of all records flattened into one list.
+    '''
+
+    def __init__(self):
+        self.chroms = []
+
+        self.coords = array.array('l')
+
+        self.refs = []
+
+        self.alts = []
+
+        self.num_annotations = array.array('l')
+
+        self.annotations = []
+
+    def add(self, record, annotations):
+        self.chroms.append(record.chrom)
+
+        self.coords.append(record.pos)
+
+        self.refs.append(record.ref)
+
+        self.alts.append(','.join(record.alts or ()))
+
+        self.num_annotations.append(len(annotations))
+
+        self.annotations.extend(annotations)
+
+    def get_record_df(self):
+        df = pd.DataFrame(OrderedDict((
+            ('chrom', self.chroms),
+            ('coord', self.coords),
+            ('ref', self.refs),
+            ('alt', self.alts),
+        )))
+
+        return df.loc[df.index.repeat(self.num_annotations)].reset_index(drop=True)
 
-            out_row = OrderedDict((
-                ('chrom', record.CHROM),
-                ('coord', record.POS),
-                ('ref', record.REF),
-                ('alt', ','.join([str(x) for x in record.ALT])),
-                ('effect', effect),
-            ))
 
-            fields = self._fields_matcher.search(annotation).groups()[0].split('|')
+def _add_split_columns(df, values, fields):
+    split = values.str.split('|', expand=True)
 
-            for i, key in enumerate(self.fields):
-                out_row[key] = fields[i]
+    for i, key in enumerate(fields):
+        if i < split.shape[1]:
+            df[key] = split[i].values
 
-            yield out_row
+        else:
+            df[key] = None
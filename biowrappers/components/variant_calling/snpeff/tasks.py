@@ -4,16 +4,134 @@ Created on Nov 2, 2015
 @author: Andrew Roth
 '''
 
+import gzip
 import pandas as pd
 import pypeliner
 import os
+import subprocess
+import threading
 
+import biowrappers.components.io.csv.tasks as csv_tasks
+import biowrappers.components.io.vcf.tasks as vcf_tasks
 import biowrappers.components.variant_calling.snpeff.parser
 
 
 def run_snpeff(db, data_dir, in_vcf_file, out_file, classic_mode=True):
 
     os.environ['MALLOC_ARENA_MAX'] = '2'
+
+    cmd = _get_snpeff_cmd(db, data_dir, classic_mode=classic_mode)
+
+    cmd.extend([
+        in_vcf_file,
+        '>',
+        out_file
+    ])
+
+    pypeliner.commandline.execute(*cmd)
+
+
+def run_snpeff_group(db, data_dir, in_vcf_files, out_files, classic_mode=True):
+    """ Annotate several VCF files with one snpEff process.
+
+    :param in_vcf_files: dict of VCF files with the same header, as written by `split_vcf_groups`.
+
+    :param out_files: Callback function which supplies the output file name given a key of `in_vcf_files`.
+
+    The records of all the files are streamed to snpEff over stdin, so the JVM starts and loads the annotation database
+    once for the group. snpEff writes one record per input record in input order, so its output is split back into a
+    file per input by counting records.
+
+    """
+
+    keys = sorted(in_vcf_files)
+
+    num_records = dict([(key, vcf_tasks.count_vcf_records(in_vcf_files[key])) for key in keys])
+
+    env = dict(os.environ, MALLOC_ARENA_MAX='2')
+
+    cmd = [str(x) for x in _get_snpeff_cmd(db, data_dir, classic_mode=classic_mode)]
+
+    proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=env)
+
+    writer = threading.Thread(target=_write_vcf_files, args=(proc.stdin, [in_vcf_files[key] for key in keys]))
+
+    writer.start()
+
+    try:
+        lines = iter(proc.stdout)
+
+        header = []
+
+        line = next(lines, None)
+
+        while (line is not None) and line.startswith(b'#'):
+            header.append(line)
+
+            line = next(lines, None)
+
+        for key in keys:
+            with open(out_files[key], 'wb') as out_fh:
+                out_fh.writelines(header)
+
+                for _ in range(num_records[key]):
+                    if line is None:
+                        raise Exception('snpEff output is missing records of {0}'.format(in_vcf_files[key]))
+
+                    out_fh.write(line)
+
+                    line = next(lines, None)
+
+        if line is not None:
+            raise Exception('snpEff output has more records than the input files')
+
+    except:
+        proc.kill()
+
+        raise
+
+    finally:
+        proc.stdout.close()
+
+        writer.join()
+
+        return_code = proc.wait()
+
+    if return_code != 0:
+        raise Exception('snpEff failed with exit code {0}: {1}'.format(return_code, ' '.join(cmd)))
+
+
+def _write_vcf_files(out_fh, in_files):
+    """ Write the header of the first file and the records of all files to `out_fh`, then close it.
+    """
+
+    try:
+        for file_idx, in_file in enumerate(in_files):
+            if in_file.endswith('.gz'):
+                in_fh = gzip.open(in_file, 'rb')
+            else:
+                in_fh = open(in_file, 'rb')
+
+            with in_fh:
+                for line in in_fh:
+                    if (file_idx > 0) and line.startswith(b'#'):
+                        continue
+
+                    out_fh.write(line)
+
+    # snpEff was stopped before reading all the records
+    except IOError:
+        pass
+
+    finally:
+        try:
+            out_fh.close()
+
+        except IOError:
+            pass
+
+
+def _get_snpeff_cmd(db, data_dir, classic_mode=True):
     data_dir = os.path.abspath(data_dir)
 
     cmd = [
@@ -30,18 +148,18 @@ def run_snpeff(db, data_dir, in_vcf_file, out_file, classic_mode=True):
     if classic_mode:
         cmd.append('-classic')
 
-    cmd.extend([
-        db,
-        in_vcf_file,
-        '>',
-        out_file
-    ])
+    cmd.append(db)
+
+    return cmd
 
-    pypeliner.commandline.execute(*cmd)
 
+def convert_vcf_to_table(in_file, out_file, table_name, classic_mode=True, chunk_size=int(1e5)):
+    """ Convert the annotations in a SnpEff VCF to a CSV table, one row per annotation.
 
-def convert_vcf_to_table(in_file, out_file, table_name, classic_mode=True):
-    data = []
+    Annotations are parsed and written in chunks of roughly `chunk_size` rows so memory use does not depend on the
+    number of annotations. Compressed output has the header and each chunk in separate gzip members.
+
+    """
 
     if classic_mode:
         parser = biowrappers.components.variant_calling.snpeff.parser.ClassicSnpEffParser(in_file)
@@ -49,12 +167,25 @@ def convert_vcf_to_table(in_file, out_file, table_name, classic_mode=True):
     else:
         parser = biowrappers.components.variant_calling.snpeff.parser.SnpEffParser(in_file)
 
-    for row in parser:
-        data.append(row)
+    compress = out_file.endswith('.gz.tmp')
 
-    data = pd.DataFrame(data)
+    def write(text):
+        if compress:
+            csv_tasks.write_gzip_member(out_fh, text)
 
-    if out_file.endswith('.gz.tmp'):
-        data.to_csv(out_file, index=False, compression='gzip')
-    else:
-        data.to_csv(out_file, index=False)
+        else:
+            out_fh.write(text.encode('utf-8'))
+
+    with open(out_file, 'wb') as out_fh:
+        header = True
+
+        for df in parser.iter_chunks(chunk_size=chunk_size):
+            if header:
+                write(df.head(0).to_csv(index=False))
+
+                header = False
+
+            write(df.to_csv(index=False, header=False))
+
+        if header:
+            write(pd.DataFrame(columns=parser.columns).to_csv(index=False))
@@ -18,6 +18,7 @@ def create_snv_allele_counts_for_vcf_targets_workflow(
         hdf5_output=True,
         min_bqual=0,
         min_mqual=0,
+        merge_group_size=100,
         split_size=int(1e7),
         table_name='snv_allele_counts',
         vcf_to_bam_chrom_map=None):
@@ -47,7 +48,7 @@ def create_snv_allele_counts_for_vcf_targets_workflow(
         name='get_snv_allele_counts_for_vcf_targets',
         axes=('regions',),
         ctx=med_ctx,
-        func='biowrappers.components.snv_allele_counts.tasks.get_snv_allele_counts_for_vcf_targets',
+        func='biowrappers.components.variant_calling.snv_allele_counts.tasks.get_snv_allele_counts_for_vcf_targets',
         args=(
             mgd.InputFile(bam_file),
             mgd.InputFile(vcf_file),
@@ -63,15 +64,15 @@ def create_snv_allele_counts_for_vcf_targets_workflow(
         }
     )
 
-    workflow.transform(
+    workflow.subworkflow(
         name='merge_snv_allele_counts',
-        ctx=med_ctx,
-        func='biowrappers.components.io.hdf5.tasks.concatenate_tables',
+        func='biowrappers.components.io.hdf5.create_concatenate_tables_workflow',
         args=(
             mgd.TempInputFile('counts.h5', 'regions'),
             merged_file.as_output(),
         ),
         kwargs={
+            'group_size': merge_group_size,
             'in_memory': False,
         }
     )
@@ -102,22 +103,28 @@ def create_snv_allele_counts_workflow(
         count_duplicates=False,
         min_bqual=0,
         min_mqual=0,
+        num_threads=1,
+        regions_per_job=1,
         report_non_variant_positions=True,
         report_zero_count_positions=False,
-        split_size=int(1e7)):
+        merge_group_size=100,
+        split_size=int(1e7),
+        use_processes=True):
 
     workflow = pypeliner.workflow.Workflow()
 
+    regions = biowrappers.components.variant_calling.utils.get_bam_regions(bam_file, split_size, chromosomes=chromosomes)
+
     workflow.setobj(
         obj=mgd.TempOutputObj('regions_obj', 'regions'),
-        value=biowrappers.components.variant_calling.utils.get_bam_regions(bam_file, split_size, chromosomes=chromosomes)
+        value=biowrappers.components.variant_calling.utils.group_regions(regions, regions_per_job)
     )
 
     workflow.transform(
         name='get_counts',
         axes=('regions',),
         ctx=med_ctx,
-        func='biowrappers.components.snv_allele_counts.tasks.get_snv_allele_counts_for_region',
+        func='biowrappers.components.variant_calling.snv_allele_counts.tasks.get_snv_allele_counts_for_regions',
         args=(
             mgd.InputFile(bam_file),
             mgd.TempOutputFile('counts.h5', 'regions'),
@@ -128,19 +135,24 @@ def create_snv_allele_counts_workflow(
             'count_duplicates': count_duplicates,
             'min_bqual': min_bqual,
             'min_mqual': min_mqual,
+            'num_threads': num_threads,
             'report_non_variant_positions': report_non_variant_positions,
-            'report_zero_count_positions': report_zero_count_positions
+            'report_zero_count_positions': report_zero_count_positions,
+            'use_processes': use_processes,
         }
     )
 
-    workflow.transform(
+    workflow.subworkflow(
         name='concatenate_counts',
-        ctx=med_ctx,
-        func='biowrappers.components.io.hdf5.tasks.concatenate_tables',
+        func='biowrappers.components.io.hdf5.create_concatenate_tables_workflow',
         args=(
             mgd.TempInputFile('counts.h5', 'regions'),
-            mgd.OutputFile(out_file)
-        )
+            mgd.OutputFile(out_file),
+        ),
+        kwargs={
+            'group_size': merge_group_size,
+            'in_memory': False,
+        }
     )
 
     return workflow
@@ -158,6 +170,7 @@ def create_snv_variant_position_counts_workflow(
         min_tumour_depth=0,
         min_variant_depth=0,
         report_strand_counts=False,
+        merge_group_size=100,
         split_size=int(1e7),
         table_group=''):
 
@@ -177,7 +190,7 @@ def create_snv_variant_position_counts_workflow(
         name='get_counts',
         axes=('regions',),
         ctx=med_ctx,
-        func='biowrappers.components.snv_allele_counts.tasks.get_variant_position_counts',
+        func='biowrappers.components.variant_calling.snv_allele_counts.tasks.get_variant_position_counts',
         args=(
             mgd.InputFile(normal_bam_file),
             tumour_input_files,
@@ -196,15 +209,17 @@ def create_snv_variant_position_counts_workflow(
         }
     )
 
-    workflow.transform(
+    workflow.subworkflow(
         name='concatenate_counts',
-        axes=(),
-        ctx=med_ctx,
-        func='biowrappers.components.io.hdf5.tasks.concatenate_tables',
+        func='biowrappers.components.io.hdf5.create_concatenate_tables_workflow',
         args=(
             mgd.TempInputFile('counts.h5', 'regions'),
             mgd.OutputFile(out_file),
-        )
+        ),
+        kwargs={
+            'group_size': merge_group_size,
+            'in_memory': False,
+        }
     )
 
     return workflow
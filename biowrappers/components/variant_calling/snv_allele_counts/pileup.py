@@ -0,0 +1,206 @@
+'''
+Single pass stranded allele counting from BAM files.
+
+Reads are filtered with flag masks and the aligned bases of a batch of reads are counted with vectorised numpy
+operations, so each region of a BAM file only needs to be decoded once to get counts for both strands.
+'''
+import array
+
+import numpy as np
+
+nucleotides = ('A', 'C', 'G', 'T')
+
+FORWARD = 0
+REVERSE = 1
+
+FLAG_REVERSE = 0x10
+FLAG_UNMAPPED = 0x4
+FLAG_SECONDARY = 0x100
+FLAG_QCFAIL = 0x200
+FLAG_DUPLICATE = 0x400
+
+# CIGAR operations which consume the query and/or reference
+_CIGAR_MATCH = frozenset([0, 7, 8])
+_CIGAR_QUERY = frozenset([1, 4])
+_CIGAR_REF = frozenset([2, 3])
+
+_base_codes = np.full(256, -1, dtype=np.int8)
+
+for _i, _base in enumerate(nucleotides):
+    _base_codes[ord(_base)] = _i
+
+
+def get_exclude_flags(count_duplicates=False):
+    '''
+    Get the bit mask of SAM flags for reads which should not be counted.
+    '''
+    flags = FLAG_UNMAPPED | FLAG_SECONDARY | FLAG_QCFAIL
+
+    if not count_duplicates:
+        flags |= FLAG_DUPLICATE
+
+    return flags
+
+
+def count_alleles(bam, chrom, start, stop, count_duplicates=False, min_bqual=0, min_mqual=0, batch_size=int(1e6)):
+    '''
+    Count the bases observed on each strand at every position of a region.
+
+    :param bam: Open pysam.AlignmentFile.
+
+    :param chrom: Name of the chromosome in the BAM file.
+
+    :param start: 0-based start of the region (inclusive).
+
+    :param stop: 0-based end of the region (exclusive).
+
+    :param batch_size: Approximate number of aligned bases to accumulate before they are added to the counts.
+
+    Returns an integer array of shape (stop - start, 4, 2) indexed by position, base (A, C, G, T) and strand (FORWARD,
+    REVERSE).
+    '''
+    counts = np.zeros((max(stop - start, 0), len(nucleotides), 2), dtype=np.int32)
+
+    if counts.shape[0] == 0:
+        return counts
+
+    batch = _AlignedBaseBatch(min_bqual > 0)
+
+    exclude_flags = get_exclude_flags(count_duplicates=count_duplicates)
+
+    for read in bam.fetch(chrom, start, stop):
+        flag = read.flag
+
+        if flag & exclude_flags:
+            continue
+
+        if read.mapping_quality < min_mqual:
+            continue
+
+        batch.add_read(read, (flag & FLAG_REVERSE) >> 4)
+
+        if batch.size >= batch_size:
+            batch.flush(counts, start, stop, min_bqual)
+
+    batch.flush(counts, start, stop, min_bqual)
+
+    return counts
+
+
+class _AlignedBaseBatch(object):
+    '''
+    Buffer of aligned blocks from a set of reads which are counted together.
+    '''
+
+    def __init__(self, use_qualities):
+        self.use_qualities = use_qualities
+
+        self._reset()
+
+    def _reset(self):
+        self.size = 0
+
+        self._seqs = []
+
+        self._quals = array.array('B')
+
+        self._query_offset = 0
+
+        self._block_ref = []
+
+        self._block_query = []
+
+        self._block_len = []
+
+        self._block_strand = []
+
+    def add_read(self, read, strand):
+        seq = read.query_sequence
+
+        if seq is None:
+            return
+
+        if self.use_qualities:
+            quals = read.query_qualities
+
+            # Reads without base qualities never pass a base quality threshold
+            if quals is None:
+                return
+
+            self._quals.extend(quals)
+
+        ref_pos = read.reference_start
+
+        query_pos = self._query_offset
+
+        for op, length in read.cigartuples:
+            if op in _CIGAR_MATCH:
+                self._block_ref.append(ref_pos)
+
+                self._block_query.append(query_pos)
+
+                self._block_len.append(length)
+
+                self._block_strand.append(strand)
+
+                ref_pos += length
+
+                query_pos += length
+
+                self.size += length
+
+            elif op in _CIGAR_QUERY:
+                query_pos += length
+
+            elif op in _CIGAR_REF:
+                ref_pos += length
+
+        self._seqs.append(seq)
+
+        self._query_offset += len(seq)
+
+    def flush(self, counts, start, stop, min_bqual):
+        '''
+        Add the buffered bases to `counts` and clear the buffer.
+        '''
+        if self.size == 0:
+            self._reset()
+
+            return
+
+        lengths = np.array(self._block_len, dtype=np.int64)
+
+        block_offsets = np.repeat(np.cumsum(lengths) - lengths, lengths)
+
+        within_block = np.arange(self.size, dtype=np.int64) - block_offsets
+
+        ref_pos = np.repeat(np.array(self._block_ref, dtype=np.int64), lengths) + within_block
+
+        query_pos = np.repeat(np.array(self._block_query, dtype=np.int64), lengths) + within_block
+
+        strand = np.repeat(np.array(self._block_strand, dtype=np.int64), lengths)
+
+        seq = np.frombuffer(''.join(self._seqs).encode('ascii'), dtype=np.uint8)
+
+        base = _base_codes[seq[query_pos]].astype(np.int64)
+
+        keep = (ref_pos >= start) & (ref_pos < stop) & (base >= 0)
+
+        if self.use_qualities:
+            quals = np.frombuffer(self._quals, dtype=np.uint8)
+
+            keep &= quals[query_pos] >= min_bqual
+
+        index = ((ref_pos[keep] - start) * len(nucleotides) + base[keep]) * 2 + strand[keep]
+
+        if index.shape[0] > 0:
+            # Reads come sorted by position so the batch only touches a narrow window of the counts
+            lower = index.min()
+
+            window = np.bincount(index - lower)
+
+            flat_counts = counts.reshape(-1)
+
+            flat_counts[lower:lower + window.shape[0]] += window.astype(counts.dtype)
+
+        self._reset()
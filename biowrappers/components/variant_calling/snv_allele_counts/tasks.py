@@ -3,16 +3,36 @@ Created on Oct 31, 2015
 
 @author: Andrew Roth
 '''
+from multiprocessing.pool import Pool, ThreadPool
+
+import functools
+import multiprocessing.util
 import numpy as np
 import pandas as pd
 import pysam
+import threading
 import vcf
 
+import biowrappers.components.variant_calling.snv_allele_counts.pileup as pileup
+import biowrappers.components.variant_calling.snv_allele_counts.writers as writers
 import biowrappers.components.variant_calling.utils as utils
 
-from single_cell.utils import csvutils
+nucleotides = pileup.nucleotides
+
+_target_counts_columns = [
+    ('chrom', np.int32),
+    ('coord', np.int32),
+    ('ref', np.uint8),
+    ('alt', np.uint8),
+    ('ref_counts', np.int32),
+    ('alt_counts', np.int32),
+]
+
+_region_counts_columns = [('chrom', np.int32), ('coord', np.int32)] + \
+    [(x, np.int32) for x in nucleotides] + [(x.lower(), np.int32) for x in nucleotides]
 
-nucleotides = ('A', 'C', 'G', 'T')
+# Open BAM file of the current pool worker thread or process
+_worker_state = threading.local()
 
 #=======================================================================================================================
 # Allele counting
@@ -31,10 +51,11 @@ def get_snv_allele_counts_for_vcf_targets(
         report_zero_count_positions=False,
         dtypes=None,
         write_header=True,
+        max_window_gap=1000,
+        max_window_size=int(1e5),
+        chunk_size=int(1e5),
         **extra_columns):
 
-    bam = pysam.AlignmentFile(bam_file, 'rb')
-
     vcf_reader = vcf.Reader(filename=vcf_file)
 
     if region is not None:
@@ -46,127 +67,284 @@ def get_snv_allele_counts_for_vcf_targets(
         except ValueError:
             vcf_reader = ()
 
-    data = []
+    writer = writers.CsvAlleleCountsWriter(
+        out_file,
+        _target_counts_columns,
+        dtypes=dtypes,
+        write_header=write_header,
+        categories={'chrom': (), 'ref': nucleotides, 'alt': nucleotides},
+        constant_columns=extra_columns,
+        chunk_size=chunk_size,
+    )
+
+    with pysam.AlignmentFile(bam_file, 'rb') as bam, writer:
+        for records, bam_chroms in _iter_target_batches(vcf_reader, chunk_size, vcf_to_bam_chrom_map):
+            site_counts = _get_target_site_counts(
+                bam,
+                bam_chroms,
+                [record.POS for record in records],
+                count_duplicates=count_duplicates,
+                min_bqual=min_bqual,
+                min_mqual=min_mqual,
+                max_window_gap=max_window_gap,
+                max_window_size=max_window_size,
+            )
+
+            site_idxs = []
+
+            chrom_codes = []
+
+            alt_codes = []
+
+            for site_idx, record in enumerate(records):
+                for alt_base in record.ALT:
+                    alt_base = str(alt_base)
+
+                    # Skip record with alt base == N
+                    if alt_base not in nucleotides:
+                        continue
+
+                    site_idxs.append(site_idx)
+
+                    chrom_codes.append(writer.encode('chrom', record.CHROM))
+
+                    alt_codes.append(nucleotides.index(alt_base))
+
+            site_idxs = np.array(site_idxs, dtype=np.int64)
+
+            chrom_codes = np.array(chrom_codes, dtype=np.int32)
+
+            alt_codes = np.array(alt_codes, dtype=np.uint8)
+
+            coords = np.array([record.POS for record in records], dtype=np.int32)[site_idxs]
+
+            ref_codes = np.array([nucleotides.index(record.REF) for record in records], dtype=np.uint8)[site_idxs]
+
+            ref_counts = site_counts[site_idxs, ref_codes]
+
+            alt_counts = site_counts[site_idxs, alt_codes]
+
+            if not report_zero_count_positions:
+                keep = (ref_counts > 0) | (alt_counts > 0)
+
+            else:
+                keep = np.ones(site_idxs.shape[0], dtype=bool)
+
+            writer.write(
+                chrom=chrom_codes[keep],
+                coord=coords[keep],
+                ref=ref_codes[keep],
+                alt=alt_codes[keep],
+                ref_counts=ref_counts[keep],
+                alt_counts=alt_counts[keep],
+            )
+
+
+def _iter_target_batches(vcf_reader, batch_size, vcf_to_bam_chrom_map=None):
+    '''
+    Iterate over batches of at most `batch_size` VCF records with a single nucleotide reference base, yielding lists of
+    the records and the matching BAM chromosome names.
+    '''
+
+    records = []
+
+    bam_chroms = []
 
     for record in vcf_reader:
+        # Skip record with reference base == N
+        if record.REF not in nucleotides:
+            continue
+
         if vcf_to_bam_chrom_map is not None:
-            bam_chrom = vcf_to_bam_chrom_map[record.CHROM]
+            bam_chroms.append(vcf_to_bam_chrom_map[record.CHROM])
 
         else:
-            bam_chrom = record.CHROM
+            bam_chroms.append(record.CHROM)
+
+        records.append(record)
+
+        if len(records) == batch_size:
+            yield records, bam_chroms
+
+            records = []
+
+            bam_chroms = []
 
-        df = _get_counts_df(
+    if len(records) > 0:
+        yield records, bam_chroms
+
+
+def get_snv_allele_counts_for_region(
+        bam_file,
+        out_file,
+        region,
+        table_name,
+        count_duplicates=False,
+        min_bqual=0,
+        min_mqual=0,
+        report_non_variant_positions=True,
+        report_zero_count_positions=False):
+
+    with pysam.AlignmentFile(bam_file, 'rb') as bam:
+        chrom, coords, counts = _get_region_counts(
             bam,
-            bam_chrom,
-            record.POS,
-            record.POS + 1,
+            region,
             count_duplicates=count_duplicates,
             min_bqual=min_bqual,
             min_mqual=min_mqual,
-            strand='both',
-            report_zero_count_positions=report_zero_count_positions,
+            report_non_variant_positions=report_non_variant_positions,
+            report_zero_count_positions=report_zero_count_positions
         )
 
-        if df is None:
-            continue
+    writer = writers.HdfAlleleCountsWriter(
+        out_file,
+        table_name,
+        _region_counts_columns,
+        min_itemsize={'chrom': len(chrom)},
+        categories={'chrom': (chrom,)}
+    )
 
-        counts = df.iloc[0]
+    with writer:
+        _write_region_counts(writer, chrom, coords, counts)
 
-        ref_base = record.REF
 
-        # Skip record with reference base == N
-        if ref_base not in nucleotides:
-            continue
+def get_snv_allele_counts_for_regions(
+        bam_file,
+        out_file,
+        regions,
+        table_name,
+        count_duplicates=False,
+        min_bqual=0,
+        min_mqual=0,
+        num_threads=1,
+        report_non_variant_positions=True,
+        report_zero_count_positions=False,
+        use_processes=True):
+    """ Get allele counts for a list of regions in a single task.
 
-        for alt_base in record.ALT:
-            alt_base = str(alt_base)
+    Regions are counted concurrently by a pool of `num_threads` workers, each with its own open handle to the BAM file,
+    and the results are appended to a single table in region order. Set `use_processes` to False to use a thread pool
+    instead of a process pool. A single worker counts the regions in the calling process.
 
-            if (len(ref_base) != 1) or (len(alt_base) != 1):
-                continue
+    """
 
-            # Skip record with alt base == N
-            if alt_base not in nucleotides:
-                continue
+    regions = list(regions)
 
-            if not report_zero_count_positions and counts[ref_base] == 0 and counts[alt_base] == 0:
-                continue
+    count_kwargs = {
+        'count_duplicates': count_duplicates,
+        'min_bqual': min_bqual,
+        'min_mqual': min_mqual,
+        'report_non_variant_positions': report_non_variant_positions,
+        'report_zero_count_positions': report_zero_count_positions,
+    }
 
-            # Format output record
-            out_row = {
-                'chrom': record.CHROM,
-                'coord': record.POS,
-                'ref': ref_base,
-                'alt': alt_base,
-                'ref_counts': counts[ref_base],
-                'alt_counts': counts[alt_base]
-            }
+    writer = writers.HdfAlleleCountsWriter(
+        out_file,
+        table_name,
+        _region_counts_columns,
+        categories={'chrom': ()},
+        min_itemsize={'chrom': max([len(_parse_region(x)[0]) for x in regions] + [1, ])}
+    )
 
-            data.append(out_row)
+    with writer:
+        if num_threads == 1:
+            with pysam.AlignmentFile(bam_file, 'rb') as bam:
+                for region in regions:
+                    chrom, coords, counts = _get_region_counts(bam, region, **count_kwargs)
 
-    data = pd.DataFrame(data, columns=['chrom', 'coord', 'ref', 'alt', 'ref_counts', 'alt_counts'])
+                    _write_region_counts(writer, chrom, coords, counts)
 
-    for col, value in extra_columns.items():
-        data[col] = value
+        else:
+            # Handles opened by thread workers are closed here, process workers close their own on exit
+            thread_bams = []
 
-    csvutils.write_dataframe_to_csv_and_yaml(
-        data, out_file, dtypes, write_header=write_header
-    )
+            if use_processes:
+                pool = Pool(num_threads, initializer=_init_worker_bam, initargs=(bam_file,))
 
+            else:
+                pool = ThreadPool(num_threads, initializer=_init_worker_bam, initargs=(bam_file, thread_bams))
 
-def get_snv_allele_counts_for_region(
-        bam_file,
-        out_file,
+            count_func = functools.partial(_get_worker_region_counts, **count_kwargs)
+
+            try:
+                for chrom, coords, counts in pool.imap(count_func, regions):
+                    _write_region_counts(writer, chrom, coords, counts)
+
+            finally:
+                pool.close()
+
+                pool.join()
+
+                for bam in thread_bams:
+                    bam.close()
+
+
+def _init_worker_bam(bam_file, thread_bams=None):
+    '''
+    Open the BAM file of a pool worker. Handles of worker threads are added to `thread_bams` to be closed by the caller,
+    and handles of worker processes are closed when the process exits.
+    '''
+
+    _worker_state.bam = pysam.AlignmentFile(bam_file, 'rb')
+
+    if thread_bams is None:
+        multiprocessing.util.Finalize(None, _worker_state.bam.close, exitpriority=10)
+
+    else:
+        thread_bams.append(_worker_state.bam)
+
+
+def _get_worker_region_counts(region, **kwargs):
+    return _get_region_counts(_worker_state.bam, region, **kwargs)
+
+
+def _get_region_counts(
+        bam,
         region,
-        table_name,
         count_duplicates=False,
         min_bqual=0,
         min_mqual=0,
         report_non_variant_positions=True,
         report_zero_count_positions=False):
-
-    bam = pysam.AlignmentFile(bam_file, 'rb')
+    '''
+    Get the forward and reverse strand counts of a region. Returns the chromosome, the 1 based coordinates of the
+    reported positions and an array of counts with the forward (A, C, G, T) followed by the reverse strand counts.
+    '''
 
     chrom, beg, end = _parse_region(region)
 
-    forward_df = _get_counts_df(
+    counts = pileup.count_alleles(
         bam,
         chrom,
-        beg,
-        end,
+        beg - 1,
+        end - 1,
         count_duplicates=count_duplicates,
         min_bqual=min_bqual,
-        min_mqual=min_mqual,
-        strand='forward'
+        min_mqual=min_mqual
     )
 
-    reverse_df = _get_counts_df(
-        bam,
-        chrom,
-        beg,
-        end,
-        count_duplicates=count_duplicates,
-        min_bqual=min_bqual,
-        min_mqual=min_mqual,
-        strand='reverse'
-    )
+    counts = np.concatenate([counts[:, :, pileup.FORWARD], counts[:, :, pileup.REVERSE]], axis=1)
 
-    reverse_df = reverse_df.rename(columns=lambda x: x.lower())
+    coords = np.arange(beg, end)
 
-    df = pd.concat([forward_df, reverse_df], axis=1)
+    keep = np.ones(coords.shape[0], dtype=bool)
 
     if not report_zero_count_positions:
-        df = df[df.sum(axis=1) > 0]
+        keep &= counts.sum(axis=1) > 0
 
-    if (not report_non_variant_positions) and (df.shape[0] > 0):
-        df = df[df.apply(_get_variant_positions_strand, axis=1)]
+    if not report_non_variant_positions:
+        keep &= _get_variant_position_mask(counts[:, :len(nucleotides)] + counts[:, len(nucleotides):], 0)
 
-    df.reset_index(inplace=True)
+    return chrom, coords[keep], counts[keep]
 
-    hdf_store = pd.HDFStore(out_file, 'w', complevel=9, complib='blosc')
 
-    hdf_store[table_name] = df
+def _write_region_counts(writer, chrom, coords, counts):
+    data = {'chrom': writer.encode('chrom', chrom), 'coord': coords}
 
-    hdf_store.close()
+    for idx, (col, _) in enumerate(_region_counts_columns[2:]):
+        data[col] = counts[:, idx]
+
+    writer.write(**data)
 
 
 def get_variant_position_counts(
@@ -181,195 +359,187 @@ def get_variant_position_counts(
         min_normal_depth=0,
         min_tumour_depth=0,
         min_variant_depth=0,
-        report_strand_counts=True):
+        report_strand_counts=True,
+        block_size=int(1e6)):
     """ Get counts for positions with at least two alleles in one or more tumour samples.
 
     This function filters for all positions which exceed the minimum depth in the normal sample and at least one tumour
     sample. It further filters for positions which have at least two alleles present in one or more tumour samples.
 
+    All samples are counted together in blocks of `block_size` positions and filtered on the stacked counts, so only
+    the counts for positions passing the filters are kept in memory.
+
     """
 
     chrom, beg, end = _parse_region(region)
 
-    tumour_samples = tumour_bam_files.keys()
+    samples = ['normal', ] + sorted(tumour_bam_files.keys())
 
-    bams = {'normal': pysam.AlignmentFile(normal_bam_file, 'rb')}
+    bams = [pysam.AlignmentFile(normal_bam_file, 'rb'), ]
 
-    for sample in tumour_samples:
-        bams[sample] = pysam.AlignmentFile(tumour_bam_files[sample], 'rb')
+    for sample in samples[1:]:
+        bams.append(pysam.AlignmentFile(tumour_bam_files[sample], 'rb'))
 
-    counts = {}
+    if report_strand_counts:
+        columns = ['A', 'C', 'G', 'T', 'a', 'c', 'g', 't']
 
-    for sample in bams:
-        if report_strand_counts:
-            forward_df = _get_counts_df(
-                bams[sample],
-                chrom,
-                beg,
-                end,
-                count_duplicates=count_duplicates,
-                min_bqual=min_bqual,
-                min_mqual=min_mqual,
-                strand='forward'
-            )
+    else:
+        columns = ['A', 'C', 'G', 'T']
 
-            reverse_df = _get_counts_df(
-                bams[sample],
-                chrom,
-                beg,
-                end,
-                count_duplicates=count_duplicates,
-                min_bqual=min_bqual,
-                min_mqual=min_mqual,
-                strand='reverse'
-            )
+    hdf_store = pd.HDFStore(out_file, 'w', complevel=9, complib='blosc')
 
-            reverse_df.rename(columns=lambda x: x.lower(), inplace=True)
+    num_rows = 0
 
-            counts[sample] = pd.concat([forward_df, reverse_df], axis=1)
+    for block_beg in range(beg, end, block_size):
+        block_end = min(block_beg + block_size, end)
 
-        else:
-            counts[sample] = _get_counts_df(
-                bams[sample],
+        # Stacked counts with shape (samples, positions, alleles, strands)
+        counts = np.stack([
+            pileup.count_alleles(
+                bam,
                 chrom,
-                beg,
-                end,
+                block_beg - 1,
+                block_end - 1,
                 count_duplicates=count_duplicates,
                 min_bqual=min_bqual,
-                min_mqual=min_mqual,
-                strand='both'
-            )
+                min_mqual=min_mqual
+            ) for bam in bams
+        ])
 
-    # Depth filtering
-    valid_positions = np.zeros(counts['normal'].shape[0], dtype=bool)
+        allele_counts = counts.sum(axis=3)
 
-    for sample in tumour_samples:
-        valid_positions = np.logical_or(valid_positions, counts[sample].sum(axis=1) >= min_tumour_depth)
+        depth = allele_counts.sum(axis=2)
 
-    valid_positions = np.logical_and(valid_positions, counts['normal'].sum(axis=1) >= min_normal_depth)
+        # Depth filtering
+        valid_positions = np.logical_and(
+            (depth[1:] >= min_tumour_depth).any(axis=0),
+            depth[0] >= min_normal_depth
+        )
 
-    for sample in counts:
-        counts[sample] = counts[sample][valid_positions]
+        # Variant position filtering, strand counts have historically ignored the minimum variant depth
+        if report_strand_counts:
+            variant_positions = _get_variant_position_mask(allele_counts[1:], 0).any(axis=0)
 
-    # Skip filtering if there are no valid positions
-    if np.sum(valid_positions) > 0:
-        # Variant position filtering
-        variant_positions = np.zeros(counts['normal'].shape[0], dtype=bool)
+        else:
+            variant_positions = _get_variant_position_mask(allele_counts[1:], min_variant_depth).any(axis=0)
 
-        for sample in tumour_samples:
-            if report_strand_counts:
-                variant_positions = np.logical_or(
-                    variant_positions, counts[sample].apply(_get_variant_positions_strand, axis=1))
+        position_idxs = np.where(np.logical_and(valid_positions, variant_positions))[0]
 
-            else:
-                variant_positions = np.logical_or(
-                    variant_positions, counts[sample].apply(lambda x: _get_variant_positions(x, min_variant_depth), axis=1))
+        if position_idxs.shape[0] == 0:
+            continue
 
-        for sample in counts:
-            counts[sample] = counts[sample][variant_positions]
+        if report_strand_counts:
+            counts = np.concatenate([counts[:, :, :, pileup.FORWARD], counts[:, :, :, pileup.REVERSE]], axis=2)
 
-    # Write output
-    hdf_store = pd.HDFStore(out_file, 'w', complevel=9, complib='blosc')
+        else:
+            counts = allele_counts
 
-    for sample in counts:
-        df = counts[sample]
+        counts = counts[:, position_idxs]
 
-        df.reset_index(inplace=True)
+        coords = block_beg + position_idxs
 
-        table_name = '/'.join((table_group, sample))
+        for sample_idx, sample in enumerate(samples):
+            df = _get_sample_counts_df(chrom, coords, counts[sample_idx], columns)
 
-        hdf_store.append(table_name, df)
+            hdf_store.append('/'.join((table_group, sample)), df)
 
-    hdf_store.close()
+        num_rows += position_idxs.shape[0]
 
+    if num_rows == 0:
+        for sample in samples:
+            df = _get_sample_counts_df(chrom, np.zeros(0, dtype=np.int64), np.zeros((0, len(columns)), dtype=np.int32), columns)
 
-def _get_counts_df(bam_file,
-                   chrom,
-                   beg,
-                   end,
-                   count_duplicates=False,
-                   min_bqual=30,
-                   min_mqual=30,
-                   strand='both',
-                   report_zero_count_positions=True):
-    '''
-    Get counts 1 based indexing.
-    '''
+            hdf_store.append('/'.join((table_group, sample)), df)
 
-    x = bam_file.count_coverage(
-        chrom,
-        beg - 1,
-        end - 1,
-        quality_threshold=min_bqual,
-        read_callback=lambda x: _check_read(
-            x,
-            count_duplicates=count_duplicates,
-            min_mqual=min_mqual,
-            strand=strand)
-    )
+    hdf_store.close()
 
-    if not report_zero_count_positions:
-        if np.array(x).sum() == 0:
-            return None
 
-    df = pd.DataFrame(pd.np.array(x).T, columns=['A', 'C', 'G', 'T'])
+def _get_sample_counts_df(chrom, coords, counts, columns):
+    df = pd.DataFrame(counts, columns=columns)
 
     df.insert(0, 'chrom', chrom)
 
-    df.insert(1, 'coord', np.arange(beg, end))
-
-    df = df.set_index(['chrom', 'coord'])
+    df.insert(1, 'coord', coords)
 
     return df
 
 
-def _check_read(read, count_duplicates=False, min_mqual=30, strand='both'):
-    valid = True
+def _get_variant_position_mask(allele_counts, min_variant_depth):
+    '''
+    Find positions where the second most common allele has more than `min_variant_depth` reads. Alleles are expected
+    along the last axis of `allele_counts`.
+    '''
 
-    if read.mapping_quality < min_mqual:
-        valid = False
+    return np.sort(allele_counts, axis=-1)[..., -2] > min_variant_depth
 
-    elif read.is_duplicate and (not count_duplicates):
-        valid = False
 
-    elif read.is_unmapped:
-        valid = False
+def _get_target_site_counts(
+        bam_file,
+        chroms,
+        coords,
+        count_duplicates=False,
+        min_bqual=0,
+        min_mqual=0,
+        max_window_gap=1000,
+        max_window_size=int(1e5)):
+    '''
+    Get the unstranded counts of each nucleotide at a list of 1 based target sites.
 
-    elif read.is_qcfail:
-        valid = False
+    Nearby sites are grouped into windows which are counted with a single pass over the BAM file. Returns an array with
+    one row of (A, C, G, T) counts per target in input order.
+    '''
 
-    elif read.is_secondary:
-        valid = False
+    site_counts = np.zeros((len(coords), len(nucleotides)), dtype=np.int32)
 
-    elif (strand == 'reverse') and (not read.is_reverse):
-        valid = False
+    coords = np.asarray(coords, dtype=np.int64)
 
-    elif (strand == 'forward') and (read.is_reverse):
-        valid = False
+    chroms = np.asarray(chroms, dtype=object)
 
-    return valid
+    for chrom in pd.unique(chroms):
+        target_idxs = np.where(chroms == chrom)[0]
 
+        target_idxs = target_idxs[np.argsort(coords[target_idxs], kind='mergesort')]
 
-def _get_variant_positions(row, min_variant_depth):
-    counts = sorted(row, reverse=True)
+        for window_idxs in _get_target_windows(coords[target_idxs], max_window_gap, max_window_size):
+            window_idxs = target_idxs[window_idxs]
 
-    if counts[1] > min_variant_depth:
-        return True
+            beg = coords[window_idxs[0]]
 
-    else:
-        return False
+            end = coords[window_idxs[-1]] + 1
 
+            window_counts = pileup.count_alleles(
+                bam_file,
+                chrom,
+                beg - 1,
+                end - 1,
+                count_duplicates=count_duplicates,
+                min_bqual=min_bqual,
+                min_mqual=min_mqual
+            )
 
-def _get_variant_positions_strand(row):
-    counts = [row[x.lower()] + row[x.upper()] for x in nucleotides]
+            site_counts[window_idxs] = window_counts.sum(axis=2)[coords[window_idxs] - beg]
 
-    counts = sorted(counts, reverse=True)
+    return site_counts
 
-    if counts[1] > 0:
-        return True
 
-    else:
-        return False
+def _get_target_windows(coords, max_window_gap, max_window_size):
+    '''
+    Split sorted coordinates into groups spanning at most `max_window_size` bases with no gaps larger than
+    `max_window_gap` between neighbouring sites. Yields arrays of indices into `coords`.
+    '''
+
+    if len(coords) == 0:
+        return
+
+    window_beg = 0
+
+    for idx in range(1, len(coords)):
+        if (coords[idx] - coords[idx - 1] > max_window_gap) or (coords[idx] - coords[window_beg] >= max_window_size):
+            yield np.arange(window_beg, idx)
+
+            window_beg = idx
+
+    yield np.arange(window_beg, len(coords))
 
 
 def _parse_region(region):
@@ -0,0 +1,244 @@
+'''
+Chunked writers for allele count tables.
+
+Rows are accumulated in fixed dtype numpy column buffers, with string columns stored as integer codes, and written to
+the output file whenever the buffers fill up so memory use does not depend on the number of rows.
+'''
+from collections import OrderedDict
+
+import abc
+import gzip
+import numpy as np
+import pandas as pd
+
+from single_cell.utils import csvutils
+
+import biowrappers.components.io.csv.tasks as csv_tasks
+
+
+class CategoryEncoder(object):
+    '''
+    Map the values of a string column to integer codes, adding new values as they are seen.
+    '''
+
+    def __init__(self, categories=()):
+        self.categories = []
+
+        self._codes = {}
+
+        for value in categories:
+            self.encode(value)
+
+    def decode(self, codes):
+        return np.asarray(self.categories, dtype=object)[codes]
+
+    def encode(self, value):
+        if value not in self._codes:
+            self._codes[value] = len(self.categories)
+
+            self.categories.append(value)
+
+        return self._codes[value]
+
+
+class AlleleCountsWriter(abc.ABCMeta('AbstractAlleleCountsWriter', (object,), {})):
+    '''
+    Base class for writing tables of allele counts in chunks.
+
+    :param columns: list of (name, dtype) pairs giving the order and buffer type of the columns.
+
+    :param categories: dict mapping names of string columns to initial categories. These columns are written to the
+        buffers as codes from `encode`.
+
+    :param constant_columns: dict of columns with a single value which are added to every chunk.
+
+    :param chunk_size: number of rows to buffer before writing.
+
+    Used as a context manager the writer is closed on exit. If an exception was raised the output file is closed
+    without writing the buffered rows.
+    '''
+
+    def __init__(self, columns, categories=None, constant_columns=None, chunk_size=int(1e5)):
+        self.columns = OrderedDict(columns)
+
+        self.encoders = {}
+
+        for name, values in (categories or {}).items():
+            self.encoders[name] = CategoryEncoder(values)
+
+        self.constant_columns = constant_columns or {}
+
+        self.chunk_size = chunk_size
+
+        self.num_rows_written = 0
+
+        self._buffers = OrderedDict()
+
+        for name, dtype in self.columns.items():
+            self._buffers[name] = np.empty(chunk_size, dtype=dtype)
+
+        self._size = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+
+        else:
+            self._close(None)
+
+    def encode(self, name, value):
+        return self.encoders[name].encode(value)
+
+    def write(self, **data):
+        '''
+        Append rows to the table. Each column is given as an array or a scalar which is repeated for every row.
+        '''
+        sizes = [np.size(x) for x in data.values() if np.ndim(x) > 0]
+
+        if len(sizes) > 0:
+            num_rows = max(sizes)
+
+        else:
+            num_rows = 1
+
+        offset = 0
+
+        while offset < num_rows:
+            size = min(num_rows - offset, self.chunk_size - self._size)
+
+            for name in self.columns:
+                value = data[name]
+
+                if np.ndim(value) > 0:
+                    value = value[offset:offset + size]
+
+                self._buffers[name][self._size:self._size + size] = value
+
+            self._size += size
+
+            offset += size
+
+            if self._size == self.chunk_size:
+                self.flush()
+
+    def flush(self):
+        if self._size == 0:
+            return
+
+        self._write_chunk(self._get_chunk_df(self._size))
+
+        self.num_rows_written += self._size
+
+        self._size = 0
+
+    def close(self):
+        self.flush()
+
+        self._close(self._get_chunk_df(0))
+
+    def _get_chunk_df(self, size):
+        df = pd.DataFrame(OrderedDict([(name, buf[:size].copy()) for name, buf in self._buffers.items()]))
+
+        for name, encoder in self.encoders.items():
+            df[name] = encoder.decode(df[name].values)
+
+        for name, value in self.constant_columns.items():
+            df[name] = value
+
+        return df
+
+    @abc.abstractmethod
+    def _write_chunk(self, df):
+        '''
+        Write a chunk of rows to the output file.
+        '''
+
+    @abc.abstractmethod
+    def _close(self, empty_df):
+        '''
+        Close the output file. `empty_df` is a table with no rows and the output columns, or None if the writer is
+        closed after an error.
+        '''
+
+
+class CsvAlleleCountsWriter(AlleleCountsWriter):
+    '''
+    Write allele counts to a CSV file with a YAML description of the columns.
+
+    The file is gzip compressed if `out_file` ends with `.gz` or `.gz.tmp`. The YAML file is written by `csvutils`,
+    and the header and chunks are written by the writer so they are compressed the same way, with the header in its
+    own gzip member.
+    '''
+
+    def __init__(self, out_file, columns, dtypes=None, write_header=True, **kwargs):
+        AlleleCountsWriter.__init__(self, columns, **kwargs)
+
+        self.out_file = out_file
+
+        self.dtypes = dtypes
+
+        self.compress = out_file.endswith('.gz') or out_file.endswith('.gz.tmp')
+
+        empty_df = self._get_chunk_df(0)
+
+        # Only the YAML file is kept, the CSV file is replaced below
+        csvutils.write_dataframe_to_csv_and_yaml(empty_df, out_file, dtypes, write_header=write_header)
+
+        self._fh = open(out_file, 'wb')
+
+        if write_header and self.compress:
+            csv_tasks.write_gzip_member(self._fh, empty_df.to_csv(index=False))
+
+        elif write_header:
+            self._fh.write(empty_df.to_csv(index=False).encode('utf-8'))
+
+        if self.compress:
+            self._out_fh = gzip.GzipFile(fileobj=self._fh, mode='wb')
+
+        else:
+            self._out_fh = self._fh
+
+    def _write_chunk(self, df):
+        self._out_fh.write(df.to_csv(header=False, index=False).encode('utf-8'))
+
+    def _close(self, empty_df):
+        if self.compress:
+            self._out_fh.close()
+
+        self._fh.close()
+
+
+class HdfAlleleCountsWriter(AlleleCountsWriter):
+    '''
+    Write allele counts to a table in an HDF5 file.
+
+    :param min_itemsize: dict giving the maximum length of each string column, which must be known before the first
+        chunk is written.
+    '''
+
+    def __init__(self, out_file, table_name, columns, min_itemsize, **kwargs):
+        AlleleCountsWriter.__init__(self, columns, **kwargs)
+
+        missing = sorted(set(self.encoders) - set(min_itemsize))
+
+        if len(missing) > 0:
+            raise Exception('min_itemsize is required for string columns: {0}'.format(', '.join(missing)))
+
+        self.table_name = table_name
+
+        self.min_itemsize = min_itemsize
+
+        self._store = pd.HDFStore(out_file, 'w', complevel=9, complib='blosc')
+
+    def _write_chunk(self, df):
+        self._store.append(self.table_name, df, min_itemsize=self.min_itemsize)
+
+    def _close(self, empty_df):
+        # Empty tables cannot be stored in table format
+        if (empty_df is not None) and (self.num_rows_written == 0):
+            self._store.put(self.table_name, empty_df)
+
+        self._store.close()
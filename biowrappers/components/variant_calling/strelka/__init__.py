@@ -93,7 +93,7 @@ def create_strelka_workflow(
             pypeliner.managed.TempInputFile('somatic.indels.unfiltered.vcf', 'chrom', 'coord'),
             pypeliner.managed.TempInputFile('strelka.stats', 'chrom', 'coord'),
             pypeliner.managed.TempInputFile('somatic.indels.unfiltered.vcf.window', 'chrom', 'coord'),
-            pypeliner.managed.TempOutputFile('somatic.indels.filtered.vcf', 'chrom'),
+            pypeliner.managed.TempOutputFile('somatic.indels.filtered.vcf.gz', 'chrom'),
             pypeliner.managed.TempInputObj('chrom_dummy', 'chrom'),
             pypeliner.managed.TempInputObj('known_sizes', 'chrom')
         ),
@@ -108,7 +108,7 @@ def create_strelka_workflow(
         args=(
             pypeliner.managed.TempInputFile('somatic.snvs.unfiltered.vcf', 'chrom', 'coord'),
             pypeliner.managed.TempInputFile('strelka.stats', 'chrom', 'coord'),
-            pypeliner.managed.TempOutputFile('somatic.snvs.filtered.vcf', 'chrom'),
+            pypeliner.managed.TempOutputFile('somatic.snvs.filtered.vcf.gz', 'chrom'),
             pypeliner.managed.TempInputObj('chrom_dummy', 'chrom'),
             pypeliner.managed.TempInputObj('known_sizes', 'chrom')
         ),
@@ -120,8 +120,8 @@ def create_strelka_workflow(
         ctx={'mem': 4, 'num_retry': 3, 'mem_retry_increment': 2},
         func=vcf_tasks.concatenate_vcf,
         args=(
-            pypeliner.managed.TempInputFile('somatic.indels.filtered.vcf', 'chrom'),
-            pypeliner.managed.TempOutputFile('somatic.indels.filtered.vcf.gz')
+            pypeliner.managed.TempInputFile('somatic.indels.filtered.vcf.gz', 'chrom'),
+            pypeliner.managed.TempOutputFile('somatic.indels.merged.vcf.gz')
         )
     )
 
@@ -130,45 +130,27 @@ def create_strelka_workflow(
         ctx={'mem': 4, 'num_retry': 3, 'mem_retry_increment': 2},
         func=vcf_tasks.concatenate_vcf,
         args=(
-            pypeliner.managed.TempInputFile('somatic.snvs.filtered.vcf', 'chrom'),
-            pypeliner.managed.TempOutputFile('somatic.snvs.filtered.vcf.gz')
+            pypeliner.managed.TempInputFile('somatic.snvs.filtered.vcf.gz', 'chrom'),
+            pypeliner.managed.TempOutputFile('somatic.snvs.merged.vcf.gz')
         )
     )
 
     workflow.transform(
         name='filter_indels',
         ctx={'mem': 4, 'num_retry': 3, 'mem_retry_increment': 2},
-        func=vcf_tasks.filter_vcf,
+        func=vcf_tasks.filter_and_compress_vcf,
         args=(
-            pypeliner.managed.TempInputFile('somatic.indels.filtered.vcf.gz'),
-            pypeliner.managed.TempOutputFile('somatic.indels.passed.vcf')
+            pypeliner.managed.TempInputFile('somatic.indels.merged.vcf.gz'),
+            pypeliner.managed.OutputFile(indel_vcf_file)
         )
     )
 
     workflow.transform(
         name='filter_snvs',
         ctx={'mem': 4, 'num_retry': 3, 'mem_retry_increment': 2},
-        func=vcf_tasks.filter_vcf,
-        args=(
-            pypeliner.managed.TempInputFile('somatic.snvs.filtered.vcf.gz'),
-            pypeliner.managed.TempOutputFile('somatic.snvs.passed.vcf')
-        )
-    )
-
-    workflow.transform(
-        name='finalise_indels',
-        func=vcf_tasks.finalise_vcf,
-        args=(
-            pypeliner.managed.TempInputFile('somatic.indels.passed.vcf'),
-            pypeliner.managed.OutputFile(indel_vcf_file)
-        )
-    )
-
-    workflow.transform(
-        name='finalise_snvs',
-        func=vcf_tasks.finalise_vcf,
+        func=vcf_tasks.filter_and_compress_vcf,
         args=(
-            pypeliner.managed.TempInputFile('somatic.snvs.passed.vcf'),
+            pypeliner.managed.TempInputFile('somatic.snvs.merged.vcf.gz'),
             pypeliner.managed.OutputFile(snv_vcf_file)
         )
     )
@@ -9,11 +9,13 @@ from collections import OrderedDict
 
 import csv
 import ConfigParser
+import itertools
 import math
+import numpy as np
 import pandas as pd
 import pypeliner
+import pysam
 import re
-import vcf
 
 FILTER_ID_BASE = 'BCNoise'
 FILTER_ID_DEPTH = 'DP'
@@ -118,80 +120,90 @@ def filter_snv_file_list(
         max_filtered_basecall_frac=0.4,
         max_spanning_deletion_frac=0.75,
         quality_lower_bound=15,
-        use_depth_filter=True):
+        use_depth_filter=True,
+        batch_size=int(1e4)):
+    """ Add filters to Strelka SNV calls and write them as a bgzip compressed VCF.
 
-    max_normal_coverage = _get_max_normal_coverage(chrom, depth_filter_multiple, known_chrom_size, stats_files)
-
-    writer = None
-
-    with open(out_file, 'wb') as out_fh:
-        for key in sorted(in_files):
-            reader = vcf.Reader(filename=in_files[key])
+    Only the INFO and FORMAT fields used by the filters are decoded and the filters are evaluated for batches of
+    `batch_size` records at a time.
 
-            if writer is None:
-                # Add filters to header
-                if use_depth_filter:
-                    reader.filters[FILTER_ID_DEPTH] = vcf.parser._Filter(
-                        id=FILTER_ID_DEPTH,
-                        desc='Greater than {0}x chromosomal mean depth in Normal sample'.format(depth_filter_multiple)
-                    )
+    """
 
-                reader.filters[FILTER_ID_BASE] = vcf.parser._Filter(
-                    id=FILTER_ID_BASE,
-                    desc='Fraction of basecalls filtered at this site in either sample is at or above {0}'.format(
-                        max_filtered_basecall_frac)
-                )
+    max_normal_coverage = _get_max_normal_coverage(chrom, depth_filter_multiple, known_chrom_size, stats_files)
 
-                reader.filters[FILTER_ID_SPANNING_DELETION] = vcf.parser._Filter(
-                    id=FILTER_ID_SPANNING_DELETION,
-                    desc='Fraction of reads crossing site with spanning deletions in either sample exceeeds {0}'.format(
-                        max_spanning_deletion_frac)
-                )
+    header = _get_header(in_files)
+
+    # Add filters to header
+    if use_depth_filter:
+        header.filters.add(
+            FILTER_ID_DEPTH,
+            None,
+            None,
+            'Greater than {0}x chromosomal mean depth in Normal sample'.format(depth_filter_multiple)
+        )
+
+    header.filters.add(
+        FILTER_ID_BASE,
+        None,
+        None,
+        'Fraction of basecalls filtered at this site in either sample is at or above {0}'.format(
+            max_filtered_basecall_frac)
+    )
 
-                reader.filters[FILTER_ID_QSS] = vcf.parser._Filter(
-                    id=FILTER_ID_QSS,
-                    desc='Normal sample is not homozygous ref or ssnv Q-score < {0}, ie calls with NT!=ref or QSS_NT < {0}'.format(
-                        quality_lower_bound)
-                )
+    header.filters.add(
+        FILTER_ID_SPANNING_DELETION,
+        None,
+        None,
+        'Fraction of reads crossing site with spanning deletions in either sample exceeeds {0}'.format(
+            max_spanning_deletion_frac)
+    )
 
-                writer = vcf.Writer(out_fh, reader)
+    header.filters.add(
+        FILTER_ID_QSS,
+        None,
+        None,
+        'Normal sample is not homozygous ref or ssnv Q-score < {0}, ie calls with NT!=ref or QSS_NT < {0}'.format(
+            quality_lower_bound)
+    )
 
-            for record in reader:
-                normal = record.genotype('NORMAL')
+    writer = pysam.VariantFile(out_file, 'wz', header=header)
 
-                tumour = record.genotype('TUMOR')
+    for _, records in _iter_record_batches(in_files, header, batch_size):
+        normal_dp = _get_format_values(records, 'NORMAL', 'DP')
 
-                # Normal depth filter
-                if use_depth_filter and (normal.data.DP > max_normal_coverage):
-                    record.add_filter(FILTER_ID_DEPTH)
+        tumour_dp = _get_format_values(records, 'TUMOR', 'DP')
 
-                # Filtered basecall fraction
-                normal_filtered_base_call_fraction = _get_filtered_base_call_fraction(normal.data)
+        filters = OrderedDict()
 
-                tumour_filtered_base_call_fraction = _get_filtered_base_call_fraction(tumour.data)
+        # Normal depth filter
+        if use_depth_filter:
+            filters[FILTER_ID_DEPTH] = normal_dp > max_normal_coverage
 
-                if (normal_filtered_base_call_fraction >= max_filtered_basecall_frac) or \
-                   (tumour_filtered_base_call_fraction >= max_filtered_basecall_frac):
+        # Filtered basecall fraction
+        normal_filtered_base_call_fraction = _get_fraction(_get_format_values(records, 'NORMAL', 'FDP'), normal_dp)
 
-                    record.add_filter(FILTER_ID_BASE)
+        tumour_filtered_base_call_fraction = _get_fraction(_get_format_values(records, 'TUMOR', 'FDP'), tumour_dp)
 
-                # Spanning deletion fraction
-                normal_spanning_deletion_fraction = _get_spanning_deletion_fraction(normal.data)
+        filters[FILTER_ID_BASE] = (normal_filtered_base_call_fraction >= max_filtered_basecall_frac) | \
+            (tumour_filtered_base_call_fraction >= max_filtered_basecall_frac)
 
-                tumour_spanning_deletion_fraction = _get_spanning_deletion_fraction(tumour.data)
+        # Spanning deletion fraction
+        normal_spanning_deletion_fraction = _get_spanning_deletion_fraction(
+            normal_dp, _get_format_values(records, 'NORMAL', 'SDP'))
 
-                if (normal_spanning_deletion_fraction > max_spanning_deletion_frac) or \
-                   (tumour_spanning_deletion_fraction > max_spanning_deletion_frac):
+        tumour_spanning_deletion_fraction = _get_spanning_deletion_fraction(
+            tumour_dp, _get_format_values(records, 'TUMOR', 'SDP'))
 
-                    record.add_filter(FILTER_ID_SPANNING_DELETION)
+        filters[FILTER_ID_SPANNING_DELETION] = (normal_spanning_deletion_fraction > max_spanning_deletion_frac) | \
+            (tumour_spanning_deletion_fraction > max_spanning_deletion_frac)
 
-                # Q-val filter
-                if (record.INFO['NT'] != 'ref') or (record.INFO['QSS_NT'] < quality_lower_bound):
-                    record.add_filter(FILTER_ID_QSS)
+        # Q-val filter
+        filters[FILTER_ID_QSS] = (_get_info_values(records, 'NT', dtype=object) != 'ref') | \
+            (_get_info_values(records, 'QSS_NT') < quality_lower_bound)
 
-                writer.write_record(record)
+        _write_filtered_records(writer, records, filters)
 
-        writer.close()
+    writer.close()
 
 
 def _get_max_normal_coverage(chrom, depth_filter_multiple, known_chrom_size, stats_files):
@@ -227,24 +239,18 @@ def _get_normal_coverage(stats_files):
     return total_coverage
 
 
-def _get_filtered_base_call_fraction(data):
-    frac = 0
-
-    if data.DP > 0:
-        frac = data.FDP / data.DP
-
-    return frac
+def _get_fraction(numerator, denominator):
+    frac = np.zeros(len(numerator))
 
+    nonzero = denominator > 0
 
-def _get_spanning_deletion_fraction(data):
-    total = data.DP + data.SDP
+    frac[nonzero] = numerator[nonzero] / denominator[nonzero]
 
-    frac = 0
+    return frac
 
-    if total > 0:
-        frac = data.SDP / total
 
-    return frac
+def _get_spanning_deletion_fraction(dp, sdp):
+    return _get_fraction(sdp, dp + sdp)
 
 #=======================================================================================================================
 # Indel filtering
@@ -263,177 +269,265 @@ def filter_indel_file_list(
         max_ref_repeat=8,
         max_window_filtered_basecall_frac=0.3,
         quality_lower_bound=30,
-        use_depth_filter=True):
+        use_depth_filter=True,
+        batch_size=int(1e4)):
+    """ Add window depths and filters to Strelka indel calls and write them as a bgzip compressed VCF.
 
-    window_cols = (
-        'chrom',
-        'coord',
-        'normal_window_used',
-        'normal_window_filtered',
-        'normal_window_submap',
-        'tumour_window_used',
-        'tumour_window_filtered',
-        'tumour_window_submap'
-    )
+    Only the INFO and FORMAT fields used by the filters are decoded and the filters are evaluated for batches of
+    `batch_size` records at a time.
+
+    """
 
     max_normal_coverage = _get_max_normal_coverage(chrom, depth_filter_multiple, known_chrom_size, stats_files)
 
-    writer = None
+    header = _get_header(vcf_files)
 
-    with open(out_file, 'wb') as out_fh:
-        for key in sorted(vcf_files):
-            window = pd.read_csv(
-                window_files[key],
-                comment='#',
-                        converters={'chrom': str},
-                header=None,
-                names=window_cols,
-                sep='\t')
+    # Add format to header
+    header.formats.add('DP50', 1, 'Float', 'Average tier1 read depth within 50 bases')
 
-            reader = vcf.Reader(filename=vcf_files[key])
+    header.formats.add(
+        'FDP50',
+        1,
+        'Float',
+        'Average tier1 number of basecalls filtered from original read depth within 50 bases'
+    )
 
-            if writer is None:
-                # Add format to header
-                reader.formats['DP50'] = vcf.parser._Format(
-                    id='DP50',
-                    num=1,
-                    type='Float',
-                    desc='Average tier1 read depth within 50 bases'
-                )
+    header.formats.add(
+        'SUBDP50',
+        1,
+        'Float',
+        'Average number of reads below tier1 mapping quality threshold aligned across sites within 50 bases'
+    )
 
-                reader.formats['FDP50'] = vcf.parser._Format(
-                    id='FDP50',
-                    num=1,
-                    type='Float',
-                    desc='Average tier1 number of basecalls filtered from original read depth within 50 bases'
-                )
+    # Add filters to header
+    if use_depth_filter:
+        header.filters.add(
+            FILTER_ID_DEPTH,
+            None,
+            None,
+            'Greater than {0}x chromosomal mean depth in Normal sample'.format(depth_filter_multiple)
+        )
+
+    header.filters.add(
+        FILTER_ID_REPEAT,
+        None,
+        None,
+        'Sequence repeat of more than {0}x in the reference sequence'.format(max_ref_repeat)
+    )
 
-                reader.formats['SUBDP50'] = vcf.parser._Format(
-                    id='SUBDP50',
-                    num=1,
-                    type='Float',
-                    desc='Average number of reads below tier1 mapping quality threshold aligned across sites within 50 bases'
-                )
+    header.filters.add(
+        FILTER_ID_INDEL_HPOL,
+        None,
+        None,
+        'Indel overlaps an interrupted homopolymer longer than {0}x in the reference sequence'.format(
+            max_int_hpol_length)
+    )
 
-                # Add filters to header
-                if use_depth_filter:
-                    reader.filters[FILTER_ID_DEPTH] = vcf.parser._Filter(
-                        id=FILTER_ID_DEPTH,
-                        desc='Greater than {0}x chromosomal mean depth in Normal sample'.format(depth_filter_multiple)
-                    )
+    header.filters.add(
+        FILTER_ID_BASE,
+        None,
+        None,
+        'Average fraction of filtered basecalls within 50 bases of the indel exceeds {0}'.format(
+            max_window_filtered_basecall_frac)
+    )
 
-                reader.filters[FILTER_ID_REPEAT] = vcf.parser._Filter(
-                    id=FILTER_ID_REPEAT,
-                    desc='Sequence repeat of more than {0}x in the reference sequence'.format(max_ref_repeat)
-                )
+    header.filters.add(
+        FILTER_ID_QSI,
+        None,
+        None,
+        'Normal sample is not homozygous ref or sindel Q-score < {0}, ie calls with NT!=ref or QSI_NT < {0}'.format(
+            quality_lower_bound)
+    )
 
-                reader.filters[FILTER_ID_INDEL_HPOL] = vcf.parser._Filter(
-                    id=FILTER_ID_INDEL_HPOL,
-                    desc='Indel overlaps an interrupted homopolymer longer than {0}x in the reference sequence'.format(
-                        max_int_hpol_length)
-                )
+    writer = pysam.VariantFile(out_file, 'wz', header=header)
 
-                reader.filters[FILTER_ID_BASE] = vcf.parser._Filter(
-                    id=FILTER_ID_BASE,
-                    desc='Average fraction of filtered basecalls within 50 bases of the indel exceeds {0}'.format(
-                        max_window_filtered_basecall_frac)
-                )
+    window = None
 
-                reader.filters[FILTER_ID_QSI] = vcf.parser._Filter(
-                    id=FILTER_ID_QSI,
-                    desc='Normal sample is not homozygous ref or sindel Q-score < {0}, ie calls with NT!=ref or QSI_NT < {0}'.format(
-                        quality_lower_bound)
-                )
+    window_key = None
 
-                writer = vcf.Writer(out_fh, reader)
+    for key, records in _iter_record_batches(vcf_files, header, batch_size):
+        if key != window_key:
+            if window is not None:
+                window.close()
 
-            for record in reader:
-                window_row = window.loc[
-                    (window['chrom'] == str(record.CHROM)) & (window['coord'] == record.POS)].iloc[0]
+            window = IndelWindowReader(window_files[key])
 
-                normal = record.genotype('NORMAL')
+            window_key = key
 
-                tumour = record.genotype('TUMOR')
+        window_data = np.zeros((len(records), 2, 3))
 
-                normal_data = normal.data._asdict()
+        # Add window data to vcf records
+        for record_idx, record in enumerate(records):
+            window_row = window.get_row(str(record.chrom), record.pos)
 
-                tumour_data = tumour.data._asdict()
+            for sample_idx, (sample, prefix) in enumerate((('NORMAL', 'normal'), ('TUMOR', 'tumour'))):
+                data = record.samples[sample]
 
-                # Add window data to vcf record
-                record.add_format('DP50')
+                data['DP50'] = window_row[prefix + '_window_used'] + window_row[prefix + '_window_filtered']
 
-                record.add_format('FDP50')
+                data['FDP50'] = window_row[prefix + '_window_filtered']
 
-                record.add_format('SUBDP50')
+                data['SUBDP50'] = window_row[prefix + '_window_submap']
 
-                normal_data['DP50'] = window_row['normal_window_used'] + window_row['normal_window_filtered']
+                window_data[record_idx, sample_idx] = (data['DP50'], data['FDP50'], data['SUBDP50'])
 
-                normal_data['FDP50'] = window_row['normal_window_filtered']
+        filters = OrderedDict()
 
-                normal_data['SUBDP50'] = window_row['normal_window_submap']
+        # Normal depth filter
+        if use_depth_filter:
+            filters[FILTER_ID_DEPTH] = _get_format_values(records, 'NORMAL', 'DP') > max_normal_coverage
 
-                tumour_data['DP50'] = window_row['tumour_window_used'] + window_row['tumour_window_filtered']
+        # Ref repeat
+        filters[FILTER_ID_REPEAT] = _get_info_values(records, 'RC', missing=-1) > max_ref_repeat
 
-                tumour_data['FDP50'] = window_row['tumour_window_filtered']
+        # Indel homopolymer
+        filters[FILTER_ID_INDEL_HPOL] = _get_info_values(records, 'IHP', missing=-1) > max_int_hpol_length
 
-                tumour_data['SUBDP50'] = window_row['tumour_window_submap']
+        # Base filter
+        normal_filtered_base_call_fraction = _get_fraction(window_data[:, 0, 1], window_data[:, 0, 0])
 
-                normal.data = _convert_dict_to_call(normal_data)
+        tumour_filtered_base_call_fraction = _get_fraction(window_data[:, 1, 1], window_data[:, 1, 0])
 
-                tumour.data = _convert_dict_to_call(tumour_data)
+        filters[FILTER_ID_BASE] = (normal_filtered_base_call_fraction >= max_window_filtered_basecall_frac) | \
+            (tumour_filtered_base_call_fraction >= max_window_filtered_basecall_frac)
 
-                # Add filters
+        # Q-val filter
+        filters[FILTER_ID_QSI] = (_get_info_values(records, 'NT', dtype=object) != 'ref') | \
+            (_get_info_values(records, 'QSI_NT') < quality_lower_bound)
 
-                # Normal depth filter
-                if use_depth_filter and (normal.data.DP > max_normal_coverage):
-                    record.add_filter(FILTER_ID_DEPTH)
+        _write_filtered_records(writer, records, filters)
 
-                # Ref repeat
-                if 'RC' in record.INFO:
-                    ref_repeat = record.INFO['RC']
+    if window is not None:
+        window.close()
 
-                    if ref_repeat > max_ref_repeat:
-                        record.add_filter(FILTER_ID_REPEAT)
+    writer.close()
 
-                # Indel homopolymer
-                if 'IHP' in record.INFO:
-                    indel_homopolymer = record.INFO['IHP']
 
-                    if indel_homopolymer > max_int_hpol_length:
-                        record.add_filter(FILTER_ID_INDEL_HPOL)
+class IndelWindowReader(object):
+    '''
+    Sequential lookup of rows in a Strelka indel window file.
 
-                # Base filter
-                normal_filtered_base_call_fraction = _get_filtered_base_call_fraction_indel(normal.data)
+    Records must be looked up in the order of the window file, so the VCF and window file are traversed together in a
+    single pass.
+    '''
 
-                tumour_filtered_base_call_fraction = _get_filtered_base_call_fraction_indel(tumour.data)
+    columns = (
+        'chrom',
+        'coord',
+        'normal_window_used',
+        'normal_window_filtered',
+        'normal_window_submap',
+        'tumour_window_used',
+        'tumour_window_filtered',
+        'tumour_window_submap'
+    )
 
-                if (normal_filtered_base_call_fraction >= max_window_filtered_basecall_frac) or \
-                   (tumour_filtered_base_call_fraction >= max_window_filtered_basecall_frac):
+    def __init__(self, file_name):
+        self._fh = open(file_name)
 
-                    record.add_filter(FILTER_ID_BASE)
+        self._rows = self._iter_rows()
 
-                # Q-val filter
-                if (record.INFO['NT'] != 'ref') or (record.INFO['QSI_NT'] < quality_lower_bound):
-                    record.add_filter(FILTER_ID_QSI)
+        self._row = next(self._rows, None)
 
-                writer.write_record(record)
+    def close(self):
+        self._fh.close()
 
-        writer.close()
+    def get_row(self, chrom, coord):
+        '''
+        Get the first row at a position, skipping over rows before it.
+        '''
+        while (self._row is not None) and ((self._row['chrom'] != chrom) or (self._row['coord'] < coord)):
+            self._row = next(self._rows, None)
 
+        if (self._row is None) or (self._row['coord'] != coord):
+            raise Exception('No indel window data for {0}:{1}'.format(chrom, coord))
 
-def _convert_dict_to_call(data_dict):
-    call_data_class = vcf.model.make_calldata_tuple(data_dict.keys())
+        return self._row
 
-    return call_data_class(**data_dict)
+    def _iter_rows(self):
+        for line in self._fh:
+            if line.startswith('#'):
+                continue
 
+            values = line.rstrip('\n').split('\t')
 
-def _get_filtered_base_call_fraction_indel(data):
-    frac = 0
+            row = {'chrom': values[0], 'coord': int(values[1])}
 
-    if data.DP50 > 0:
-        frac = data.FDP50 / data.DP50
+            for col, value in zip(self.columns[2:], values[2:]):
+                row[col] = _parse_number(value)
 
-    return frac
+            yield row
+
+
+def _parse_number(value):
+    try:
+        return int(value)
+
+    except ValueError:
+        return float(value)
+
+#=======================================================================================================================
+# Filter helpers
+#=======================================================================================================================
+
+
+def _get_header(in_files):
+    '''
+    Get a copy of the header of the first file in sorted key order, to which filters can be added.
+    '''
+    reader = pysam.VariantFile(in_files[sorted(in_files)[0]])
+
+    header = reader.header.copy()
+
+    reader.close()
+
+    return header
+
+
+def _iter_record_batches(in_files, header, batch_size):
+    '''
+    Iterate over lists of at most `batch_size` records from files in sorted key order, yielding the key of the file and
+    the records translated to `header`.
+    '''
+    for key in sorted(in_files):
+        reader = pysam.VariantFile(in_files[key])
+
+        records = []
+
+        for record in reader:
+            record.translate(header)
+
+            records.append(record)
+
+            if len(records) == batch_size:
+                yield key, records
+
+                records = []
+
+        if len(records) > 0:
+            yield key, records
+
+        reader.close()
+
+
+def _get_format_values(records, sample, field):
+    return np.array([record.samples[sample][field] for record in records], dtype=float)
+
+
+def _get_info_values(records, field, dtype=float, missing=None):
+    if missing is None:
+        return np.array([record.info[field] for record in records], dtype=dtype)
+
+    return np.array([record.info.get(field, missing) for record in records], dtype=dtype)
+
+
+def _write_filtered_records(writer, records, filters):
+    for record_idx, record in enumerate(records):
+        for filter_id, is_filtered in filters.items():
+            if is_filtered[record_idx]:
+                record.filter.add(filter_id)
+
+        writer.write(record)
 
 #=======================================================================================================================
 # Write config file for make style strelka
@@ -527,36 +621,71 @@ def configure_run(normal_bam_file,
 #=======================================================================================================================
 
 
-def convert_vcf_to_hdf5(in_file, out_file, data_type='snv', table_name=None):
-    out_store = pd.HDFStore(out_file, 'w', complevel=9, complib='blosc')
+def convert_vcf_to_hdf5(in_file, out_file, data_type='snv', table_name=None, chunk_size=int(1e5)):
+    if data_type == 'snv':
+        qual_field = 'QSS'
 
-    reader = vcf.Reader(filename=in_file)
+    elif data_type == 'indel':
+        qual_field = 'QSI'
+
+    else:
+        raise Exception('Unknown data type {0}'.format(data_type))
 
     if table_name is None:
         table_name = 'strelka_{0}'.format(data_type)
 
+    # String lengths must be known before the first chunk is appended
+    min_itemsize = {'chrom': 1, 'ref_base': 1, 'alt_base': 1}
+
+    reader = pysam.VariantFile(in_file, drop_samples=True)
+
     for record in reader:
-        row = OrderedDict()
+        for col, value in zip(('chrom', 'ref_base', 'alt_base'), _get_record_strings(record)):
+            min_itemsize[col] = max(min_itemsize[col], len(value))
 
-        row['chrom'] = str(record.CHROM)
+    reader.close()
+
+    out_store = pd.HDFStore(out_file, 'w', complevel=9, complib='blosc')
 
-        row['coord'] = int(record.POS)
+    reader = pysam.VariantFile(in_file)
 
-        row['ref_base'] = str(record.REF)
+    num_rows = 0
 
-        row['alt_base'] = str(record.ALT[0])
+    while True:
+        data = OrderedDict([(col, []) for col in ('chrom', 'coord', 'ref_base', 'alt_base', 'qual')])
 
-        if data_type == 'snv':
-            row['qual'] = float(record.INFO['QSS'])
+        for record in itertools.islice(reader, chunk_size):
+            chrom, ref_base, alt_base = _get_record_strings(record)
 
-        elif data_type == 'indel':
-            row['qual'] = float(record.INFO['QSI'])
+            data['chrom'].append(chrom)
 
-        else:
-            raise Exception('Unknown data type {0}'.format(data_type))
+            data['coord'].append(record.pos)
 
-        row = pd.DataFrame([pd.Series(row)])
+            data['ref_base'].append(ref_base)
 
-        out_store.append(table_name, row)
+            data['alt_base'].append(alt_base)
+
+            data['qual'].append(float(record.info[qual_field]))
+
+        if len(data['coord']) == 0:
+            break
+
+        df = pd.DataFrame(data, columns=list(data.keys()), index=range(num_rows, num_rows + len(data['coord'])))
+
+        out_store.append(table_name, df, min_itemsize=min_itemsize)
+
+        num_rows += df.shape[0]
+
+    reader.close()
 
     out_store.close()
+
+
+def _get_record_strings(record):
+    if record.alts:
+        alt_base = str(record.alts[0])
+
+    else:
+        alt_base = '.'
+
+    return str(record.chrom), str(record.ref), alt_base
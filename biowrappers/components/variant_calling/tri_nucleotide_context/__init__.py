@@ -1,13 +1,21 @@
 import pypeliner
 import pypeliner.managed as mgd
 
+import biowrappers.components.variant_calling.utils as utils
+
 
 def create_vcf_tric_nucleotide_annotation_workflow(
         ref_genome_fasta_file,
         vcf_file,
         out_file,
-        split_size=int(1e4),
-        table_name='tri_nucleotide_context'):
+        split_size=None,
+        target_task_seconds=600,
+        max_jobs=1000,
+        table_name='tri_nucleotide_context',
+        ref_store_file=None,
+        cache_file=None,
+        ref_build=None,
+        db_version=None):
 
     ctx = {'num_retry': 3, 'mem_retry_increment': 2}
 
@@ -15,6 +23,31 @@ def create_vcf_tric_nucleotide_annotation_workflow(
 
     workflow = pypeliner.workflow.Workflow()
 
+    # The store is kept at ref_store_file, so it is only rebuilt if the FASTA file changes. Without it the reference
+    # is read with faidx lookups.
+    if ref_store_file is not None:
+        workflow.transform(
+            name='build_reference_store',
+            ctx=dict(mem=2, **ctx),
+            func='biowrappers.components.io.fasta.tasks.build_reference_store',
+            args=(
+                mgd.InputFile(ref_genome_fasta_file),
+                mgd.OutputFile(ref_store_file, extensions=['.idx']),
+            )
+        )
+
+        ref_store_file = mgd.InputFile(ref_store_file, extensions=['.idx'])
+
+    split_size = utils.plan_split(
+        workflow,
+        vcf_file,
+        split_size,
+        utils.tri_nucleotide_context_task_cost,
+        target_task_seconds,
+        max_jobs,
+        ctx=dict(mem=2, **ctx)
+    )
+
     workflow.transform(
         name='split_vcf',
         ctx=dict(mem=2, **ctx),
@@ -36,7 +69,13 @@ def create_vcf_tric_nucleotide_annotation_workflow(
             mgd.TempInputFile('split.vcf', 'split'),
             mgd.TempOutputFile('tri_nucleotide_context.csv.gz', 'split'),
             table_name
-        )
+        ),
+        kwargs={
+            'ref_store_file': ref_store_file,
+            'cache_file': cache_file,
+            'ref_build': ref_build,
+            'db_version': db_version,
+        }
     )
 
     workflow.transform(
@@ -3,29 +3,73 @@ Created on Nov 2, 2015
 
 @author: Andrew Roth
 '''
+from collections import OrderedDict
+
+import biowrappers.components.io.csv.tasks as csv_tasks
+import biowrappers.components.io.fasta.tasks as fasta_tasks
+import biowrappers.components.variant_calling.annotation_cache as annotation_cache
+import numpy as np
 import pandas as pd
 import pysam
 import vcf
 
-def get_tri_nucelotide_context(ref_genome_fasta_file, vcf_file, out_file, table_name):
-    vcf_reader = vcf.Reader(filename=vcf_file)
+def get_tri_nucelotide_context(
+        ref_genome_fasta_file,
+        vcf_file,
+        out_file,
+        table_name,
+        ref_store_file=None,
+        cache_file=None,
+        ref_build=None,
+        db_version=None):
+
+    records = list(vcf.Reader(filename=vcf_file))
 
-    fasta_reader = pysam.Fastafile(ref_genome_fasta_file)
+    data = annotation_cache.annotate_with_cache(
+        [x.CHROM for x in records],
+        [x.POS for x in records],
+        [x.REF for x in records],
+        [[str(alt) for alt in x.ALT if alt is not None] for x in records],
+        lambda is_target: _get_tri_nucleotide_context(ref_genome_fasta_file, ref_store_file, records, is_target),
+        cache_file=cache_file,
+        ref_build=ref_build,
+        db_version=db_version
+    )
 
-    data = []
+    csv_tasks.write_csv(data, out_file)
 
-    for record in vcf_reader:
-        chrom = record.CHROM
 
-        coord = record.POS
+def _get_tri_nucleotide_context(ref_genome_fasta_file, ref_store_file, records, is_target):
+    chroms = np.array([x.CHROM for x in records], dtype=object)[is_target]
 
-        tri_nucleotide_context = fasta_reader.fetch(chrom, coord - 2, coord + 1)
+    coords = np.array([x.POS for x in records], dtype=np.int64)[is_target]
 
-        data.append({'chrom': record.CHROM, 'coord': record.POS, 'tri_nucleotide_context': tri_nucleotide_context})
+    if ref_store_file is not None:
+        ref_store = fasta_tasks.ReferenceStore(ref_genome_fasta_file, ref_store_file)
 
-    data = pd.DataFrame(data)
+        tri_nucleotide_context = ref_store.get_sequences(chroms, coords - 2, 3).astype(object)
 
-    if out_file.endswith('.gz.tmp'):
-        data.to_csv(out_file, index=False, compression='gzip')
     else:
-        data.to_csv(out_file, index=False)
+        tri_nucleotide_context = _fetch_sequences(ref_genome_fasta_file, chroms, coords - 2, 3)
+
+    return pd.DataFrame(OrderedDict((
+        ('record_idx', np.flatnonzero(is_target)),
+        ('chrom', chroms),
+        ('coord', coords),
+        ('tri_nucleotide_context', tri_nucleotide_context),
+    )))
+
+
+def _fetch_sequences(ref_genome_fasta_file, chroms, starts, length):
+    ''' Fetch windows with faidx, clipped to the contig as in `fasta_tasks.ReferenceStore.get_sequences`.
+    '''
+    fasta_reader = pysam.FastaFile(ref_genome_fasta_file)
+
+    sequences = []
+
+    for chrom, start in zip(chroms, np.asarray(starts).tolist()):
+        sequences.append(fasta_reader.fetch(chrom, max(start, 0), start + length))
+
+    fasta_reader.close()
+
+    return np.array(sequences, dtype=object)
@@ -3,8 +3,9 @@ Created on Oct 31, 2015
 
 @author: Andrew Roth
 '''
-from collections import OrderedDict
+from collections import OrderedDict, namedtuple
 
+import pypeliner.managed as mgd
 import pysam
 import vcf
 import pandas as pd
@@ -12,6 +13,19 @@ import pandas as pd
 
 default_chromosomes = [str(x) for x in range(1, 23)] + ['X', 'Y']
 
+# Estimated run time of an annotation task, used to choose how many records each task gets. `startup_seconds` is the
+# fixed cost of a task and `seconds_per_record` the cost of each record.
+TaskCost = namedtuple('TaskCost', ['seconds_per_record', 'startup_seconds'])
+
+# Sweep of the target records against a tabix indexed database
+db_status_task_cost = TaskCost(seconds_per_record=2e-4, startup_seconds=5)
+
+# Starting the snpEff JVM and loading its database takes minutes, and annotation runs at a few hundred records a second
+snpeff_task_cost = TaskCost(seconds_per_record=2e-3, startup_seconds=120)
+
+# Lookups in the memory mapped reference store
+tri_nucleotide_context_task_cost = TaskCost(seconds_per_record=1e-4, startup_seconds=5)
+
 
 def get_regions(chromosome_lengths, split_size):
     if split_size is None:
@@ -33,6 +47,31 @@ def get_regions(chromosome_lengths, split_size):
     return regions
 
 
+def group_regions(regions, regions_per_group):
+    '''
+    Group consecutive regions from the same chromosome into lists of at most `regions_per_group` regions.
+
+    :param regions: dict of regions as returned by `get_regions`.
+    '''
+    groups = {}
+    group_index = -1
+    group_chrom = None
+
+    for region_index in sorted(regions):
+        region = regions[region_index]
+
+        chrom = region.split(':')[0]
+
+        if (chrom != group_chrom) or (len(groups[group_index]) >= regions_per_group):
+            group_index += 1
+            groups[group_index] = []
+            group_chrom = chrom
+
+        groups[group_index].append(region)
+
+    return groups
+
+
 def get_vcf_regions(vcf_file, split_size, chromosomes=None):
     if split_size is None:
         return dict(enumerate(chromosomes))
@@ -133,3 +172,36 @@ def parse_region_for_vcf(region):
     end = int(end)
 
     return chrom, beg, end
+
+
+def plan_split(workflow, vcf_file, split_size, task_cost, target_task_seconds, max_jobs, ctx=None):
+    '''
+    Add a task choosing the number of records per file when a VCF is split for annotation.
+
+    :param split_size: Number of records per file. If None a `plan_split` task picks it from the number of records so
+        each annotation task runs for about `target_task_seconds`, with at most `max_jobs` files.
+
+    :param task_cost: `TaskCost` of the annotation task.
+
+    Returns the value to pass as the `lines_per_file` argument of `split_vcf`.
+    '''
+    if split_size is not None:
+        return split_size
+
+    workflow.transform(
+        name='plan_split',
+        ctx=ctx,
+        func='biowrappers.components.io.vcf.tasks.plan_vcf_split',
+        ret=mgd.TempOutputObj('split_size'),
+        args=(
+            mgd.InputFile(vcf_file),
+            task_cost.seconds_per_record,
+        ),
+        kwargs={
+            'startup_seconds': task_cost.startup_seconds,
+            'target_task_seconds': target_task_seconds,
+            'max_jobs': max_jobs,
+        }
+    )
+
+    return mgd.TempInputObj('split_size')
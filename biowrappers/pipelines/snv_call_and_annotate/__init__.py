@@ -263,6 +263,7 @@ def call_and_annotate_pipeline(
         ),
         kwargs={
             'drop_duplicates': True,
+            'in_memory': False,
         }
     )
 
@@ -442,15 +443,15 @@ def get_kwargs(config, table_name):
 
 
 def nuseq_callback(record):
-    return record.INFO['PS']
+    return record.info['PS']
 
 
 def strelka_indel_callback(record):
-    return record.INFO['QSI']
+    return record.info['QSI']
 
 
 def strelka_snv_callback(record):
-    return record.INFO['QSS']
+    return record.info['QSS']
 
 vcf_score_callbacks = {
     'indel': {
@@ -0,0 +1,71 @@
+import pysam
+import pytest
+import random
+
+chrom_length = 2000
+
+
+@pytest.fixture(scope='session')
+def bam_file(tmpdir_factory):
+    ''' Sorted and indexed BAM file of random reads with a mix of flags, CIGAR operations and qualities.
+    '''
+    tmpdir = tmpdir_factory.mktemp('bam')
+
+    unsorted_file = str(tmpdir.join('unsorted.bam'))
+
+    file_name = str(tmpdir.join('reads.bam'))
+
+    rng = random.Random(1)
+
+    header = {
+        'HD': {'VN': '1.0', 'SO': 'coordinate'},
+        'SQ': [{'SN': '1', 'LN': chrom_length}, {'SN': '2', 'LN': chrom_length}],
+    }
+
+    with pysam.AlignmentFile(unsorted_file, 'wb', header=header) as fh:
+        for read_idx in range(1500):
+            fh.write(_get_random_read(rng, 'r{0}'.format(read_idx)))
+
+    pysam.sort('-o', file_name, unsorted_file)
+
+    pysam.index(file_name)
+
+    return file_name
+
+
+def _get_random_read(rng, name):
+    length = rng.randint(30, 80)
+
+    soft_clip = rng.randint(0, 5)
+
+    insertion = rng.randint(0, 3)
+
+    first_match = rng.randint(5, length - soft_clip - insertion - 5)
+
+    second_match = length - soft_clip - insertion - first_match
+
+    if insertion > 0:
+        cigar = [(4, soft_clip), (0, first_match), (1, insertion), (2, rng.randint(0, 4)), (7, second_match)]
+
+    else:
+        cigar = [(4, soft_clip), (8, first_match), (3, rng.randint(1, 50)), (0, second_match)]
+
+    read = pysam.AlignedSegment()
+
+    read.query_name = name
+
+    read.query_sequence = ''.join([rng.choice('ACGTN') for _ in range(length)])
+
+    read.reference_id = rng.randint(0, 1)
+
+    read.reference_start = rng.randint(0, chrom_length - 200)
+
+    read.cigartuples = [x for x in cigar if x[1] > 0]
+
+    read.flag = rng.choice([0, 0, 0x10, 0x10, 0x4, 0x100, 0x200, 0x400, 0x410, 0x800])
+
+    read.mapping_quality = rng.randint(0, 60)
+
+    read.query_qualities = pysam.qualitystring_to_array(''.join([chr(33 + rng.randint(0, 40)) for _ in range(length)]))
+
+    return read
@@ -0,0 +1,161 @@
+import pandas as pd
+import pysam
+import pytest
+import random
+
+from biowrappers.components.variant_calling.annotated_db_status import tasks
+
+header = '''##fileformat=VCFv4.1
+##contig=<ID=1,length=10000>
+##contig=<ID=2,length=10000>
+##contig=<ID=3,length=10000>
+#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO
+'''
+
+columns = ['chrom', 'coord', 'ref', 'alt', 'db_id', 'exact_match', 'indel']
+
+
+def _get_random_allele(rng, max_length):
+    return ''.join([rng.choice('ACGT') for _ in range(rng.randint(1, max_length))])
+
+
+def _write_vcf(file_name, records):
+    with open(file_name, 'w') as fh:
+        fh.write(header)
+
+        for chrom, coord, record_id, ref, alts in records:
+            fh.write('{0}\t{1}\t{2}\t{3}\t{4}\t.\tPASS\t.\n'.format(chrom, coord, record_id, ref, ','.join(alts)))
+
+
+@pytest.fixture(scope='module')
+def vcf_files(tmpdir_factory):
+    tmpdir = tmpdir_factory.mktemp('db_status')
+
+    rng = random.Random(5)
+
+    db_records = []
+
+    for chrom in ('1', '2'):
+        for coord in sorted(rng.sample(range(1, 3000), 300)):
+            # Several database records at some positions
+            for _ in range(rng.choice([1, 1, 1, 2, 3])):
+                ref = rng.choice(['A', 'C', _get_random_allele(rng, 3)])
+
+                alts = [rng.choice(['A', 'C', 'G', 'T', _get_random_allele(rng, 3)]) for _ in range(rng.randint(1, 2))]
+
+                record_id = rng.choice(['.', 'db{0}_{1}_{2}'.format(chrom, coord, len(db_records))])
+
+                db_records.append((chrom, coord, record_id, ref, alts))
+
+    db_file = str(tmpdir.join('db.vcf'))
+
+    _write_vcf(db_file, db_records)
+
+    db_file = pysam.tabix_index(db_file, preset='vcf')
+
+    target_records = []
+
+    for chrom in ('2', '1', '3'):
+        for coord in sorted(rng.sample(range(1, 3100), 400)):
+            if rng.random() < 0.5:
+                db_record = rng.choice(db_records)
+
+                if db_record[0] == chrom:
+                    coord = db_record[1]
+
+            ref = rng.choice(['A', 'C', 'G'])
+
+            alts = rng.sample(['A', 'C', 'G', 'T', 'AT'], rng.randint(1, 2))
+
+            target_records.append((chrom, coord, '.', ref, alts))
+
+    # Targets are in file order, not sorted, and repeat some sites
+    target_records.extend(target_records[:50])
+
+    rng.shuffle(target_records)
+
+    target_file = str(tmpdir.join('targets.vcf'))
+
+    _write_vcf(target_file, target_records)
+
+    return db_file, target_file
+
+
+def _is_indel(record):
+    if len(record.ref) > 1:
+        return True
+
+    return any([len(x) != len(record.ref) for x in record.alts])
+
+
+def _annotate_db_status(db_vcf_file, target_vcf_file):
+    ''' Match each target with a database fetch at its position, as targets were matched before the sweep join.
+    '''
+    db_reader = pysam.VariantFile(db_vcf_file)
+
+    data = []
+
+    for record in pysam.VariantFile(target_vcf_file):
+        try:
+            db_records = list(db_reader.fetch(record.chrom, record.pos - 1, record.pos))
+
+        except ValueError:
+            db_records = []
+
+        for db_record in db_records:
+            if db_record.pos != record.pos:
+                continue
+
+            for alt in record.alts:
+                data.append({
+                    'chrom': record.chrom,
+                    'coord': record.pos,
+                    'ref': record.ref,
+                    'alt': alt,
+                    'db_id': db_record.id,
+                    'exact_match': int((record.ref == db_record.ref) and (alt in db_record.alts)),
+                    'indel': int(_is_indel(db_record)),
+                })
+
+    return pd.DataFrame(data, columns=columns)
+
+
+def _write_csv(tmpdir, df):
+    file_name = str(tmpdir.join('expected.csv'))
+
+    df.to_csv(file_name, index=False)
+
+    return file_name
+
+
+@pytest.mark.parametrize('max_window_gap', [0, 10, int(1e4)])
+def test_annotate_db_status(tmpdir, vcf_files, max_window_gap):
+    db_file, target_file = vcf_files
+
+    out_file = str(tmpdir.join('out.csv'))
+
+    tasks.annotate_db_status(db_file, target_file, out_file, max_window_gap=max_window_gap)
+
+    expected = _annotate_db_status(db_file, target_file)
+
+    df = pd.read_csv(out_file, dtype={'chrom': str})
+
+    assert list(df.columns) == columns
+
+    assert expected['exact_match'].sum() > 0
+
+    pd.testing.assert_frame_equal(df, pd.read_csv(_write_csv(tmpdir, expected), dtype={'chrom': str}))
+
+
+def test_annotate_db_status_no_matches(tmpdir, vcf_files):
+    db_file, _ = vcf_files
+
+    target_file = str(tmpdir.join('targets.vcf'))
+
+    _write_vcf(target_file, [('3', 10, '.', 'A', ['C'])])
+
+    out_file = str(tmpdir.join('out.csv'))
+
+    tasks.annotate_db_status(db_file, target_file, out_file)
+
+    assert list(pd.read_csv(out_file).columns) == columns
@@ -0,0 +1,147 @@
+import gzip
+import io
+import pytest
+import zlib
+
+from biowrappers.components.io.compression.tasks import check_gzip_file, copy_gzip_file
+
+
+def _compress(data):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    return compressor.compress(data) + compressor.flush()
+
+
+def _copy(members, skip_bytes, buffer_size=2 ** 20):
+    in_fh = io.BytesIO(b''.join([_compress(x) for x in members]))
+
+    in_fh.name = 'in.gz'
+
+    out_fh = io.BytesIO()
+
+    last_byte = copy_gzip_file(in_fh, out_fh, skip_bytes=skip_bytes, buffer_size=buffer_size)
+
+    return out_fh.getvalue(), last_byte
+
+
+def _decompress(data):
+    return gzip.GzipFile(fileobj=io.BytesIO(data)).read()
+
+
+@pytest.mark.parametrize('buffer_size', [2, 7, 2 ** 20])
+def test_copy_header_in_own_member(buffer_size):
+    members = [b'a,b\n', b'1,2\n', b'3,4\n']
+
+    out, last_byte = _copy(members, 4, buffer_size=buffer_size)
+
+    # Members after the header are copied without recompressing
+    assert out == _compress(b'1,2\n') + _compress(b'3,4\n')
+
+    assert last_byte == b'\n'
+
+
+@pytest.mark.parametrize('buffer_size', [2, 7, 2 ** 20])
+def test_copy_header_in_single_member(buffer_size):
+    out, last_byte = _copy([b'a,b\n1,2\n3,4'], 4, buffer_size=buffer_size)
+
+    assert _decompress(out) == b'1,2\n3,4'
+
+    assert last_byte == b'4'
+
+
+@pytest.mark.parametrize('buffer_size', [2, 7, 2 ** 20])
+def test_copy_header_split_across_members(buffer_size):
+    members = [b'a,', b'b', b'\n1,', b'2\n', b'3,4\n']
+
+    out, last_byte = _copy(members, 4, buffer_size=buffer_size)
+
+    assert _decompress(out) == b'1,2\n3,4\n'
+
+    assert out.endswith(_compress(b'2\n') + _compress(b'3,4\n'))
+
+    assert last_byte == b'\n'
+
+
+def test_copy_without_skip():
+    members = [b'a,b\n', b'1,2\n']
+
+    out, last_byte = _copy(members, 0)
+
+    assert out == b''.join([_compress(x) for x in members])
+
+    assert last_byte == b'\n'
+
+
+def test_copy_header_only():
+    out, last_byte = _copy([b'a,b\n'], 4)
+
+    assert _decompress(out) == b''
+
+    assert last_byte == b''
+
+
+@pytest.mark.parametrize('skip_bytes', [0, 2, 4])
+def test_copy_truncated(skip_bytes):
+    data = _compress(b'a,b\n') + _compress(b'1,2\n' * 100)
+
+    in_fh = io.BytesIO(data[:-5])
+
+    in_fh.name = 'in.gz'
+
+    with pytest.raises(Exception):
+        copy_gzip_file(in_fh, io.BytesIO(), skip_bytes=skip_bytes, buffer_size=7)
+
+
+def test_copy_skip_past_end():
+    with pytest.raises(Exception):
+        _copy([b'a,b\n'], 10)
+
+
+def test_check_gzip_file(tmpdir):
+    file_name = str(tmpdir.join('in.gz'))
+
+    data = _compress(b'a,b\n') + _compress(b'1,2\n')
+
+    with open(file_name, 'wb') as fh:
+        fh.write(data)
+
+    check_gzip_file(file_name, buffer_size=3)
+
+    with open(file_name, 'wb') as fh:
+        fh.write(data[:-1])
+
+    with pytest.raises(Exception):
+        check_gzip_file(file_name, buffer_size=3)
+
+
+def test_check_gzip_file_with_padding(tmpdir):
+    file_name = str(tmpdir.join('in.gz'))
+
+    data = _compress(b'a,b\n') + b'\x00' * 5 + _compress(b'1,2\n')
+
+    with open(file_name, 'wb') as fh:
+        fh.write(data + b'\x00' * 10)
+
+    assert check_gzip_file(file_name, buffer_size=3) == len(data)
+
+    assert gzip.open(file_name).read() == b'a,b\n1,2\n'
+
+    with open(file_name, 'wb') as fh:
+        fh.write(data + b'\x00' * 10 + b'x')
+
+    with pytest.raises(Exception):
+        check_gzip_file(file_name, buffer_size=3)
+
+
+def test_copy_with_padding():
+    data = _compress(b'a,b\n') + _compress(b'1,2\n') + b'\x00' * 10
+
+    in_fh = io.BytesIO(data)
+
+    in_fh.name = 'in.gz'
+
+    out_fh = io.BytesIO()
+
+    assert copy_gzip_file(in_fh, out_fh, skip_bytes=4, buffer_size=3) == b'\n'
+
+    assert _decompress(out_fh.getvalue()) == b'1,2\n'
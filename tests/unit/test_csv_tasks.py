@@ -0,0 +1,63 @@
+import gzip
+import pytest
+
+from biowrappers.components.io.csv.tasks import concatenate_files_with_header, write_gzip_member
+
+
+def _write(file_name, members, compress):
+    with open(file_name, 'wb') as fh:
+        for text in members:
+            if compress:
+                write_gzip_member(fh, text)
+
+            else:
+                fh.write(text.encode('utf-8'))
+
+
+def _read(file_name, compress):
+    if compress:
+        fh = gzip.open(file_name, 'rb')
+
+    else:
+        fh = open(file_name, 'rb')
+
+    with fh:
+        return fh.read().decode('utf-8')
+
+
+@pytest.mark.parametrize('in_compress', [False, True])
+@pytest.mark.parametrize('out_compress', [False, True])
+def test_concatenate_files_with_header(tmpdir, in_compress, out_compress):
+    in_files = [str(tmpdir.join('in_{0}'.format(i))) for i in range(4)]
+
+    _write(in_files[0], ['a,b\n', '1,2\n'], in_compress)
+
+    _write(in_files[1], [], in_compress)
+
+    _write(in_files[2], ['a,b\n'], in_compress)
+
+    _write(in_files[3], ['a,b\n', '3,4\n', '5,6\n'], in_compress)
+
+    out_file = str(tmpdir.join('out'))
+
+    concatenate_files_with_header(in_files, out_file, compress=out_compress)
+
+    assert _read(out_file, out_compress) == 'a,b\n1,2\n3,4\n5,6\n'
+
+
+@pytest.mark.parametrize('in_compress', [False, True])
+@pytest.mark.parametrize('out_compress', [False, True])
+def test_concatenate_files_without_final_newline(tmpdir, in_compress, out_compress):
+    in_files = [str(tmpdir.join('in_{0}'.format(i))) for i in range(3)]
+
+    _write(in_files[0], ['a,b\n1,2'], in_compress)
+
+    _write(in_files[1], ['a,b'], in_compress)
+
+    _write(in_files[2], ['a,b\n', '3,4'], in_compress)
+
+    out_file = str(tmpdir.join('out'))
+
+    concatenate_files_with_header(in_files, out_file, compress=out_compress)
+
+    assert _read(out_file, out_compress) == 'a,b\n1,2\n3,4\n'
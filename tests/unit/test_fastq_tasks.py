@@ -0,0 +1,78 @@
+import gzip
+import pytest
+import zlib
+
+from biowrappers.components.io.fastq.tasks import concatenate
+
+reads = [
+    b'@r1\nACGT\n+\nIIII\n',
+    b'@r2\nCCGA\n+\nIIHI\n',
+    b'@r3\nTTGA\n+\nHIII\n',
+]
+
+
+def _compress(data):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    return compressor.compress(data) + compressor.flush()
+
+
+def _write(tmpdir, name, data):
+    file_name = str(tmpdir.join(name))
+
+    with open(file_name, 'wb') as fh:
+        fh.write(data)
+
+    return file_name
+
+
+@pytest.mark.parametrize('check_integrity', [False, True])
+def test_concatenate(tmpdir, check_integrity):
+    in_files = [
+        _write(tmpdir, 'a.fq.gz', _compress(reads[0])),
+        _write(tmpdir, 'b.fq', reads[1]),
+        _write(tmpdir, 'c.fq', b''),
+        _write(tmpdir, 'd.fq.gz', _compress(reads[2])),
+    ]
+
+    out_file = str(tmpdir.join('out.fq.gz'))
+
+    concatenate(in_files, out_file, check_integrity=check_integrity)
+
+    assert gzip.open(out_file).read() == b''.join(reads)
+
+
+def test_concatenate_drops_padding(tmpdir):
+    in_files = [
+        _write(tmpdir, 'a.fq.gz', _compress(reads[0]) + b'\x00' * 8),
+        _write(tmpdir, 'b.fq.gz', _compress(reads[1])),
+    ]
+
+    out_file = str(tmpdir.join('out.fq.gz'))
+
+    concatenate(in_files, out_file, check_integrity=True)
+
+    with open(out_file, 'rb') as fh:
+        assert fh.read() == _compress(reads[0]) + _compress(reads[1])
+
+
+def test_concatenate_corrupt(tmpdir):
+    data = bytearray(_compress(reads[0]))
+
+    data[-6] ^= 0xff
+
+    in_files = [_write(tmpdir, 'a.fq.gz', bytes(data))]
+
+    with pytest.raises(Exception):
+        concatenate(in_files, str(tmpdir.join('out.fq.gz')), check_integrity=True)
+
+
+@pytest.mark.parametrize('check_integrity', [False, True])
+def test_concatenate_empty(tmpdir, check_integrity):
+    in_files = [_write(tmpdir, 'a.fq', b''), _write(tmpdir, 'b.fq.gz', b'')]
+
+    out_file = str(tmpdir.join('out.fq.gz'))
+
+    concatenate(in_files, out_file, check_integrity=check_integrity)
+
+    assert gzip.open(out_file).read() == b''
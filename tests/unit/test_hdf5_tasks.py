@@ -0,0 +1,124 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from biowrappers.components.io.hdf5 import tasks
+
+
+@pytest.fixture
+def in_files(tmpdir):
+    rng = np.random.RandomState(6)
+
+    in_files = []
+
+    for file_idx in range(3):
+        num_rows = 40
+
+        counts = pd.DataFrame({
+            'chrom': rng.choice(['1', '2', 'X{0}'.format(file_idx)], num_rows),
+            'coord': rng.randint(0, 10, num_rows),
+            'value': rng.randint(0, 2, num_rows) / 2.0,
+        })
+
+        # Categorical in some files and object in others
+        if file_idx == 1:
+            counts['chrom'] = counts['chrom'].astype('category')
+
+        other = pd.DataFrame({
+            'sample': rng.choice(['a', 'b', 'long_sample_{0}'.format(file_idx)], 10),
+            'depth': rng.randint(0, 3, 10),
+        })
+
+        file_name = str(tmpdir.join('in_{0}.h5'.format(file_idx)))
+
+        with pd.HDFStore(file_name, 'w') as store:
+            store.put('counts', counts, format='table')
+
+            if file_idx == 2:
+                store.put('other', other.head(0))
+
+            else:
+                store.put('other', other, format='table')
+
+        in_files.append(file_name)
+
+    return in_files
+
+
+def _read_tables(file_name):
+    tables = {}
+
+    with pd.HDFStore(file_name, 'r') as store:
+        for table_name in tasks._iter_table_names(store):
+            df = store[table_name].reset_index(drop=True)
+
+            for col in df.columns:
+                if df[col].dtype.kind not in 'biuf':
+                    df[col] = df[col].astype(str)
+
+            tables[table_name] = df
+
+    return tables
+
+
+def _assert_tables_equal(file_name, expected_file_name):
+    tables = _read_tables(file_name)
+
+    expected_tables = _read_tables(expected_file_name)
+
+    assert sorted(tables.keys()) == sorted(expected_tables.keys())
+
+    for table_name, expected in expected_tables.items():
+        df = tables[table_name]
+
+        pd.testing.assert_frame_equal(df[list(expected.columns)], expected, check_dtype=False)
+
+
+@pytest.mark.parametrize('drop_duplicates', [False, True])
+@pytest.mark.parametrize('non_numeric_as_category', [False, True])
+@pytest.mark.parametrize('chunk_size,num_partitions', [(7, 3), (int(1e5), 64)])
+def test_concatenate_tables_on_disk(tmpdir, in_files, drop_duplicates, non_numeric_as_category, chunk_size,
+                                    num_partitions):
+    expected_file = str(tmpdir.join('expected.h5'))
+
+    out_file = str(tmpdir.join('out.h5'))
+
+    kwargs = dict(drop_duplicates=drop_duplicates, non_numeric_as_category=non_numeric_as_category)
+
+    tasks.concatenate_tables(in_files, expected_file, in_memory=True, **kwargs)
+
+    tasks.concatenate_tables(
+        in_files, out_file, in_memory=False, chunk_size=chunk_size, num_partitions=num_partitions, **kwargs)
+
+    _assert_tables_equal(out_file, expected_file)
+
+    if drop_duplicates:
+        counts = _read_tables(out_file)['/counts']
+
+        assert not counts.duplicated().any()
+
+        assert counts.shape[0] < 3 * 40
+
+
+def test_get_unique_rows(tmpdir, in_files):
+    is_unique = tasks._get_unique_rows(in_files, ['/counts', '/other'], str(tmpdir), chunk_size=5, num_partitions=4)
+
+    for table_name in ('/counts', '/other'):
+        dfs = []
+
+        for file_name in in_files:
+            with pd.HDFStore(file_name, 'r') as store:
+                df = store[table_name]
+
+            for col in df.columns:
+                if df[col].dtype.kind not in 'biuf':
+                    df[col] = df[col].astype(str)
+
+            dfs.append(df)
+
+        df = pd.concat(dfs, ignore_index=True)
+
+        np.testing.assert_array_equal(is_unique[table_name], ~df.duplicated().values)
+
+    # Partition files are removed
+    assert tmpdir.listdir(lambda x: x.isdir()) == []
@@ -0,0 +1,61 @@
+import pytest
+
+from biowrappers.components.io.hdf5 import create_concatenate_tables_workflow
+
+
+def _get_chunks(workflow, *axes):
+    job = workflow.job_definitions['_'.join(('setobj', 'chunks') + axes)]
+
+    assert job.argset.ret.axes == axes
+
+    return job.argset.args[0]
+
+
+def test_concatenate_tables_workflow_single_level():
+    in_files = ['in_{0}.h5'.format(i) for i in range(3)]
+
+    workflow = create_concatenate_tables_workflow(in_files, 'out.h5', group_size=3)
+
+    assert _get_chunks(workflow, 'merge_input') == [0, 1, 2]
+
+    in_arg = workflow.job_definitions['concatenate_tables'].argset.args[0]
+
+    assert in_arg.axes == ('merge_input',)
+
+    assert in_arg.kwargs['fnames'] == dict(enumerate(in_files))
+
+
+@pytest.mark.parametrize('num_in_files,group_size', [(5, 2), (7, 3), (4, 3)])
+def test_concatenate_tables_workflow_groups(num_in_files, group_size):
+    in_files = ['in_{0}.h5'.format(i) for i in range(num_in_files)]
+
+    workflow = create_concatenate_tables_workflow(in_files, 'out.h5', group_size=group_size)
+
+    chunks = _get_chunks(workflow, 'merge_group', 'merge_input')
+
+    assert sorted(chunks) == [(i // group_size, i) for i in range(num_in_files)]
+
+    group_job = workflow.job_definitions['concatenate_group_tables']
+
+    assert group_job.axes == ('merge_group',)
+
+    in_arg = group_job.argset.args[0]
+
+    assert in_arg.axes == ('merge_group', 'merge_input')
+
+    assert sorted(in_arg.kwargs['fnames'].keys()) == sorted(chunks)
+
+    assert [in_arg.kwargs['fnames'][x] for x in sorted(chunks)] == in_files
+
+    assert group_job.argset.args[1].axes == ('merge_group',)
+
+    partial_job = workflow.job_definitions['concatenate_partial_tables']
+
+    assert partial_job.argset.args[0].axes == ('merge_group',)
+
+    assert partial_job.argset.kwargs['group_size'] == group_size
+
+
+def test_concatenate_tables_workflow_group_size():
+    with pytest.raises(Exception):
+        create_concatenate_tables_workflow(['a.h5', 'b.h5'], 'out.h5', group_size=1)
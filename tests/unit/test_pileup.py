@@ -0,0 +1,80 @@
+import numpy as np
+import pysam
+import pytest
+
+from biowrappers.components.variant_calling.snv_allele_counts import pileup
+
+from conftest import chrom_length
+
+filter_params = [
+    dict(count_duplicates=False, min_bqual=0, min_mqual=0),
+    dict(count_duplicates=True, min_bqual=0, min_mqual=0),
+    dict(count_duplicates=False, min_bqual=20, min_mqual=0),
+    dict(count_duplicates=False, min_bqual=0, min_mqual=30),
+    dict(count_duplicates=True, min_bqual=15, min_mqual=20),
+]
+
+regions = [
+    ('1', 0, chrom_length),
+    ('1', 500, 700),
+    ('2', 1999, 2000),
+    ('2', 300, 301),
+]
+
+
+def _count_coverage(bam, chrom, start, stop, strand, count_duplicates=False, min_bqual=0, min_mqual=0):
+    ''' Counts from pysam count_coverage with the read filters counting was done with before pileup.
+    '''
+
+    def check_read(read):
+        if read.mapping_quality < min_mqual:
+            return False
+
+        if read.is_duplicate and (not count_duplicates):
+            return False
+
+        if read.is_unmapped or read.is_qcfail or read.is_secondary:
+            return False
+
+        return read.is_reverse == (strand == pileup.REVERSE)
+
+    counts = bam.count_coverage(chrom, start, stop, quality_threshold=min_bqual, read_callback=check_read)
+
+    return np.array(counts).T.reshape(stop - start, len(pileup.nucleotides))
+
+
+@pytest.mark.parametrize('params', filter_params)
+@pytest.mark.parametrize('region', regions)
+@pytest.mark.parametrize('batch_size', [50, int(1e6)])
+def test_count_alleles(bam_file, params, region, batch_size):
+    chrom, start, stop = region
+
+    with pysam.AlignmentFile(bam_file, 'rb') as bam:
+        counts = pileup.count_alleles(bam, chrom, start, stop, batch_size=batch_size, **params)
+
+        assert counts.shape == (stop - start, len(pileup.nucleotides), 2)
+
+        for strand in (pileup.FORWARD, pileup.REVERSE):
+            expected = _count_coverage(bam, chrom, start, stop, strand, **params)
+
+            np.testing.assert_array_equal(counts[:, :, strand], expected)
+
+
+def test_count_alleles_has_counts(bam_file):
+    with pysam.AlignmentFile(bam_file, 'rb') as bam:
+        counts = pileup.count_alleles(bam, '1', 0, chrom_length)
+
+    assert (counts[:, :, pileup.FORWARD].sum() > 0) and (counts[:, :, pileup.REVERSE].sum() > 0)
+
+
+def test_count_alleles_empty_region(bam_file):
+    with pysam.AlignmentFile(bam_file, 'rb') as bam:
+        counts = pileup.count_alleles(bam, '1', 100, 100)
+
+    assert counts.shape == (0, len(pileup.nucleotides), 2)
+
+
+def test_get_exclude_flags():
+    assert pileup.get_exclude_flags() & pileup.FLAG_DUPLICATE
+
+    assert not (pileup.get_exclude_flags(count_duplicates=True) & pileup.FLAG_DUPLICATE)
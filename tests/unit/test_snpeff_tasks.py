@@ -0,0 +1,80 @@
+import pytest
+import sys
+
+from biowrappers.components.variant_calling.snpeff import tasks
+
+header = '''##fileformat=VCFv4.1
+##contig=<ID=1,length=10000>
+#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO
+'''
+
+# Stands in for snpEff, adds an annotation to each record read from stdin
+annotate_script = '''
+import sys
+for line in sys.stdin:
+    if not line.startswith('#'):
+        line = line.replace('\\t.\\n', '\\tANN={0}\\n'.format(line.split('\\t')[1]))
+    sys.stdout.write(line)
+'''
+
+# Drops the last record
+drop_script = '''
+import sys
+sys.stdout.writelines(sys.stdin.readlines()[:-1])
+'''
+
+
+def _mock_snpeff(monkeypatch, script):
+    monkeypatch.setattr(tasks, '_get_snpeff_cmd', lambda *args, **kwargs: [sys.executable, '-c', script])
+
+
+def _write_vcf_files(tmpdir, num_records):
+    in_files = {}
+
+    coord = 1
+
+    for key, n in enumerate(num_records):
+        in_files[key] = str(tmpdir.join('in_{0}.vcf'.format(key)))
+
+        with open(in_files[key], 'w') as fh:
+            fh.write(header)
+
+            for _ in range(n):
+                fh.write('1\t{0}\t.\tA\tC\t.\tPASS\t.\n'.format(coord))
+
+                coord += 1
+
+    return in_files
+
+
+def _read_lines(file_name):
+    with open(file_name) as fh:
+        return fh.readlines()
+
+
+@pytest.mark.parametrize('num_records', [[5], [3, 0, 4], [0, 0], [1000, 2000]])
+def test_run_snpeff_group(tmpdir, monkeypatch, num_records):
+    _mock_snpeff(monkeypatch, annotate_script)
+
+    in_files = _write_vcf_files(tmpdir, num_records)
+
+    out_files = dict([(key, str(tmpdir.join('out_{0}.vcf'.format(key)))) for key in in_files])
+
+    tasks.run_snpeff_group('db', str(tmpdir), in_files, out_files)
+
+    for key in in_files:
+        expected = [line.replace('\t.\n', '\tANN={0}\n'.format(line.split('\t')[1])) if not line.startswith('#') else
+                    line for line in _read_lines(in_files[key])]
+
+        assert _read_lines(out_files[key]) == expected
+
+
+def test_run_snpeff_group_missing_records(tmpdir, monkeypatch):
+    _mock_snpeff(monkeypatch, drop_script)
+
+    in_files = _write_vcf_files(tmpdir, [3, 4])
+
+    out_files = dict([(key, str(tmpdir.join('out_{0}.vcf'.format(key)))) for key in in_files])
+
+    with pytest.raises(Exception):
+        tasks.run_snpeff_group('db', str(tmpdir), in_files, out_files)
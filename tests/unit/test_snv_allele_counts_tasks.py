@@ -0,0 +1,90 @@
+import numpy as np
+import pysam
+import pytest
+import random
+
+from biowrappers.components.variant_calling.snv_allele_counts import tasks
+
+from conftest import chrom_length
+
+
+def _get_site_counts(bam, chrom, coord, count_duplicates=False, min_bqual=0, min_mqual=0):
+    ''' Unstranded counts of a 1 based site from pysam count_coverage, as targets were counted one at a time before.
+    '''
+
+    def check_read(read):
+        if read.mapping_quality < min_mqual:
+            return False
+
+        if read.is_duplicate and (not count_duplicates):
+            return False
+
+        return not (read.is_unmapped or read.is_qcfail or read.is_secondary)
+
+    counts = bam.count_coverage(chrom, coord - 1, coord, quality_threshold=min_bqual, read_callback=check_read)
+
+    return [x[0] for x in counts]
+
+
+@pytest.fixture(scope='module')
+def targets():
+    rng = random.Random(2)
+
+    chroms = [rng.choice(['1', '2']) for _ in range(300)]
+
+    coords = [rng.randint(1, chrom_length) for _ in range(300)]
+
+    # Repeated sites in a different order
+    chroms.extend(chroms[:20])
+
+    coords.extend(coords[:20])
+
+    return chroms[::-1], coords[::-1]
+
+
+@pytest.mark.parametrize('max_window_gap,max_window_size', [(0, 1), (10, 50), (1000, int(1e5))])
+@pytest.mark.parametrize('params', [
+    dict(count_duplicates=False, min_bqual=0, min_mqual=0),
+    dict(count_duplicates=True, min_bqual=20, min_mqual=10),
+])
+def test_get_target_site_counts(bam_file, targets, max_window_gap, max_window_size, params):
+    chroms, coords = targets
+
+    with pysam.AlignmentFile(bam_file, 'rb') as bam:
+        counts = tasks._get_target_site_counts(
+            bam,
+            chroms,
+            coords,
+            max_window_gap=max_window_gap,
+            max_window_size=max_window_size,
+            **params
+        )
+
+        expected = np.array([_get_site_counts(bam, x, y, **params) for x, y in zip(chroms, coords)])
+
+    np.testing.assert_array_equal(counts, expected)
+
+    assert counts.sum() > 0
+
+
+def test_get_target_site_counts_no_targets(bam_file):
+    with pysam.AlignmentFile(bam_file, 'rb') as bam:
+        counts = tasks._get_target_site_counts(bam, [], [])
+
+    assert counts.shape == (0, len(tasks.nucleotides))
+
+
+@pytest.mark.parametrize('max_window_gap,max_window_size', [(0, 1), (2, 5), (5, 100), (100, 4)])
+def test_get_target_windows(max_window_gap, max_window_size):
+    coords = np.array([1, 2, 2, 4, 9, 10, 11, 20, 100])
+
+    windows = list(tasks._get_target_windows(coords, max_window_gap, max_window_size))
+
+    np.testing.assert_array_equal(np.concatenate(windows), np.arange(len(coords)))
+
+    for window in windows:
+        window_coords = coords[window]
+
+        assert (np.diff(window_coords) <= max_window_gap).all()
+
+        assert (window_coords[-1] - window_coords[0] < max_window_size) or (len(window) == 1)
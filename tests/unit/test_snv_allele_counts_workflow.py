@@ -0,0 +1,38 @@
+import importlib
+
+from biowrappers.components.variant_calling import snv_allele_counts
+
+
+def _check_funcs(workflow):
+    ''' Check every job function given by name can be imported.
+    '''
+    for job in workflow.job_definitions.values():
+        func = job.func
+
+        if not isinstance(func, str):
+            continue
+
+        module_name, func_name = func.rsplit('.', 1)
+
+        assert hasattr(importlib.import_module(module_name), func_name), func
+
+
+def test_vcf_targets_workflow_funcs():
+    workflow = snv_allele_counts.create_snv_allele_counts_for_vcf_targets_workflow(
+        'reads.bam', 'targets.vcf.gz', 'counts.tsv.gz')
+
+    _check_funcs(workflow)
+
+
+def test_snv_allele_counts_workflow_funcs(bam_file):
+    workflow = snv_allele_counts.create_snv_allele_counts_workflow(
+        bam_file, 'counts.h5', 'snv_allele_counts', chromosomes=['1', '2'], split_size=500)
+
+    _check_funcs(workflow)
+
+
+def test_variant_position_counts_workflow_funcs(bam_file):
+    workflow = snv_allele_counts.create_snv_variant_position_counts_workflow(
+        bam_file, {'tumour': bam_file}, 'counts.h5', chromosomes=['1', '2'], split_size=500)
+
+    _check_funcs(workflow)
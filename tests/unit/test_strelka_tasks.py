@@ -0,0 +1,294 @@
+import pysam
+import pytest
+import random
+
+from biowrappers.components.variant_calling.strelka import tasks
+
+header = '''##fileformat=VCFv4.1
+##source=strelka
+##contig=<ID=1,length=100000>
+##INFO=<ID=NT,Number=1,Type=String,Description="Genotype of the normal">
+##INFO=<ID=SOMATIC,Number=0,Type=Flag,Description="Somatic mutation">
+##FORMAT=<ID=DP,Number=1,Type=Integer,Description="Read depth">
+##FORMAT=<ID=FDP,Number=1,Type=Integer,Description="Filtered read depth">
+'''
+
+snv_header = header + '''##INFO=<ID=QSS_NT,Number=1,Type=Integer,Description="Quality score">
+##FORMAT=<ID=SDP,Number=1,Type=Integer,Description="Spanning deletion depth">
+#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tNORMAL\tTUMOR
+'''
+
+indel_header = header + '''##INFO=<ID=QSI_NT,Number=1,Type=Integer,Description="Quality score">
+##INFO=<ID=RC,Number=1,Type=Integer,Description="Reference repeat count">
+##INFO=<ID=IHP,Number=1,Type=Integer,Description="Interrupted homopolymer length">
+#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tNORMAL\tTUMOR
+'''
+
+known_chrom_size = 1000
+
+
+@pytest.fixture
+def stats_files(tmpdir):
+    stats_files = {}
+
+    for key, mean in ((0, 5.5), (1, 6.5)):
+        stats_files[key] = str(tmpdir.join('stats_{0}.txt'.format(key)))
+
+        with open(stats_files[key], 'w') as fh:
+            fh.write('NORMAL_NO_REF_N_COVERAGE sample_size: 1000 min: 0 max: 40 mean: {0} sd: 3\n'.format(mean))
+
+    return stats_files
+
+
+def _get_max_normal_coverage():
+    return (5.5 * 1000 + 6.5 * 1000) / known_chrom_size * 3.0
+
+
+def _write_snv_files(tmpdir, rng):
+    in_files = {}
+
+    for key in range(3):
+        in_files[key] = str(tmpdir.join('snv_{0}.vcf'.format(key)))
+
+        with open(in_files[key], 'w') as fh:
+            fh.write(snv_header)
+
+            for coord in sorted(rng.sample(range(key * 100 + 1, key * 100 + 100), 20)):
+                samples = []
+
+                for _ in range(2):
+                    dp = rng.randint(0, 60)
+
+                    samples.append('{0}:{1}:{2}'.format(dp, rng.randint(0, dp), rng.randint(0, 10) if dp else 0))
+
+                fh.write('1\t{0}\t.\tA\tC\t.\tPASS\tSOMATIC;NT={1};QSS_NT={2}\tDP:FDP:SDP\t{3}\t{4}\n'.format(
+                    coord, rng.choice(['ref', 'ref', 'het']), rng.randint(0, 40), samples[0], samples[1]))
+
+    return in_files
+
+
+def _write_indel_files(tmpdir, rng):
+    in_files = {}
+
+    window_files = {}
+
+    for key in range(3):
+        in_files[key] = str(tmpdir.join('indel_{0}.vcf'.format(key)))
+
+        window_files[key] = str(tmpdir.join('indel_{0}.window'.format(key)))
+
+        with open(in_files[key], 'w') as fh, open(window_files[key], 'w') as window_fh:
+            fh.write(indel_header)
+
+            window_fh.write('#CHROM\tPOS\tNU\tNF\tNS\tTU\tTF\tTS\n')
+
+            coords = sorted(rng.sample(range(key * 100 + 1, key * 100 + 100), 40))
+
+            # Window files also have rows at positions without calls
+            call_coords = set(rng.sample(coords, 20))
+
+            for coord in coords:
+                window = []
+
+                for _ in range(2):
+                    window.extend([rng.randint(0, 30), rng.randint(0, 15) + 0.25, rng.randint(0, 4)])
+
+                window_fh.write('1\t{0}\t{1}\n'.format(coord, '\t'.join([str(x) for x in window])))
+
+                if coord not in call_coords:
+                    continue
+
+                info = 'SOMATIC;NT={0};QSI_NT={1}'.format(rng.choice(['ref', 'ref', 'hom']), rng.randint(0, 60))
+
+                if rng.randint(0, 1):
+                    info += ';RC={0}'.format(rng.randint(0, 12))
+
+                if rng.randint(0, 1):
+                    info += ';IHP={0}'.format(rng.randint(0, 20))
+
+                fh.write('1\t{0}\t.\tAT\tA\t.\tPASS\t{1}\tDP:FDP\t{2}:{3}\t{4}:{5}\n'.format(
+                    coord, info, rng.randint(0, 60), rng.randint(0, 5), rng.randint(0, 40), rng.randint(0, 5)))
+
+    return in_files, window_files
+
+
+def _get_fraction(numerator, denominator):
+    if denominator > 0:
+        return numerator / float(denominator)
+
+    return 0
+
+
+def _get_snv_filters(record, max_normal_coverage):
+    ''' Filters of an SNV record, following the previous record by record implementation.
+    '''
+    normal = record.samples['NORMAL']
+
+    tumour = record.samples['TUMOR']
+
+    filters = set()
+
+    if normal['DP'] > max_normal_coverage:
+        filters.add(tasks.FILTER_ID_DEPTH)
+
+    if (_get_fraction(normal['FDP'], normal['DP']) >= 0.4) or (_get_fraction(tumour['FDP'], tumour['DP']) >= 0.4):
+        filters.add(tasks.FILTER_ID_BASE)
+
+    if (_get_fraction(normal['SDP'], normal['DP'] + normal['SDP']) > 0.75) or \
+       (_get_fraction(tumour['SDP'], tumour['DP'] + tumour['SDP']) > 0.75):
+        filters.add(tasks.FILTER_ID_SPANNING_DELETION)
+
+    if (record.info['NT'] != 'ref') or (record.info['QSS_NT'] < 15):
+        filters.add(tasks.FILTER_ID_QSS)
+
+    return filters
+
+
+def _get_indel_filters(record, window_row, max_normal_coverage):
+    ''' Filters of an indel record, following the previous record by record implementation.
+    '''
+    filters = set()
+
+    if record.samples['NORMAL']['DP'] > max_normal_coverage:
+        filters.add(tasks.FILTER_ID_DEPTH)
+
+    if record.info.get('RC', 0) > 8:
+        filters.add(tasks.FILTER_ID_REPEAT)
+
+    if record.info.get('IHP', 0) > 14:
+        filters.add(tasks.FILTER_ID_INDEL_HPOL)
+
+    normal_fraction = _get_fraction(window_row[1], window_row[0] + window_row[1])
+
+    tumour_fraction = _get_fraction(window_row[4], window_row[3] + window_row[4])
+
+    if (normal_fraction >= 0.3) or (tumour_fraction >= 0.3):
+        filters.add(tasks.FILTER_ID_BASE)
+
+    if (record.info['NT'] != 'ref') or (record.info['QSI_NT'] < 30):
+        filters.add(tasks.FILTER_ID_QSI)
+
+    return filters
+
+
+def _read_records(in_files):
+    records = []
+
+    for key in sorted(in_files):
+        with pysam.VariantFile(in_files[key]) as reader:
+            records.extend(list(reader))
+
+    return records
+
+
+def _read_window_rows(window_files):
+    rows = {}
+
+    for file_name in window_files.values():
+        with open(file_name) as fh:
+            for line in fh:
+                if line.startswith('#'):
+                    continue
+
+                values = line.rstrip('\n').split('\t')
+
+                rows[(values[0], int(values[1]))] = [float(x) for x in values[2:]]
+
+    return rows
+
+
+def _get_filters(record):
+    filters = set(record.filter.keys())
+
+    filters.discard('PASS')
+
+    return filters
+
+
+@pytest.mark.parametrize('batch_size', [1, 7, int(1e4)])
+def test_filter_snv_file_list(tmpdir, stats_files, batch_size):
+    in_files = _write_snv_files(tmpdir, random.Random(3))
+
+    out_file = str(tmpdir.join('out.vcf.gz'))
+
+    tasks.filter_snv_file_list(in_files, stats_files, out_file, '1', known_chrom_size, batch_size=batch_size)
+
+    in_records = _read_records(in_files)
+
+    with pysam.VariantFile(out_file) as reader:
+        for filter_id in (tasks.FILTER_ID_DEPTH, tasks.FILTER_ID_BASE, tasks.FILTER_ID_SPANNING_DELETION,
+                          tasks.FILTER_ID_QSS):
+            assert filter_id in reader.header.filters
+
+        out_records = list(reader)
+
+    assert [(x.chrom, x.pos) for x in out_records] == [(x.chrom, x.pos) for x in in_records]
+
+    for in_record, out_record in zip(in_records, out_records):
+        assert _get_filters(out_record) == _get_snv_filters(in_record, _get_max_normal_coverage())
+
+    assert any([len(_get_filters(x)) == 0 for x in out_records])
+
+
+def test_filter_snv_file_list_without_depth_filter(tmpdir, stats_files):
+    in_files = _write_snv_files(tmpdir, random.Random(3))
+
+    out_file = str(tmpdir.join('out.vcf.gz'))
+
+    tasks.filter_snv_file_list(in_files, stats_files, out_file, '1', known_chrom_size, use_depth_filter=False)
+
+    with pysam.VariantFile(out_file) as reader:
+        assert tasks.FILTER_ID_DEPTH not in reader.header.filters
+
+        for record, in_record in zip(reader, _read_records(in_files)):
+            expected = _get_snv_filters(in_record, _get_max_normal_coverage())
+
+            expected.discard(tasks.FILTER_ID_DEPTH)
+
+            assert _get_filters(record) == expected
+
+
+@pytest.mark.parametrize('batch_size', [1, 7, int(1e4)])
+def test_filter_indel_file_list(tmpdir, stats_files, batch_size):
+    in_files, window_files = _write_indel_files(tmpdir, random.Random(4))
+
+    out_file = str(tmpdir.join('out.vcf.gz'))
+
+    tasks.filter_indel_file_list(
+        in_files, stats_files, window_files, out_file, '1', known_chrom_size, batch_size=batch_size)
+
+    in_records = _read_records(in_files)
+
+    window_rows = _read_window_rows(window_files)
+
+    with pysam.VariantFile(out_file) as reader:
+        out_records = list(reader)
+
+    assert [(x.chrom, x.pos) for x in out_records] == [(x.chrom, x.pos) for x in in_records]
+
+    for in_record, out_record in zip(in_records, out_records):
+        window_row = window_rows[(in_record.chrom, in_record.pos)]
+
+        expected = _get_indel_filters(in_record, window_row, _get_max_normal_coverage())
+
+        assert _get_filters(out_record) == expected
+
+        for sample, offset in (('NORMAL', 0), ('TUMOR', 3)):
+            data = out_record.samples[sample]
+
+            assert data['DP50'] == pytest.approx(window_row[offset] + window_row[offset + 1])
+
+            assert data['FDP50'] == pytest.approx(window_row[offset + 1])
+
+            assert data['SUBDP50'] == pytest.approx(window_row[offset + 2])
+
+
+def test_filter_indel_file_list_missing_window(tmpdir, stats_files):
+    in_files, window_files = _write_indel_files(tmpdir, random.Random(4))
+
+    with open(window_files[1], 'w') as fh:
+        fh.write('#CHROM\tPOS\tNU\tNF\tNS\tTU\tTF\tTS\n')
+
+    with pytest.raises(Exception):
+        tasks.filter_indel_file_list(
+            in_files, stats_files, window_files, str(tmpdir.join('out.vcf.gz')), '1', known_chrom_size)
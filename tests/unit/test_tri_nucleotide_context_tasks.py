@@ -0,0 +1,69 @@
+import pandas as pd
+import pysam
+import pytest
+import random
+
+from biowrappers.components.variant_calling.tri_nucleotide_context import tasks
+
+contig_lengths = {'1': 500, '2': 3}
+
+
+@pytest.fixture
+def input_files(tmpdir):
+    rng = random.Random(9)
+
+    fasta_file = str(tmpdir.join('ref.fa'))
+
+    sequences = {}
+
+    with open(fasta_file, 'w') as fh:
+        for chrom, length in sorted(contig_lengths.items()):
+            sequences[chrom] = ''.join([rng.choice('ACGTacgtN') for _ in range(length)])
+
+            fh.write('>{0} description\n'.format(chrom))
+
+            for idx in range(0, length, 60):
+                fh.write(sequences[chrom][idx:idx + 60] + '\n')
+
+    pysam.faidx(fasta_file)
+
+    vcf_file = str(tmpdir.join('in.vcf'))
+
+    with open(vcf_file, 'w') as fh:
+        fh.write('##fileformat=VCFv4.1\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n')
+
+        # Includes the first and last position of each contig
+        for chrom, coords in (('1', [1, 2] + sorted(rng.sample(range(3, 500), 50)) + [500]), ('2', [1, 2, 3])):
+            for coord in coords:
+                fh.write('{0}\t{1}\t.\t{2}\tT\t.\tPASS\t.\n'.format(chrom, coord, sequences[chrom][coord - 1]))
+
+    return fasta_file, vcf_file, sequences
+
+
+def _get_expected(vcf_file, sequences):
+    data = []
+
+    for record in pysam.VariantFile(vcf_file):
+        seq = sequences[record.chrom]
+
+        data.append((record.chrom, record.pos, seq[max(record.pos - 2, 0):record.pos + 1]))
+
+    return data
+
+
+@pytest.mark.parametrize('use_store', [False, True])
+def test_get_tri_nucleotide_context(tmpdir, input_files, use_store):
+    fasta_file, vcf_file, sequences = input_files
+
+    ref_store_file = str(tmpdir.join('ref.seq')) if use_store else None
+
+    out_file = str(tmpdir.join('out.csv'))
+
+    tasks.get_tri_nucelotide_context(fasta_file, vcf_file, out_file, 'tri_nucleotide_context',
+                                     ref_store_file=ref_store_file)
+
+    df = pd.read_csv(out_file, dtype={'chrom': str})
+
+    assert list(zip(df['chrom'], df['coord'], df['tri_nucleotide_context'])) == _get_expected(vcf_file, sequences)
+
+    assert tmpdir.join('ref.seq').check() == use_store
@@ -0,0 +1,133 @@
+import pandas as pd
+import pysam
+import pytest
+import random
+
+from biowrappers.components.io.vcf import tasks
+
+header = '''##fileformat=VCFv4.1
+##contig=<ID=1,length=10000>
+##contig=<ID=2,length=10000>
+##contig=<ID=10,length=10000>
+#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO
+'''
+
+columns = ['chrom', 'coord', 'ref', 'alt', 'score']
+
+
+@pytest.fixture
+def vcf_file(tmpdir):
+    rng = random.Random(7)
+
+    file_name = str(tmpdir.join('in.vcf'))
+
+    with open(file_name, 'w') as fh:
+        fh.write(header)
+
+        # Later chromosomes and alleles sort before earlier ones
+        for chrom in ('2', '10', '1'):
+            for coord in sorted(rng.sample(range(1, 1000), 30)):
+                ref = rng.choice(['T', 'G', 'CA', 'ACGT'])
+
+                alts = rng.sample(['T', 'C', 'GG', 'A'], rng.randint(1, 2))
+
+                qual = rng.choice(['.', str(rng.randint(0, 100))])
+
+                fh.write('{0}\t{1}\t.\t{2}\t{3}\t{4}\tPASS\t.\n'.format(chrom, coord, ref, ','.join(alts), qual))
+
+    return file_name
+
+
+def _read_vcf(file_name):
+    data = []
+
+    for record in pysam.VariantFile(file_name):
+        for alt in record.alts:
+            data.append({
+                'chrom': record.chrom,
+                'coord': record.pos,
+                'ref': record.ref,
+                'alt': alt,
+                'score': record.qual if record.qual is not None else float('nan'),
+            })
+
+    return pd.DataFrame(data, columns=columns)
+
+
+@pytest.mark.parametrize('chunk_size', [7, 50, int(1e5)])
+def test_convert_vcf_to_hdf5(tmpdir, vcf_file, chunk_size):
+    out_file = str(tmpdir.join('out.h5'))
+
+    tasks.convert_vcf_to_hdf5(vcf_file, out_file, 'variants', chunk_size=chunk_size)
+
+    with pd.HDFStore(out_file, 'r') as store:
+        df = store['variants']
+
+    expected = _read_vcf(vcf_file)
+
+    assert list(df.index) == list(range(expected.shape[0]))
+
+    for col in ('chrom', 'ref', 'alt'):
+        assert list(df[col].cat.categories) == sorted(expected[col].unique())
+
+        df[col] = df[col].astype(str)
+
+    pd.testing.assert_frame_equal(df, expected, check_dtype=False)
+
+    # Temporary store is removed
+    assert tmpdir.listdir(lambda x: x.isdir()) == []
+
+
+def test_convert_vcf_to_hdf5_empty(tmpdir):
+    vcf_file = str(tmpdir.join('in.vcf'))
+
+    with open(vcf_file, 'w') as fh:
+        fh.write(header)
+
+    out_file = str(tmpdir.join('out.h5'))
+
+    tasks.convert_vcf_to_hdf5(vcf_file, out_file, 'variants')
+
+    with pd.HDFStore(out_file, 'r') as store:
+        assert store.keys() == []
+
+
+def test_convert_vcf_to_csv(tmpdir, vcf_file):
+    out_file = str(tmpdir.join('out.csv'))
+
+    tasks.convert_vcf_to_csv(vcf_file, out_file)
+
+    df = pd.read_csv(out_file, dtype={'chrom': str})
+
+    pd.testing.assert_frame_equal(df, _read_vcf(vcf_file), check_dtype=False)
+
+
+@pytest.mark.parametrize('lines_per_group,files_per_group', [(50, 3), (1000, 4), (7, 10)])
+def test_split_vcf_groups(tmpdir, vcf_file, lines_per_group, files_per_group):
+    def out_files(group_idx, file_idx):
+        file_name = str(tmpdir.join('split_{0}_{1}.vcf'.format(group_idx, file_idx)))
+
+        split_files[(group_idx, file_idx)] = file_name
+
+        return file_name
+
+    split_files = {}
+
+    tasks.split_vcf_groups(vcf_file, out_files, lines_per_group, files_per_group)
+
+    records = []
+
+    for group_idx in sorted(set([x[0] for x in split_files])):
+        group_records = []
+
+        for key in sorted(split_files):
+            if key[0] == group_idx:
+                group_records.extend([str(x) for x in pysam.VariantFile(split_files[key])])
+
+        assert len(group_records) <= lines_per_group
+
+        records.extend(group_records)
+
+    assert max([x[1] for x in split_files]) < files_per_group
+
+    assert records == [str(x) for x in pysam.VariantFile(vcf_file)]